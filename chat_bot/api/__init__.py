@@ -1,5 +1,7 @@
 import fastapi
 
+from .batch import batch_router
+from .health import health_router
 from .ws import websocket_router
 
 
@@ -11,5 +13,7 @@ def apply_routers(app: fastapi.FastAPI):
     router = fastapi.APIRouter()
 
     router.include_router(router=websocket_router)
+    router.include_router(router=health_router)
+    router.include_router(router=batch_router)
 
     app.include_router(router)
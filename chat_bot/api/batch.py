@@ -0,0 +1,35 @@
+import json
+from collections.abc import AsyncIterator
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from chat_bot.core.config import settings
+from chat_bot.tools import BatchProcessor
+
+batch_router = APIRouter(tags=["Batch"])
+
+
+@batch_router.post("/batch")
+async def batch_endpoint(request: Request, skip_cache: bool = False) -> StreamingResponse:
+    """
+    Answer a JSONL document of questions, one `{"question", "resource", "language"}` object per line.
+
+    The answers are streamed back as JSONL in completion order, each result carrying the `index`
+    of its line. Answers generated by the LLM are stored in the cache collection, so this endpoint
+    also pre-warms the cache. `skip_cache` answers every question with the LLM.
+    """
+    body = (await request.body()).decode()
+    processor = BatchProcessor(
+        request.app.state.clients,
+        openai_key=request.user.openai_key,
+        concurrency=settings.BATCH_CONCURRENCY,
+        batch_size=settings.BATCH_SIZE,
+        skip_cache=skip_cache,
+    )
+
+    async def results() -> AsyncIterator[str]:
+        async for result in processor.run(body.splitlines()):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from chat_bot.core.db_setup import BootstrapStatus
+
+health_router = APIRouter(tags=["Health"])
+
+
+@health_router.get("/readyz")
+async def readyz(request: Request) -> JSONResponse:
+    """
+    Readiness probe. Answers 200 once the knowledge base bootstrap has finished, 503 with its progress before.
+    """
+    status: BootstrapStatus = request.app.state.bootstrap
+    return JSONResponse(status.as_dict(), status_code=200 if status.ready else 503)
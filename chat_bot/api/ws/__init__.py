@@ -1,63 +1,190 @@
+import json
 import logging
+import uuid
+from functools import partial
 
-from fastapi import APIRouter, WebSocket
+from fastapi import APIRouter, WebSocket, status
 from starlette.websockets import WebSocketDisconnect
 
 from chat_bot.core.config import settings
-from chat_bot.tools import LLM, EmbeddingModel, PipeLine, Qdrant
+from chat_bot.tools import ClientRegistry, ContextBuilder, PipeLine, StreamBuffer
+from chat_bot.tools.chat_pipeline import EventType
+
+from .session import WebSocketSession
 
 websocket_router = APIRouter(tags=["Socket"])
 
 logger = logging.getLogger("chatbot")
 
 
+class AudioUploadError(ValueError):
+    def __init__(self, message: str, close_code: int | None = None):
+        """
+        An audio upload sent as binary frames was rejected.
+
+        Args:
+            message (str): The reason sent to the client.
+            close_code (int | None, optional): The code the connection is closed with, if the frames of
+                the upload cannot be told apart from the next messages. Defaults to keeping it open.
+        """
+        super().__init__(message)
+        self.close_code = close_code
+
+
+async def receive_audio(websocket: WebSocket, size: int) -> bytearray:
+    """
+    Receive an audio upload sent as binary frames into a single preallocated buffer.
+
+    Args:
+        websocket (WebSocket): The WebSocket connection.
+        size (int): The size of the upload in bytes, announced in the message header.
+
+    Returns:
+        bytearray: The raw audio bytes.
+
+    Raises:
+        AudioUploadError: If the size is invalid, or a frame is not binary or exceeds the announced size.
+            Uploads larger than `WS_MAX_AUDIO_BYTES` and frames exceeding the announced size close
+            the connection, since the frames still on their way would be read as new messages.
+    """
+    if size <= 0:
+        raise AudioUploadError("Audio size must be positive")
+    if size > settings.WS_MAX_AUDIO_BYTES:
+        raise AudioUploadError(f"Audio size exceeds {settings.WS_MAX_AUDIO_BYTES} bytes", close_code=status.WS_1009_MESSAGE_TOO_BIG)
+    audio = bytearray(size)
+    view = memoryview(audio)
+    received = 0
+    while received < size:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        frame = message.get("bytes")
+        if frame is None:
+            # The client gave the upload up, its remaining frames are rejected by the receive loop
+            raise AudioUploadError("Expected a binary audio frame")
+        if received + len(frame) > size:
+            raise AudioUploadError("Audio frames exceed the announced size", close_code=status.WS_1009_MESSAGE_TOO_BIG)
+        view[received : received + len(frame)] = frame
+        received += len(frame)
+    return audio
+
+
 @websocket_router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket) -> None:
     """
     This endpoint is for establishing a WebSocket connection.
     The client will send audio or text messages to this endpoint.
     The messages will be processed by an LLM and the response will be sent back to the client.
+
+    Messages are processed concurrently, up to `WS_MAX_CONCURRENT_MESSAGES` per connection.
+    Messages arriving while `WS_MAX_PENDING_MESSAGES` transactions are queued or in flight
+    are rejected with an exception event.
+    Every event of a transaction carries its `transaction_id`, taken from the message payload
+    or generated, so clients can demultiplex the responses. A message sent with the
+    `transaction_id` of a running transaction, or listing it in `supersedes`, cancels it.
+    A `stop_generation` message cancels the transaction named in its payload, or every
+    transaction of the connection if none is given.
+
+    Audio is sent either base64 encoded in the `data` of an `audio_message`, or as raw bytes:
+    the `audio_message` then carries the size of the upload in `audio_bytes`, and the audio
+    follows in as many binary frames as the client likes. An upload larger than
+    `WS_MAX_AUDIO_BYTES`, or frames exceeding the announced size, close the connection with
+    code 1009. Binary frames that do not belong to an upload are answered with an exception event.
     """
     logger.info("[New Connection] User: %s", websocket.user.user_name)
+    clients: ClientRegistry = websocket.app.state.clients
+    session = WebSocketSession(max_concurrency=settings.WS_MAX_CONCURRENT_MESSAGES, max_pending=settings.WS_MAX_PENDING_MESSAGES)
     await websocket.accept()
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None:
+                # Binary frames are only read as the audio announced by an audio_message
+                await websocket.send_json({"type": EventType.EXCEPTION, "payload": {"data": "Unexpected binary frame"}})
+                continue
+            data = json.loads(message["text"])
+            if data["type"] == "stop_generation":
+                # Stop the requested generation, or all of them
+                stop_id = data.get("payload", {}).get("transaction_id")
+                for transaction_id in [stop_id] if stop_id else session.active:
+                    session.cancel(transaction_id)
+                continue
+
             resource = data["payload"].get("document", False)
 
             chat_message_id = data["payload"].get("point_id", None)
             skip_cache = data["payload"].get("re_generate", False)
             suggested_question = data["payload"].get("suggested_question", False)
+            transaction_id = data["payload"].get("transaction_id") or uuid.uuid4().hex
+            superseded = data["payload"].get("supersedes", [])
 
             action_type = data["type"]
-            voice_text = data["payload"]["data"] if action_type == "audio_message" else ""
+            voice_text: str | bytearray = data["payload"].get("data", "") if action_type == "audio_message" else ""
+            if action_type == "audio_message" and "audio_bytes" in data["payload"]:
+                try:
+                    voice_text = await receive_audio(websocket, int(data["payload"]["audio_bytes"]))
+                except ValueError as e:
+                    await websocket.send_json(
+                        {"type": EventType.EXCEPTION, "payload": {"data": f"Invalid audio upload: {e}"}, "transaction_id": transaction_id}
+                    )
+                    if isinstance(e, AudioUploadError) and e.close_code is not None:
+                        await websocket.close(code=e.close_code)
+                        return
+                    continue
             text_msg = data["payload"]["data"] if action_type == "text_message" else ""
             response_language = data["payload"].get("response_language", "english")
 
+            # Cancel the in-flight generations the client superseded
+            for superseded_id in [superseded] if isinstance(superseded, str) else superseded:
+                session.cancel(superseded_id)
+
+            if not session.accepts(transaction_id):
+                # Bound the pipelines, and the audio they hold, a single connection can queue up
+                await websocket.send_json(
+                    {
+                        "type": EventType.EXCEPTION,
+                        "payload": {"data": f"Too many pending messages, at most {session.max_pending} are processed at once"},
+                        "transaction_id": transaction_id,
+                    }
+                )
+                continue
+
             try:
                 # Process the message and send the response back to the client
                 openai_key = websocket.user.openai_key
-                await PipeLine(
-                    llm_model=LLM(model=settings.OPENAI_BASE_MODEL, temperature=0, openai_key=openai_key),
-                    embedding_model=EmbeddingModel(model=settings.OPENAI_EMBEDDING_BASE_MODEL, openai_key=openai_key),
-                    vector_store=Qdrant(
-                        cache_collection=settings.QDRANT_CACHE_COLLECTION,
-                        main_collection=settings.QDRANT_MAIN_COLLECTION,
-                        search_limit=settings.QDRANT_SEARCH_LIMIT,
-                        cache_hit_score=settings.QDRANT_CACHE_SCORE,
-                    ),
+                pipeline = PipeLine(
+                    llm_model=clients.llm(model=settings.OPENAI_BASE_MODEL, temperature=0, openai_key=openai_key),
+                    embedding_model=clients.embedding_model(model=settings.OPENAI_EMBEDDING_BASE_MODEL, openai_key=openai_key),
+                    vector_store=clients.vector_store(),
                     chat_message_id=chat_message_id,
                     websocket=websocket,
                     audio_data=voice_text,
                     text_data=text_msg,
                     suggested_question=suggested_question,
                     skip_cache=skip_cache,
+                    speculative_search=settings.QDRANT_SPECULATIVE_SEARCH,
                     resource=resource,
                     response_language=response_language,
-                ).run()
+                    transaction_id=transaction_id,
+                    stream_buffer=StreamBuffer(
+                        interval=settings.STREAM_FLUSH_INTERVAL_MS / 1000,
+                        max_chars=settings.STREAM_FLUSH_CHARS,
+                        on_sentence=settings.STREAM_FLUSH_ON_SENTENCE,
+                    ),
+                    context_builder=ContextBuilder(model=settings.OPENAI_BASE_MODEL, token_budget=settings.CONTEXT_TOKEN_BUDGET),
+                    background=websocket.app.state.background,
+                    cache_manager=clients.cache_manager(),
+                    on_offload=partial(session.attach, transaction_id),
+                )
             except Exception:  # pragma: no cover
                 # If an exception occurs, continue to the next iteration
                 continue
+            session.submit(transaction_id, pipeline.run())
     except WebSocketDisconnect:  # pragma: no cover
         # If the client disconnects, log a warning message
         logger.warning("[Disconnected] User: %s", websocket.user.user_name)
+    finally:
+        # Nobody is listening anymore, stop the transactions of this connection
+        await session.close()
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from collections.abc import Coroutine
+from functools import partial
+from typing import Any
+
+logger = logging.getLogger("chatbot")
+
+
+class WebSocketSession:
+    def __init__(self, max_concurrency: int, max_pending: int | None = None):
+        """
+        Schedule the transactions of a single WebSocket connection as concurrent tasks.
+
+        The receive loop keeps reading messages while earlier transactions are still streaming,
+        so a new question or a `re_generate` is not blocked behind the previous answer.
+
+        Args:
+            max_concurrency (int): Maximum number of transactions processed at the same time.
+                Further transactions wait for a free slot.
+            max_pending (int | None, optional): Maximum number of transactions queued or in flight,
+                see `accepts`. Defaults to `max_concurrency`.
+        """
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.max_pending = max_pending or max_concurrency
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+        # Background jobs a transaction handed over, see `attach`
+        self._jobs: dict[str, asyncio.Task[None]] = {}
+
+    @property
+    def active(self) -> list[str]:
+        """
+        Transaction IDs that are queued or in flight.
+        """
+        return list(self._tasks)
+
+    def accepts(self, transaction_id: str) -> bool:
+        """
+        Whether a transaction can be submitted: fewer than `max_pending` are queued or in flight,
+        or it supersedes a running transaction with the same ID.
+
+        Args:
+            transaction_id (str): The correlation ID of the transaction.
+        """
+        return transaction_id in self._tasks or len(self._tasks) < self.max_pending
+
+    def submit(self, transaction_id: str, coroutine: Coroutine[Any, Any, None]) -> asyncio.Task[None]:
+        """
+        Schedule a transaction. A transaction still running under the same ID is superseded and cancelled.
+
+        Args:
+            transaction_id (str): The correlation ID of the transaction.
+            coroutine (Coroutine): The transaction to run.
+
+        Returns:
+            asyncio.Task: The scheduled task.
+        """
+        self.cancel(transaction_id)
+        task = asyncio.create_task(self._run(transaction_id, coroutine), name=f"transaction-{transaction_id}")
+        self._tasks[transaction_id] = task
+        task.add_done_callback(partial(self._release, transaction_id, coroutine))
+        return task
+
+    def attach(self, transaction_id: str, task: asyncio.Task[None]) -> None:
+        """
+        Tie a background job of a transaction to the session, so stopping the transaction or closing
+        the session also cancels the job. The job does not count towards `max_pending`.
+
+        Args:
+            transaction_id (str): The correlation ID of the transaction.
+            task (asyncio.Task): The task of the job.
+        """
+        self._jobs[transaction_id] = task
+        task.add_done_callback(partial(self._detach, transaction_id))
+
+    def _detach(self, transaction_id: str, task: asyncio.Task[None]) -> None:
+        if self._jobs.get(transaction_id) is task:
+            del self._jobs[transaction_id]
+
+    def _release(self, transaction_id: str, coroutine: Coroutine[Any, Any, None], task: asyncio.Task[None]) -> None:
+        # Close the coroutine in case the task was cancelled before it started
+        coroutine.close()
+        # A superseding transaction may already have taken the ID over
+        if self._tasks.get(transaction_id) is task:
+            del self._tasks[transaction_id]
+
+    async def _run(self, transaction_id: str, coroutine: Coroutine[Any, Any, None]) -> None:
+        try:
+            async with self._slots:
+                await coroutine
+        except asyncio.CancelledError:
+            logger.info("[Cancelled] Transaction: %s", transaction_id)
+            raise
+        except Exception:  # pragma: no cover
+            logger.exception("[Failed] Transaction: %s", transaction_id)
+
+    def cancel(self, transaction_id: str) -> bool:
+        """
+        Cancel a queued or in-flight transaction and its background job.
+
+        Args:
+            transaction_id (str): The correlation ID of the transaction.
+
+        Returns:
+            bool: True if a transaction was cancelled.
+        """
+        cancelled = False
+        for task in (self._tasks.pop(transaction_id, None), self._jobs.pop(transaction_id, None)):
+            if task is not None and not task.done():
+                task.cancel()
+                cancelled = True
+        return cancelled
+
+    async def close(self) -> None:
+        """
+        Cancel every remaining transaction and background job and wait for them to finish.
+        """
+        tasks = [*self._tasks.values(), *self._jobs.values()]
+        self._tasks.clear()
+        self._jobs.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -19,15 +19,39 @@ class Settings(BaseSettings):
     APP_LOG_LEVEL: Literal["critical", "error", "info", "debug"] = "debug"
     ENVIRONMENT: Literal["local", "platform", "production"] = "local"
     WS_MAX_QUEUE: int = 100
+    WS_MAX_CONCURRENT_MESSAGES: int = 2
+    WS_MAX_PENDING_MESSAGES: int = 8
+    WS_MAX_AUDIO_BYTES: int = 25 * 1024 * 1024
+    STREAM_FLUSH_INTERVAL_MS: int = 50
+    STREAM_FLUSH_CHARS: int = 80
+    STREAM_FLUSH_ON_SENTENCE: bool = True
+    POST_ANSWER_CONCURRENCY: int = 16
+    POST_ANSWER_ATTEMPTS: int = 3
+    SHUTDOWN_DRAIN_TIMEOUT: float = 10.0
+    BATCH_CONCURRENCY: int = 8
+    BATCH_SIZE: int = 64
     WORKERS: int = 1
     OPENAI_API_KEY: str = ""
     OPENAI_BASE_MODEL: str = "gpt-4o-mini"
     OPENAI_EMBEDDING_BASE_MODEL: str = "text-embedding-ada-002"
     EMBEDDING_DIMENSION: int = 1536
+    EMBEDDING_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    EMBEDDING_CACHE_TTL: int = 3600
+    EMBEDDING_DISK_CACHE_PATH: str | None = None
+    EMBEDDING_DISK_CACHE_MAX_ROWS: int = Field(default=100_000, ge=1)
+    EMBEDDING_BATCH_WINDOW_MS: int = 5
+    EMBEDDING_BATCH_SIZE: int = 64
+    TRANSCRIPTION_CACHE_MAX_BYTES: int = 4 * 1024 * 1024
+    TRANSCRIPTION_CACHE_TTL: int = 86400
+    TRANSCRIPTION_DISK_CACHE_PATH: str | None = None
+    TRANSCRIPTION_SEGMENT_SECONDS: float = Field(default=20, ge=1)
+    TRANSCRIPTION_CONCURRENCY: int = 4
     JWT_SECRET_KEY: str = (
         "35678eb97d529e5502c0db50da70e4304ba9361296e91e718e176ba861eb6cdfe2e99b907e52a9e353354a609f9e7e6b6b73cb9907f84aa84bacf29816f14a77"
     )
     JWT_ALGORITHM: str = "HS256"
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL: int = 300
     QDRANT_CLOUD: bool = Field(default_factory=lambda: check_env("QDRANT_CLOUD"))
     QDRANT_URL: str = "https://qdrant.mypits.org"
     QDRANT_TLS: bool = Field(default_factory=lambda: check_env("QDRANT_TLS"))
@@ -35,8 +59,49 @@ class Settings(BaseSettings):
     QDRANT_MAIN_COLLECTION: str = "360inControl"
     QDRANT_CACHE_COLLECTION: str = "llm_cache"
     QDRANT_SEARCH_LIMIT: int = 10
+    QDRANT_SEARCH_SCORE: float | None = None
+    CONTEXT_TOKEN_BUDGET: int = 3000
     QDRANT_CACHE_SCORE: float = 0.8
+    QDRANT_SPECULATIVE_SEARCH: bool = True
+    QDRANT_WRITE_BEHIND_SIZE: int = 64
+    QDRANT_WRITE_BEHIND_INTERVAL_MS: int = 500
+    SEMANTIC_CACHE_CAPACITY: int = 1024
+    SEMANTIC_CACHE_TTL: int = 3600
+    SEMANTIC_CACHE_MAX_SCOPES: int = 64
+    SEMANTIC_CACHE_SHARED_TTL: int = 30
+    SEMANTIC_CACHE_VERIFY: bool = False
+    EXACT_CACHE_CAPACITY: int = 10000
+    CACHE_MAX_POINTS_PER_RESOURCE: int = 10000
+    CACHE_POINT_TTL: int = 30 * 24 * 3600
+    CACHE_COMPACTION_INTERVAL: int = 3600
+    QDRANT_LOCAL_PATH: str | None = None
+    QDRANT_LOCAL_SEED_PATH: str | None = None
+    NUMPY_RETRIEVER: bool = False
+    NUMPY_INDEX_PATH: str | None = None
+    QDRANT_BOOTSTRAP: bool = True
+    QDRANT_SNAPSHOT_CHUNK_SIZE: int = 1024 * 1024
+    QDRANT_MAIN_INDEX_FIELDS: list[str] = ["metadata.resource"]
+    QDRANT_QUANTIZATION: Literal["none", "scalar", "binary"] = "none"
+    QDRANT_QUANTIZATION_ALWAYS_RAM: bool = True
+    QDRANT_SEARCH_OVERSAMPLING: float = 2.0
+    QDRANT_ON_DISK_VECTORS: bool = False
+    QDRANT_HNSW_M: int | None = None
+    QDRANT_HNSW_EF_CONSTRUCT: int | None = None
+    QDRANT_HNSW_EF: int | None = None
     FORWARDED_ALLOW_IPS: list[str] | str = "*"
+    CLIENT_POOL_MAX_KEYS: int = 256
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 100
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+
+    @model_validator(mode="after")
+    def check_local_mode(self) -> Self:
+        """
+        The storage directory of the local mode is locked by the process that opens it, so it cannot be shared
+        by several workers. The in-memory store of each worker can.
+        """
+        if self.QDRANT_LOCAL_PATH and self.QDRANT_LOCAL_PATH != ":memory:" and self.WORKERS > 1:
+            raise ValueError("QDRANT_LOCAL_PATH storage directory cannot be shared by WORKERS > 1, use :memory: or a single worker")
+        return self
 
 
 class ProductionSettings(Settings):
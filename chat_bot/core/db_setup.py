@@ -1,43 +1,438 @@
+import asyncio
+import itertools
+import json
+import logging
+import tempfile
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import IO, Any, Literal
 
-from qdrant_client import QdrantClient, models
-from tenacity import retry, stop_after_attempt, wait_random
+import httpx
+from qdrant_client import AsyncQdrantClient, models
+from qdrant_client.http.exceptions import UnexpectedResponse
+from tenacity import AsyncRetrying, stop_after_attempt, wait_random
 
 from chat_bot.core.config import settings
+from chat_bot.tools.retriever import make_client
 
+logger = logging.getLogger("chatbot")
 
-@retry(stop=stop_after_attempt(3), wait=wait_random(min=3, max=10))
-def setup_knowledge_base() -> None:  # pragma: no cover
+SNAPSHOT_PATH = Path(__file__).parent.parent / "db_snapshot/360inControl.snapshot"
+# Serializes the bootstrap of the uvicorn workers of a host
+BOOTSTRAP_LOCK_PATH = Path(tempfile.gettempdir()) / "chatbot-bootstrap.lock"
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows, where the workers are not serialized and rely on the idempotent setup alone
+    fcntl = None  # type: ignore[assignment]
+
+# Payload fields every cache lookup filters on, see `PipeLine.cache_filter`
+CACHE_SCOPE_FIELDS = ("metadata.resource", "metadata.response_language", "metadata.model", "metadata.prompt_version")
+
+
+def quantization_config() -> models.ScalarQuantization | models.BinaryQuantization | None:
     """
-    This function is called by the FastAPI Application as a startup event.
-    It checks if the Qdrant collection exists, if not, it creates it.
-    It also creates a payload index for the "resource_type" field in the collection.
+    The quantization configured by `QDRANT_QUANTIZATION`, or None if it is disabled.
     """
-    vector_db = QdrantClient(
-        https=True,
-        url=settings.QDRANT_URL,
-        port=None,
-        api_key=settings.QDRANT_API_KEY if settings.QDRANT_CLOUD or settings.QDRANT_TLS else None,
-        verify=False,
-    )
+    always_ram = settings.QDRANT_QUANTIZATION_ALWAYS_RAM
+    if settings.QDRANT_QUANTIZATION == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=always_ram),
+        )
+    if settings.QDRANT_QUANTIZATION == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    return None
+
+
+def collection_update(config: models.CollectionConfig) -> dict[str, Any]:
+    """
+    Compare the storage configuration of a collection with the settings.
+
+    Only the differences are returned, so an already provisioned collection is not re-indexed on every start.
+
+    Args:
+        config (models.CollectionConfig): The current configuration of the collection.
+
+    Returns:
+        dict[str, Any]: Keyword arguments of `update_collection`, empty if the collection is up to date.
+    """
+    update: dict[str, Any] = {}
+
+    hnsw = {"m": settings.QDRANT_HNSW_M, "ef_construct": settings.QDRANT_HNSW_EF_CONSTRUCT}
+    hnsw = {field: value for field, value in hnsw.items() if value is not None and value != getattr(config.hnsw_config, field)}
+    if hnsw:
+        update["hnsw_config"] = models.HnswConfigDiff(**hnsw)
+
+    # The collections use a single unnamed vector, named vectors are tuned one by one
+    vectors = config.params.vectors
+    named_vectors = vectors if isinstance(vectors, dict) else {"": vectors}
+    on_disk = {
+        name: models.VectorParamsDiff(on_disk=settings.QDRANT_ON_DISK_VECTORS)
+        for name, params in named_vectors.items()
+        if params is not None and bool(params.on_disk) != settings.QDRANT_ON_DISK_VECTORS
+    }
+    if on_disk:
+        update["vectors_config"] = on_disk
+
+    quantization = quantization_config()
+    if quantization != config.quantization_config:
+        update["quantization_config"] = quantization or models.Disabled.DISABLED
+    return update
+
+
+class BootstrapStatus:
+    def __init__(self):
+        """
+        Progress of the knowledge base bootstrap, reported by the readiness endpoint.
+        """
+        self.state: Literal["pending", "running", "ready", "failed"] = "pending"
+        self.step: str = ""
+        self.attempt: int = 0
+        self.error: str | None = None
+        self.uploaded_bytes: int = 0
+        self.snapshot_bytes: int = 0
+        self.copied_points: int = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "step": self.step,
+            "attempt": self.attempt,
+            "error": self.error,
+            "uploaded_bytes": self.uploaded_bytes,
+            "snapshot_bytes": self.snapshot_bytes,
+            "copied_points": self.copied_points,
+        }
+
+
+async def snapshot_chunks(path: Path, status: BootstrapStatus, chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    Read the snapshot in chunks in a worker thread, so neither the file nor the event loop is held up.
+
+    Args:
+        path (Path): The snapshot file.
+        status (BootstrapStatus): Progress of the upload.
+        chunk_size (int): Bytes read per chunk.
+
+    Yields:
+        bytes: The next chunk of the snapshot.
+    """
+    snapshot = await asyncio.to_thread(path.open, "rb")
+    try:
+        while chunk := await asyncio.to_thread(snapshot.read, chunk_size):
+            status.uploaded_bytes += len(chunk)
+            yield chunk
+    finally:
+        snapshot.close()
+
+
+async def upload_snapshot(
+    collection_name: str, path: Path, status: BootstrapStatus, transport: httpx.AsyncBaseTransport | None = None
+) -> None:
+    """
+    Recover a collection by streaming a snapshot to the Qdrant upload API as a multipart body.
+
+    Args:
+        collection_name (str): Name of the collection to recover.
+        path (Path): The snapshot file.
+        status (BootstrapStatus): Progress of the upload.
+        transport (httpx.AsyncBaseTransport | None, optional): Transport of the HTTP client. Defaults to the network.
+
+    Raises:
+        httpx.HTTPStatusError: If Qdrant rejected the snapshot.
+    """
+    boundary = uuid.uuid4().hex
+    opening = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="snapshot"; filename="{path.name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    status.snapshot_bytes = path.stat().st_size
+    status.uploaded_bytes = 0
+
+    async def body() -> AsyncIterator[bytes]:
+        yield opening
+        async for chunk in snapshot_chunks(path, status, settings.QDRANT_SNAPSHOT_CHUNK_SIZE):
+            yield chunk
+        yield closing
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(opening) + status.snapshot_bytes + len(closing)),
+    }
+    if settings.QDRANT_CLOUD or settings.QDRANT_TLS:
+        headers["api-key"] = settings.QDRANT_API_KEY or ""
+    # The recovery only answers once the collection is loaded, which may take minutes
+    async with httpx.AsyncClient(verify=False, timeout=httpx.Timeout(30, read=None, write=None), transport=transport) as http:
+        response = await http.post(
+            f"{settings.QDRANT_URL.rstrip('/')}/collections/{collection_name}/snapshots/upload",
+            params={"priority": "snapshot", "wait": "true"},
+            headers=headers,
+            content=body(),
+        )
+        response.raise_for_status()
+
+
+async def copy_collection(
+    source: AsyncQdrantClient, target: AsyncQdrantClient, collection_name: str, status: BootstrapStatus, batch_size: int = 256
+) -> None:
+    """
+    Copy a collection with its vectors and payloads, e.g. from the Qdrant server into the local mode.
+
+    Args:
+        source (AsyncQdrantClient): The client holding the collection.
+        target (AsyncQdrantClient): The client the collection is created in.
+        collection_name (str): Name of the collection.
+        status (BootstrapStatus): Progress of the copy.
+        batch_size (int, optional): Number of points read and written per request. Defaults to 256.
+    """
+    info = await source.get_collection(collection_name=collection_name)
+    await target.create_collection(collection_name=collection_name, vectors_config=info.config.params.vectors)
+    status.copied_points = 0
+    offset = None
+    while True:
+        records, offset = await source.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if records:
+            points = [models.PointStruct(id=record.id, vector=record.vector, payload=record.payload) for record in records]
+            await target.upsert(collection_name=collection_name, points=points)
+            status.copied_points += len(points)
+        if offset is None:
+            break
+
 
+async def export_collection(source: AsyncQdrantClient, collection_name: str, path: Path, batch_size: int = 256) -> int:
+    """
+    Export a collection with its vectors and payloads as JSONL.
+
+    The local mode loads the export without a server, see `QDRANT_LOCAL_SEED_PATH`. The first
+    line holds the vector configuration of the collection, every following line one point.
+
+    Args:
+        source (AsyncQdrantClient): The client holding the collection.
+        collection_name (str): Name of the collection.
+        path (Path): The JSONL file written.
+        batch_size (int, optional): Number of points read per request. Defaults to 256.
+
+    Returns:
+        int: The number of exported points.
+    """
+    info = await source.get_collection(collection_name=collection_name)
+    exported = 0
+    with path.open("w") as export:
+        header = {"vectors": models.VectorParams.model_validate(info.config.params.vectors).model_dump(mode="json")}
+        await asyncio.to_thread(export.write, json.dumps(header) + "\n")
+        offset = None
+        while True:
+            records, offset = await source.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            lines = "".join(json.dumps({"id": record.id, "vector": record.vector, "payload": record.payload}) + "\n" for record in records)
+            await asyncio.to_thread(export.write, lines)
+            exported += len(records)
+            if offset is None:
+                break
+    return exported
+
+
+def read_lines(source: IO[str], count: int) -> list[str]:
+    return list(itertools.islice(source, count))
+
+
+async def load_collection(
+    target: AsyncQdrantClient, collection_name: str, path: Path, status: BootstrapStatus, batch_size: int = 256
+) -> None:
+    """
+    Create a collection from a JSONL export, see `export_collection`.
+
+    The file is read in batches from a worker thread, so the event loop keeps serving.
+
+    Args:
+        target (AsyncQdrantClient): The client the collection is created in.
+        collection_name (str): Name of the collection.
+        path (Path): The JSONL export.
+        status (BootstrapStatus): Progress of the load.
+        batch_size (int, optional): Number of points written per request. Defaults to 256.
+    """
+    status.copied_points = 0
+    with path.open() as export:
+        header = json.loads((await asyncio.to_thread(read_lines, export, 1))[0])
+        await target.create_collection(collection_name=collection_name, vectors_config=models.VectorParams(**header["vectors"]))
+        while lines := await asyncio.to_thread(read_lines, export, batch_size):
+            points = [models.PointStruct(**json.loads(line)) for line in lines if line.strip()]
+            await target.upsert(collection_name=collection_name, points=points)
+            status.copied_points += len(points)
+
+
+async def provision_collection(vector_db: AsyncQdrantClient, collection_name: str, index_fields: tuple[str, ...] | list[str]) -> None:
+    """
+    Create the missing keyword payload indexes of a collection and apply the configured vector storage tuning.
+
+    Args:
+        vector_db (AsyncQdrantClient): The Qdrant client.
+        collection_name (str): Name of the collection.
+        index_fields (tuple[str, ...] | list[str]): Payload fields the searches filter on.
+    """
+    info = await vector_db.get_collection(collection_name=collection_name)
+    for field_name in index_fields:
+        if field_name not in info.payload_schema:
+            await vector_db.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_type="keyword",
+            )
+    update = collection_update(info.config)
+    if update:
+        await vector_db.update_collection(collection_name=collection_name, **update)
+
+
+async def setup_knowledge_base(vector_db: AsyncQdrantClient, status: BootstrapStatus) -> None:
+    """
+    Check if the Qdrant collections exist, if not, recover the main collection from the snapshot
+    and create the cache collection.
+
+    It also creates the payload indexes of the fields the searches filter on and applies the
+    configured quantization, on-disk storage and HNSW parameters to both collections.
+
+    The local mode cannot recover snapshots: it loads the main collection from the JSONL export
+    at `QDRANT_LOCAL_SEED_PATH`, which needs no server, or else copies it from the Qdrant server.
+
+    The setup is idempotent: a collection another worker created in the meantime counts as created.
+
+    Args:
+        vector_db (AsyncQdrantClient): The Qdrant client.
+        status (BootstrapStatus): Progress of the bootstrap.
+    """
     cache_collection = settings.QDRANT_CACHE_COLLECTION
     main_collection = settings.QDRANT_MAIN_COLLECTION
 
     # Check if the collection exists, if not, create it
-    if not vector_db.collection_exists(collection_name=main_collection):
-        # If the collection does not exist, try to recover it from a snapshot
-        with open(Path(__file__).parent.parent / "db_snapshot/360inControl.snapshot", "rb") as snapshot:
-            vector_db.http.snapshots_api.recover_from_uploaded_snapshot(collection_name=main_collection, snapshot=snapshot)
-    if not vector_db.collection_exists(collection_name=cache_collection):
+    status.step = "main_collection"
+    if not await vector_db.collection_exists(collection_name=main_collection):
+        if settings.QDRANT_LOCAL_PATH and settings.QDRANT_LOCAL_SEED_PATH:
+            status.step = "seed_load"
+            await load_collection(vector_db, main_collection, Path(settings.QDRANT_LOCAL_SEED_PATH), status)
+        elif settings.QDRANT_LOCAL_PATH:
+            # The local mode cannot recover snapshots, copy the collection from the server restored from it instead
+            status.step = "server_copy"
+            server = make_client(local_path=None)
+            try:
+                await copy_collection(server, vector_db, main_collection, status)
+            finally:
+                await server.close()
+        else:
+            # If the collection does not exist, recover it from the snapshot
+            status.step = "snapshot_upload"
+            await upload_snapshot(main_collection, SNAPSHOT_PATH, status)
+    status.step = "cache_collection"
+    if not await vector_db.collection_exists(collection_name=cache_collection):
         # If the cache collection does not exist, create it
-        vector_db.create_collection(
-            collection_name=cache_collection,
-            vectors_config=models.VectorParams(size=settings.EMBEDDING_DIMENSION, distance=models.Distance.COSINE),
-        )
-        # Create a payload index for the "resource_type" field in the collection
-        vector_db.create_payload_index(
-            collection_name=cache_collection,
-            field_name="metadata.resource",
-            field_type="keyword",
-        )
+        try:
+            await vector_db.create_collection(
+                collection_name=cache_collection,
+                vectors_config=models.VectorParams(size=settings.EMBEDDING_DIMENSION, distance=models.Distance.COSINE),
+            )
+        except UnexpectedResponse as e:
+            # Another host created it in the meantime
+            if e.status_code != 409:
+                raise
+            logger.info("[Bootstrap] %s was created by another worker", cache_collection)
+    if settings.QDRANT_LOCAL_PATH:
+        # Payload indexes, quantization and HNSW parameters have no effect in the local mode
+        return
+    # Provision existing collections as well, so configuration changes apply on the next start
+    status.step = "provisioning"
+    await provision_collection(vector_db, main_collection, settings.QDRANT_MAIN_INDEX_FIELDS)
+    await provision_collection(vector_db, cache_collection, CACHE_SCOPE_FIELDS)
+
+
+@asynccontextmanager
+async def bootstrap_lock(path: Path, poll_interval: float = 0.5) -> AsyncIterator[None]:
+    """
+    Hold an exclusive lock on a file, shared by every worker process of the host.
+
+    The lock is polled without blocking, so the event loop keeps serving and a cancelled bootstrap
+    stops waiting at once. The lock is released when the file is closed, also if the worker dies.
+
+    Args:
+        path (Path): The lock file, created if missing.
+        poll_interval (float, optional): Seconds between two attempts to take the lock. Defaults to 0.5.
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    lock_file = await asyncio.to_thread(path.open, "a")
+    try:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        yield
+    finally:
+        lock_file.close()
+
+
+async def bootstrap(
+    vector_db: AsyncQdrantClient,
+    status: BootstrapStatus,
+    attempts: int = 3,
+    lock_path: Path = BOOTSTRAP_LOCK_PATH,
+    provision: bool = True,
+    warmup: Callable[[], Awaitable[None]] | None = None,
+) -> None:
+    """
+    Set up the knowledge base in the background of the FastAPI lifespan, retrying failed attempts.
+
+    The application accepts connections meanwhile, and the readiness endpoint reports the progress
+    so orchestrators only route traffic once the collections are usable. Every uvicorn worker runs
+    the bootstrap, so they take turns on a lock file: the first one restores the collections and the
+    others find them in place.
+
+    Args:
+        vector_db (AsyncQdrantClient): The Qdrant client.
+        status (BootstrapStatus): Progress of the bootstrap.
+        attempts (int, optional): Number of attempts before the bootstrap is given up. Defaults to 3.
+        lock_path (Path, optional): The lock file shared by the workers of the host.
+        provision (bool, optional): Whether to set the collections up. Defaults to True.
+        warmup (Callable[[], Awaitable[None]] | None, optional): Loads what the worker needs to answer
+            the first question at full speed, e.g. the NumPy index, once the collections are set up.
+    """
+    status.state = "running"
+    try:
+        async for attempt in AsyncRetrying(stop=stop_after_attempt(attempts), wait=wait_random(min=3, max=10), reraise=True):
+            with attempt:
+                status.attempt = attempt.retry_state.attempt_number
+                if provision:
+                    status.step = "waiting_for_lock"
+                    async with bootstrap_lock(lock_path):
+                        await setup_knowledge_base(vector_db, status)
+                if warmup is not None:
+                    status.step = "warmup"
+                    await warmup()
+    except Exception as e:
+        logger.exception("[Bootstrap] Knowledge base setup failed")
+        status.state = "failed"
+        status.error = f"{e.__class__.__name__}: {e}"
+        return
+    status.state = "ready"
+    status.step = ""
+    logger.info("[Bootstrap] Knowledge base ready")
@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import time
 
 from fastapi.middleware import Middleware
 from jwt.exceptions import PyJWTError
@@ -6,14 +8,75 @@ from starlette.authentication import AuthenticationBackend
 from starlette.middleware.authentication import AuthenticationMiddleware
 from starlette.requests import HTTPConnection
 
-from .security import User, decode_jwt
+from chat_bot.tools.lru import LRUCache
+
+from .config import settings
+from .security import User, decode_claims, user_details
 
 logger = logging.getLogger("chatbot")
 
 
+class TokenCache:
+    def __init__(self, capacity: int, time_to_live: float):
+        """
+        Initialize the cache of verified tokens.
+
+        Maps the SHA-256 digest of a token to the user it was verified for, so a client reconnecting
+        with the same token skips the signature check, the payload decryption and the user validation.
+        An entry is kept until the least recently used one is evicted, for at most `time_to_live`
+        seconds, and not past the `exp` claim of a token that has not expired yet. Tokens accepted
+        although they expired are kept for `time_to_live` seconds.
+
+        Args:
+            capacity (int): Maximum number of tokens kept.
+            time_to_live (float): Seconds after which a token is verified again.
+        """
+        self.capacity = capacity
+        self.time_to_live = time_to_live
+        self._entries: LRUCache[str, User] = LRUCache(capacity, time_to_live)
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> User | None:
+        """
+        Get the user of a verified token and count the hit or miss.
+
+        Args:
+            token (str): The encoded JWT token.
+
+        Returns:
+            User | None: The user, or None if the token is not cached or its entry expired.
+        """
+        return self._entries.get(self.digest(token))
+
+    def put(self, token: str, user: User, expires_at: float | None = None) -> None:
+        """
+        Store the user of a verified token, evicting the least recently used token if the cache is full.
+
+        Args:
+            token (str): The encoded JWT token.
+            user (User): The user the token was verified for.
+            expires_at (float | None, optional): The `exp` claim of the token, as a UNIX timestamp.
+                Ignored if it already passed, since expired tokens are accepted.
+        """
+        remaining = expires_at - time.time() if expires_at is not None else None
+        # Expired tokens are still accepted, so only a token that has not expired yet is verified again at its expiry
+        self._entries.put(self.digest(token), user, time_to_live=remaining if remaining is not None and remaining > 0 else None)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Hit and miss counters and the number of cached tokens.
+        """
+        return {"hits": self._entries.hits, "misses": self._entries.misses, "entries": len(self._entries)}
+
+
 class AuthBackend(AuthenticationBackend):
-    def __init__(self, white_list_apis: list[str] | None = None):
+    def __init__(self, white_list_apis: list[str] | None = None, token_cache: TokenCache | None = None):
         self.white_list_apis = white_list_apis or []
+        self.token_cache = token_cache
 
     @staticmethod
     def get_token(conn: HTTPConnection) -> str | None:
@@ -51,14 +114,23 @@ class AuthBackend(AuthenticationBackend):
             # Raise an exception if the token is None
             raise RuntimeError("Invalid Token")
 
+        # A reconnecting client usually sends a token that was verified before
+        current_user = self.token_cache.get(token) if self.token_cache is not None else None
+        if current_user is not None:
+            return True, current_user
+
         try:
             # Decode the token and get the user's information
-            payload = decode_jwt(token, allow_expired=True)
-            current_user = User(**payload)
+            claims = decode_claims(token, allow_expired=True)
+            current_user = User(**user_details(claims))
         except PyJWTError as e:  # pragma: no cover
             # Raise an exception if the token validation fails
             raise RuntimeError("Token validation failed") from e
 
+        if self.token_cache is not None:
+            expires_at = claims.get("exp")
+            self.token_cache.put(token, current_user, expires_at=expires_at if isinstance(expires_at, int | float) else None)
+
         # Return a tuple containing a boolean indicating whether the authentication was
         # successful and a User object containing the user's information
         return True, current_user
@@ -74,7 +146,12 @@ def make_middleware() -> list[Middleware]:
         Middleware(
             # Use the AuthenticationMiddleware with the AuthBackend
             AuthenticationMiddleware,
-            backend=AuthBackend(white_list_apis=["/", "/docs", "/redoc", "/openapi.json", "/favicon.ico", "/static/workflow.png"]),
+            backend=AuthBackend(
+                white_list_apis=["/", "/docs", "/redoc", "/openapi.json", "/favicon.ico", "/static/workflow.png", "/readyz"],
+                token_cache=TokenCache(capacity=settings.AUTH_CACHE_SIZE, time_to_live=settings.AUTH_CACHE_TTL)
+                if settings.AUTH_CACHE_SIZE > 0
+                else None,
+            ),
         ),
     ]
     # Return the list of middleware
@@ -18,19 +18,19 @@ class User(BaseModel):
     openai_key: str | None = Field(default_factory=lambda: settings.OPENAI_API_KEY)
 
 
-def decode_jwt(
+def decode_claims(
     encoded_token: str,
     allow_expired: bool = False,
 ) -> dict[str, Any]:
     """
-    Decode an encoded JWT token into a dictionary of user details.
+    Verify an encoded JWT token and return its claims.
 
     Args:
         encoded_token (str): The encoded JWT token to decode.
         allow_expired (bool, optional): Whether to allow an expired token to be decoded. Defaults to False.
 
     Returns:
-        dict[str, Any]: The decoded JWT token as a dictionary.
+        dict[str, Any]: The claims of the token, with the user details as they were encoded.
     """
     options = {}
     if allow_expired:  # pragma: no cover
@@ -45,9 +45,39 @@ def decode_jwt(
         algorithms=[settings.JWT_ALGORITHM],
         options=options,
     )
-    ctx = decoded_token["user_details"]
+    return decoded_token
+
+
+def user_details(claims: dict[str, Any]) -> dict[str, Any]:
+    """
+    Get the user details of verified token claims, decrypting them if payload encryption is enabled.
+
+    Args:
+        claims (dict[str, Any]): The claims returned by `decode_claims`.
+
+    Returns:
+        dict[str, Any]: The user details.
+    """
+    ctx = claims["user_details"]
     if settings.PAYLOAD_ENCRYPTION and isinstance(ctx, str):  # pragma: no cover
         # If payload encryption is enabled, decrypt the user details
         ctx_text = encryption_layer.decrypt(ctx.encode()).decode()
         ctx = json.loads(ctx_text)
     return ctx  # type: ignore[no-any-return]
+
+
+def decode_jwt(
+    encoded_token: str,
+    allow_expired: bool = False,
+) -> dict[str, Any]:
+    """
+    Decode an encoded JWT token into a dictionary of user details.
+
+    Args:
+        encoded_token (str): The encoded JWT token to decode.
+        allow_expired (bool, optional): Whether to allow an expired token to be decoded. Defaults to False.
+
+    Returns:
+        dict[str, Any]: The decoded JWT token as a dictionary.
+    """
+    return user_details(decode_claims(encoded_token, allow_expired=allow_expired))
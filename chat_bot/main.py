@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 from pathlib import Path
@@ -8,7 +9,7 @@ import uvicorn
 sys.path.extend([str(Path(__file__).parent.parent)])  # don't change the import order
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "--environment",
     type=click.Choice(["local", "production"], case_sensitive=False),
@@ -26,12 +27,14 @@ sys.path.extend([str(Path(__file__).parent.parent)])  # don't change the import
     default=False,
     help="Enable debug mode, which will make the application run slower.",
 )
-def main(environment: str, debug: bool):  # pragma: no cover
+@click.pass_context
+def main(ctx: click.Context, environment: str, debug: bool):  # pragma: no cover
     """
     Run the ChatBot application.
 
-    This function sets up the environment variables from the command line arguments,
-    sets up the knowledge base and runs the application with uvicorn.
+    This function sets up the environment variables from the command line arguments
+    and runs the application with uvicorn, unless a maintenance command is given.
+    The knowledge base is set up by the application lifespan.
 
     :param environment: The environment to run the application in.
     :type environment: str
@@ -41,13 +44,13 @@ def main(environment: str, debug: bool):  # pragma: no cover
     # Set environment variables
     os.environ["ENVIRONMENT"] = environment
     os.environ["DEBUG"] = str(debug)
+    if ctx.invoked_subcommand is not None:
+        return
 
     # Get configuration from environment variables
     from chat_bot.core.config import get_config  # noqa:E402
-    from chat_bot.core.db_setup import setup_knowledge_base  # noqa:E402
 
     config = get_config(environment)
-    setup_knowledge_base()
     # Run application
     uvicorn.run(
         app="chat_bot.server:app",
@@ -63,5 +66,76 @@ def main(environment: str, debug: bool):  # pragma: no cover
     )
 
 
+@main.command("compact-cache")
+def compact_cache():  # pragma: no cover
+    """
+    Flush the cache hits and remove expired and least used points from the cache collection.
+    """
+    from chat_bot.tools import ClientRegistry  # noqa:E402
+
+    async def compact() -> dict[str, int]:
+        clients = ClientRegistry()
+        try:
+            return await clients.cache_manager().compact()
+        finally:
+            await clients.aclose()
+
+    click.echo(asyncio.run(compact()))
+
+
+@main.command("export-collection")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+def export_collection(path: str):  # pragma: no cover
+    """
+    Export the main collection of the Qdrant server as JSONL, for QDRANT_LOCAL_SEED_PATH.
+    """
+    from chat_bot.core import db_setup  # noqa:E402
+    from chat_bot.core.config import settings  # noqa:E402
+    from chat_bot.tools.retriever import make_client  # noqa:E402
+
+    async def export() -> int:
+        client = make_client(local_path=None)
+        try:
+            return await db_setup.export_collection(client, settings.QDRANT_MAIN_COLLECTION, Path(path))
+        finally:
+            await client.close()
+
+    click.echo(f"{asyncio.run(export())} points exported")
+
+
+@main.command("batch")
+@click.argument("questions", type=click.File("r"))
+@click.argument("answers", type=click.File("w"))
+@click.option("--openai-key", default=None, help="OpenAI API key, defaults to OPENAI_API_KEY.")
+@click.option("--skip-cache", is_flag=True, default=False, help="Answer every question with the LLM.")
+def batch(questions, answers, openai_key: str | None, skip_cache: bool):  # pragma: no cover
+    """
+    Answer a JSONL file of {"question", "resource", "language"} objects and write the answers as JSONL.
+
+    The answers are stored in the cache collection, so this also pre-warms the cache.
+    """
+    import json  # noqa:E402
+
+    from chat_bot.core.config import settings  # noqa:E402
+    from chat_bot.tools import BatchProcessor, ClientRegistry  # noqa:E402
+
+    async def answer_all() -> None:
+        clients = ClientRegistry()
+        try:
+            processor = BatchProcessor(
+                clients,
+                openai_key=openai_key or settings.OPENAI_API_KEY,
+                concurrency=settings.BATCH_CONCURRENCY,
+                batch_size=settings.BATCH_SIZE,
+                skip_cache=skip_cache,
+            )
+            async for result in processor.run(questions):
+                answers.write(json.dumps(result) + "\n")
+        finally:
+            await clients.aclose()
+
+    asyncio.run(answer_all())
+
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -8,7 +11,11 @@ from fastapi.staticfiles import StaticFiles
 from chat_bot.api import apply_routers
 from chat_bot.core.audit_log import setup_logger
 from chat_bot.core.config import get_config
+from chat_bot.core.db_setup import BootstrapStatus, bootstrap
 from chat_bot.core.middleware import make_middleware
+from chat_bot.tools import ClientRegistry, NumpyRetriever, TaskSupervisor
+from chat_bot.tools.cache_manager import COMPACTION_LOCK_PATH
+from chat_bot.tools.context import load_encoding
 
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.DEBUG)
@@ -55,6 +62,46 @@ Welcome to the documentation for our advanced Chatbot! This Chatbot is designed
 """
 
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    """
+    Create the process-wide client registry and background task supervisor and start the knowledge
+    base bootstrap, the tokenizer and index warmup and the cache compaction on startup, drain the
+    background tasks and close the clients on shutdown.
+    """
+    config = get_config(os.getenv("ENVIRONMENT", "local"))
+    _app.state.clients = ClientRegistry()
+    _app.state.background = TaskSupervisor(max_concurrency=config.POST_ANSWER_CONCURRENCY, attempts=config.POST_ANSWER_ATTEMPTS)
+    logger.info(" [✔] Client registry initialized")
+    _app.state.bootstrap = BootstrapStatus()
+    vector_store = _app.state.clients.vector_store()
+
+    async def warmup() -> None:
+        # tiktoken may download the BPE file, which must not block the event loop
+        await asyncio.to_thread(load_encoding, config.OPENAI_BASE_MODEL)
+        # The NumPy index is loaded before the worker reports ready, not on the first question
+        if isinstance(vector_store, NumpyRetriever):
+            await vector_store.load()
+
+    # Without QDRANT_BOOTSTRAP the collections are managed outside the application
+    setup = asyncio.create_task(bootstrap(vector_store.client, _app.state.bootstrap, provision=config.QDRANT_BOOTSTRAP, warmup=warmup))
+    compaction = (
+        asyncio.create_task(_app.state.clients.cache_manager().run(config.CACHE_COMPACTION_INTERVAL, COMPACTION_LOCK_PATH))
+        if config.CACHE_COMPACTION_INTERVAL > 0
+        else None
+    )
+    try:
+        yield
+    finally:
+        for task in (setup, compaction):
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        await _app.state.background.drain(timeout=config.SHUTDOWN_DRAIN_TIMEOUT)
+        await _app.state.clients.aclose()
+
+
 def create_app() -> FastAPI:
     """Create a FastAPI application from the given configuration."""
     config = get_config(os.getenv("ENVIRONMENT", "local"))
@@ -65,6 +112,7 @@ def create_app() -> FastAPI:
         version="1.0.0",
         docs_url="/",
         middleware=make_middleware(),
+        lifespan=lifespan,
     )
     _app.mount("/static", StaticFiles(directory=Path(__file__).parent.parent / "static"), name="static")
     logger.info(" [✔] Application initialized")
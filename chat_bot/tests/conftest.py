@@ -1,8 +1,14 @@
+import os
+
 import jwt
 import pytest
 
 from datetime import UTC, datetime, timedelta
 from fastapi.testclient import TestClient
+
+# The tests mock Qdrant, the knowledge base bootstrap is enabled by the tests that cover it
+os.environ.setdefault("QDRANT_BOOTSTRAP", "false")
+
 from chat_bot.core.config import settings
 from chat_bot.server import app
 
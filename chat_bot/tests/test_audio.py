@@ -0,0 +1,95 @@
+import asyncio
+import io
+import wave
+from unittest import mock
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from chat_bot.tools.audio import split_wav
+from chat_bot.tools.llm import LLM
+
+RATE = 16000
+
+
+def make_wav(*parts: tuple[float, bool]) -> bytes:
+    """
+    Build a mono 16-bit WAV recording of (seconds, speech) parts, speech being a loud tone and the rest silence.
+    """
+    samples = []
+    for seconds, speech in parts:
+        time = np.arange(int(seconds * RATE)) / RATE
+        samples.append((np.sin(2 * np.pi * 440 * time) * 10000 if speech else np.zeros_like(time)).astype(np.int16))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(RATE)
+        writer.writeframes(np.concatenate(samples).tobytes())
+    return buffer.getvalue()
+
+
+def read_wav(audio: bytes) -> np.ndarray:
+    with wave.open(io.BytesIO(audio)) as reader:
+        return np.frombuffer(reader.readframes(reader.getnframes()), dtype=np.int16)
+
+
+def test_split_wav():
+    """
+    Long recordings are cut in the pauses into WAV segments holding every sample; short or non-WAV audio is kept whole.
+    """
+    audio = make_wav((1.5, True), (0.5, False), (1.0, True), (0.6, False), (1.2, True))
+    segments = split_wav(audio, segment_seconds=2.5)
+
+    assert len(segments) == 3
+    assert np.array_equal(np.concatenate([read_wav(segment) for segment in segments]), read_wav(audio))
+    # Every cut falls in a pause: the segments start and end with silence
+    for segment in segments[1:]:
+        assert not read_wav(segment)[:100].any()
+
+    assert split_wav(audio, segment_seconds=10) == [audio]
+    assert split_wav(b"OggS-MOCK-AUDIO", segment_seconds=2.5) == [b"OggS-MOCK-AUDIO"]
+
+
+def test_split_wav_tiny_segments():
+    """
+    Segments shorter than a frame are cut one frame long instead of looping forever or failing.
+    """
+    audio = make_wav((0.3, True))
+    segments = split_wav(audio, segment_seconds=0.01)
+
+    assert len(segments) == 10
+    assert np.array_equal(np.concatenate([read_wav(segment) for segment in segments]), read_wav(audio))
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.AsyncOpenAI")
+async def test_segmented_transcription(openai_whisper_mock: MagicMock):
+    """
+    Segments are transcribed concurrently, the text is stitched in order and partial texts are reported in order.
+    """
+    texts = iter(["first part.", "second part.", "third part."])
+
+    async def create(model: str, file: tuple[str, bytes]) -> MagicMock:
+        text = next(texts)
+        # The first segment is the slowest one
+        await asyncio.sleep(0.05 if text == "first part." else 0.01)
+        return MagicMock(text=f" {text} ")
+
+    openai_whisper_mock.return_value = MagicMock(audio=MagicMock(transcriptions=MagicMock(create=create)))
+    llm = LLM(model="gpt-4o-mini", openai_key="sk-1234567890", segment_seconds=2.5, transcription_concurrency=3)
+    partials: list[str] = []
+
+    async def on_partial(text: str) -> None:
+        partials.append(text)
+
+    audio = make_wav((1.5, True), (0.5, False), (1.0, True), (0.6, False), (1.2, True))
+    assert await llm.audio_transcription(audio, on_partial=on_partial) == "first part. second part. third part."
+    assert partials == []
+
+    # Without a pause the recording is still split, and earlier segments are reported once they are done
+    texts = iter(["first part.", "second part."])
+    with mock.patch.object(llm, "_transcription_slots", asyncio.Semaphore(1)):
+        assert await llm.audio_transcription(make_wav((3, True)), on_partial=on_partial) == "first part. second part."
+    assert partials == ["first part."]
@@ -0,0 +1,30 @@
+from unittest import mock
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from tenacity import wait_none
+
+from chat_bot.tools import TaskSupervisor
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.background.wait_random", return_value=wait_none())
+async def test_task_supervisor(wait_mock: MagicMock):
+    """
+    Background steps are retried on failure, except when the client disconnected, and drained on shutdown.
+    """
+    supervisor = TaskSupervisor(max_concurrency=1, attempts=3)
+    step = AsyncMock(side_effect=[RuntimeError("upsert failed"), None])
+    disconnected = AsyncMock(side_effect=WebSocketDisconnect())
+
+    async def job():
+        await supervisor.retrying(step)
+        with pytest.raises(WebSocketDisconnect):
+            await supervisor.retrying(disconnected)
+
+    supervisor.spawn("post-answer", job)
+    await supervisor.drain(timeout=1)
+
+    assert step.call_count == 2
+    assert disconnected.call_count == 1
@@ -0,0 +1,73 @@
+import json
+from unittest import mock
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+from qdrant_client import models
+from qdrant_client.conversions import common_types as types
+
+from chat_bot.core.config import settings
+
+
+def scored_point(point_id: str, payload: dict) -> models.ScoredPoint:
+    return models.ScoredPoint(id=point_id, version=0, score=0.95, payload=payload)
+
+
+@mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.retrieve")
+@mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.upsert")
+@mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.query_batch_points")
+@mock.patch("chat_bot.tools.llm.OpenAIEmbeddings.aembed_documents")
+@mock.patch("chat_bot.tools.llm.ChatOpenAI.ainvoke")
+@mock.patch("chat_bot.tools.llm.ChatOpenAI.astream")
+def test_batch_endpoint(
+    openai_stream_mock: MagicMock,
+    openai_ainvoke_mock: MagicMock,
+    openai_embedding_mock: MagicMock,
+    qdrant_batch_mock: MagicMock,
+    qdrant_upsert_mock: MagicMock,
+    _qdrant_retrieve_mock: MagicMock,
+    client: TestClient,
+    jwt_token: str,
+):
+    """
+    Questions are embedded and searched in batches, answered from the cache or the LLM, and streamed back as JSONL.
+    """
+
+    async def astream(*args, **kwargs):
+        yield "LLM-ANSWER"
+
+    openai_stream_mock.side_effect = astream
+    openai_ainvoke_mock.return_value = "1. question 1?\n2. question 2?"
+    openai_embedding_mock.return_value = [[0.1, 0.2], [0.3, 0.4]]
+    cached = scored_point("739af4ef1f9f4c34a3b4fced617c92b2", {"llm_response": "CACHED-ANSWER", "metadata": {"suggested_questions": []}})
+    context = scored_point("1b4e28ba2fa1411d9c4a5e0c0f5c8e01", {"metadata": {"page_number": 1}, "page_content": "MOCK_QDRANT_RESPONSE"})
+
+    def query_batch_points(collection_name: str, requests: list[models.QueryRequest]) -> list[types.QueryResponse]:
+        if collection_name == settings.QDRANT_CACHE_COLLECTION:
+            return [types.QueryResponse(points=[cached]), types.QueryResponse(points=[])]
+        return [types.QueryResponse(points=[context]) for _ in requests]
+
+    qdrant_batch_mock.side_effect = query_batch_points
+    questions = "\n".join(
+        [
+            json.dumps({"question": "explain admin module", "resource": "admin_guide"}),
+            json.dumps({"question": "how are roles assigned", "resource": "admin_guide", "language": "german"}),
+            "not json",
+        ]
+    )
+
+    with client:
+        response = client.post(f"/batch?token={jwt_token}", content=questions)
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda result: result["index"])
+
+    assert response.status_code == 200
+    assert [result.get("answer") for result in results] == ["CACHED-ANSWER", "LLM-ANSWER", None]
+    assert [result.get("cached") for result in results] == [True, False, None]
+    assert results[1]["suggested_questions"] == ["question 1?", "question 2?"]
+    assert results[1]["point_id"] and results[1]["error"] is None
+    assert results[2]["error"].startswith("Invalid line")
+    openai_embedding_mock.assert_called_once_with(["explain admin module", "how are roles assigned"])
+    # The LLM answer reached the cache collection through the write-behind buffer on shutdown
+    stored = qdrant_upsert_mock.call_args.kwargs["points"][0]
+    assert stored.payload["llm_response"] == "LLM-ANSWER"
+    assert stored.payload["metadata"]["response_language"] == "german"
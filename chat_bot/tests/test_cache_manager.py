@@ -0,0 +1,192 @@
+import asyncio
+import uuid
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+from qdrant_client import models
+
+from chat_bot.tools import PipeLine
+from chat_bot.tools.cache_manager import CacheManager
+from chat_bot.tools.retriever import Qdrant, make_client
+from chat_bot.tools.semantic_cache import ExactMatchCache, SemanticCache
+
+
+def cache_point(point_id: str, resource: str, created_at: float | None, hit_count: int = 0) -> models.Record:
+    metadata = {"resource": resource, "hit_count": hit_count, "last_hit_at": None}
+    if created_at is not None:
+        metadata["created_at"] = created_at
+    return models.Record(id=point_id, payload={"metadata": metadata})
+
+
+@pytest.fixture
+def vector_store() -> Qdrant:
+    store = Qdrant(cache_collection="llm_cache", main_collection="main", search_limit=5, cache_hit_score=0.9)
+    store.client = mock.MagicMock(
+        scroll=AsyncMock(),
+        retrieve=AsyncMock(),
+        batch_update_points=AsyncMock(),
+        set_payload=AsyncMock(),
+        delete=AsyncMock(),
+    )
+    return store
+
+
+@pytest.mark.asyncio
+async def test_cache_compaction(vector_store: Qdrant):
+    """
+    Expired points are removed, the least used points of a full resource are evicted and unstamped points are stamped.
+    """
+    vector_store.client.scroll.side_effect = [
+        ([cache_point("expired", "admin_guide", 0), cache_point("popular", "admin_guide", 900, hit_count=5)], "next"),
+        ([cache_point("unused", "admin_guide", 950), cache_point("legacy", "user_guide", None)], None),
+    ]
+    manager = CacheManager(vector_store, max_points=1, time_to_live=500)
+
+    with mock.patch("chat_bot.tools.cache_manager.time.time", return_value=1000):
+        assert await manager.compact() == {"expired": 1, "evicted": 1, "kept": 2}
+
+    deleted = vector_store.client.delete.call_args.kwargs["points_selector"].points
+    assert deleted == ["expired", "unused"]
+    assert vector_store.client.set_payload.call_args.kwargs["points"] == ["legacy"]
+
+
+@pytest.mark.asyncio
+async def test_single_worker_compaction(vector_store: Qdrant, tmp_path):
+    """
+    Every worker flushes its hits, but only the one holding the compaction lock compacts, until it stops.
+    """
+    managers = [CacheManager(vector_store, max_points=1, time_to_live=500) for _ in range(2)]
+    for manager in managers:
+        manager.flush_hits = AsyncMock()
+        manager.compact = AsyncMock(return_value={})
+    tasks = [asyncio.create_task(manager.run(0.01, tmp_path / "compaction.lock")) for manager in managers]
+    await asyncio.sleep(0.1)
+    assert all(manager.flush_hits.await_count > 1 for manager in managers)
+    leader, follower = sorted(managers, key=lambda manager: manager.compact.await_count, reverse=True)
+    assert leader.compact.await_count > 1
+    assert follower.compact.await_count == 0
+
+    tasks[managers.index(leader)].cancel()
+    await asyncio.sleep(0.1)
+    assert follower.compact.await_count > 0
+    tasks[managers.index(follower)].cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_cache_hits(vector_store: Qdrant):
+    """
+    Hits are counted in memory and added to the stored hit count, writing only the counter fields.
+    """
+    vector_store.client.retrieve.return_value = [cache_point("point-1", "admin_guide", 0, hit_count=2)]
+    manager = CacheManager(vector_store, max_points=0, time_to_live=0)
+
+    with mock.patch("chat_bot.tools.cache_manager.time.time", return_value=1000):
+        manager.record_hit("point-1")
+        manager.record_hit("point-1")
+    await manager.flush_hits()
+    await manager.flush_hits()
+
+    vector_store.client.retrieve.assert_called_once()
+    vector_store.client.batch_update_points.assert_not_called()
+    vector_store.client.set_payload.assert_awaited_once()
+    kwargs = vector_store.client.set_payload.call_args.kwargs
+    assert kwargs["key"] == "metadata"
+    assert kwargs["payload"] == {"hit_count": 4, "last_hit_at": 1000}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_hit_flush():
+    """
+    Two workers flushing hits of the same point keep the other metadata fields, but may lose hits.
+    """
+    client = make_client(local_path=":memory:")
+    await client.create_collection("llm_cache", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    metadata = {"resource": "admin_guide", "hit_count": 0}
+    point_id = str(uuid.uuid4())
+    await client.upsert("llm_cache", points=[models.PointStruct(id=point_id, vector=[1.0, 0.0], payload={"metadata": metadata})])
+    store = Qdrant(cache_collection="llm_cache", main_collection="main", search_limit=5, cache_hit_score=0.9, client=client)
+    workers = [CacheManager(store, max_points=0, time_to_live=0) for _ in range(2)]
+    for worker in workers:
+        worker.record_hit(point_id)
+
+    await asyncio.gather(*(worker.flush_hits() for worker in workers))
+
+    stored = (await client.retrieve("llm_cache", ids=[point_id]))[0].payload["metadata"]
+    assert stored["resource"] == "admin_guide"
+    # Both workers read a count of 0, one hit is lost
+    assert stored["hit_count"] in (1, 2)
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_dashed_point_ids(vector_store: Qdrant):
+    """
+    Qdrant returns UUIDs in the dashed form, hits and evictions still match the points the tiers hold in hex form.
+    """
+    vector_store.local_cache = SemanticCache(capacity=4, time_to_live=60)
+    vector_store.exact_cache = ExactMatchCache(capacity=4, time_to_live=60)
+    point_id = uuid.uuid4()
+    vector_store.local_cache.add("admin_guide", point_id.hex, [1.0, 0.0], {})
+    vector_store.exact_cache.add("explain admin module", point_id.hex, {})
+    manager = CacheManager(vector_store, max_points=0, time_to_live=500)
+
+    manager.record_hit(point_id.hex)
+    vector_store.client.retrieve.return_value = [cache_point(str(point_id), "admin_guide", 0, hit_count=2)]
+    await manager.flush_hits()
+    assert vector_store.client.set_payload.call_args.kwargs["payload"]["hit_count"] == 3
+
+    vector_store.client.scroll.return_value = ([cache_point(str(point_id), "admin_guide", 0)], None)
+    with mock.patch("chat_bot.tools.cache_manager.time.time", return_value=1000):
+        assert await manager.compact() == {"expired": 1, "evicted": 0, "kept": 0}
+    assert vector_store.local_cache.lookup("admin_guide", [1.0, 0.0], score_threshold=0.8) is None
+    assert vector_store.exact_cache.get("explain admin module") is None
+
+
+@pytest.mark.asyncio
+async def test_confirm_cached(vector_store: Qdrant):
+    """
+    A memory hit on a point another worker deleted is dropped from the tiers, pending and existing points are served.
+    """
+    vector_store.local_cache = SemanticCache(capacity=4, time_to_live=60)
+    vector_store.exact_cache = ExactMatchCache(capacity=4, time_to_live=60)
+    vector_store.local_cache.add("admin_guide", "point-1", [1.0, 0.0], {})
+    vector_store.exact_cache.add("explain admin module", "point-1", {})
+
+    vector_store.client.retrieve.return_value = [models.Record(id="point-1", payload=None)]
+    assert await vector_store.confirm_cached("point-1")
+
+    vector_store.client.retrieve.return_value = []
+    assert not await vector_store.confirm_cached("point-1")
+    assert vector_store.local_cache.lookup("admin_guide", [1.0, 0.0], score_threshold=0.8) is None
+    assert vector_store.exact_cache.get("explain admin module") is None
+
+    # A point still waiting in the write-behind buffer is not in Qdrant yet
+    vector_store.write_behind = mock.MagicMock(__contains__=lambda _, point_id: point_id == "point-2")
+    assert await vector_store.confirm_cached("point-2")
+    assert vector_store.client.retrieve.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_exact_hit_without_network(vector_store: Qdrant):
+    """
+    With the default settings an exact-match hit is served without any Qdrant call, nor an embedding call.
+    """
+    vector_store.exact_cache = ExactMatchCache(capacity=4, time_to_live=60)
+    embedding_model = mock.MagicMock(aembed_query=AsyncMock())
+    pipeline = PipeLine(
+        llm_model=mock.MagicMock(model="gpt-4o-mini"),
+        embedding_model=embedding_model,
+        vector_store=vector_store,
+        websocket=mock.MagicMock(),
+        resource="admin_guide",
+        response_language="english",
+        text_data="Explain the admin module?",
+    )
+    vector_store.exact_cache.add(pipeline.exact_cache_key, "point-1", {"llm_response": "cached"})
+
+    assert await pipeline.get_from_exact_cache()
+    assert pipeline.cache_response.points[0].payload == {"llm_response": "cached"}
+    vector_store.client.retrieve.assert_not_awaited()
+    embedding_model.aembed_query.assert_not_awaited()
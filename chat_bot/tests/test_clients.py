@@ -0,0 +1,77 @@
+from unittest import mock
+from unittest.mock import AsyncMock
+
+import pytest
+
+from chat_bot.core.config import settings
+from chat_bot.tools import ClientRegistry
+
+
+def test_client_registry_reuse():
+    """
+    Clients are reused per (OpenAI key, model) and share one HTTP connection pool.
+    """
+    registry = ClientRegistry(max_keys=4)
+
+    llm = registry.llm(model="gpt-4o-mini", openai_key="sk-1")
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-1") is llm
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-2") is not llm
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-1", temperature=0.5) is not llm
+
+    embedding_model = registry.embedding_model(model="text-embedding-ada-002", openai_key="sk-1")
+    assert registry.embedding_model(model="text-embedding-ada-002", openai_key="sk-1") is embedding_model
+    assert registry.embedding_model(model="text-embedding-3-small", openai_key="sk-1") is not embedding_model
+    assert registry.vector_store() is registry.vector_store()
+
+
+def test_client_registry_eviction():
+    """
+    The least recently used entry is evicted once a pool holds `max_keys` entries.
+    """
+    registry = ClientRegistry(max_keys=2)
+    first = registry.llm(model="gpt-4o-mini", openai_key="sk-1")
+    second = registry.llm(model="gpt-4o-mini", openai_key="sk-2")
+    # sk-2 is now the least recently used key
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-1") is first
+    registry.llm(model="gpt-4o-mini", openai_key="sk-3")
+
+    assert len(registry._llms) == 2
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-1") is first
+    assert registry.llm(model="gpt-4o-mini", openai_key="sk-2") is not second
+
+
+@pytest.mark.asyncio
+async def test_client_registry_aclose():
+    """
+    Closing the registry writes the pending cache hits, closes the vector store and the HTTP pool, and empties the pools.
+    """
+    registry = ClientRegistry(max_keys=2)
+    registry.llm(model="gpt-4o-mini", openai_key="sk-1")
+    registry.embedding_model(model="text-embedding-ada-002", openai_key="sk-1")
+    vector_store = registry.vector_store()
+    cache_manager = registry.cache_manager()
+
+    # A failed write of the cache hits does not keep the clients open
+    with (
+        mock.patch.object(cache_manager, "flush_hits", AsyncMock(side_effect=RuntimeError("Qdrant is down"))) as flush_mock,
+        mock.patch.object(vector_store, "close", AsyncMock()) as close_mock,
+    ):
+        await registry.aclose()
+
+    flush_mock.assert_awaited_once()
+    close_mock.assert_awaited_once()
+    assert registry.http_client.is_closed
+    assert not registry._llms and not registry._embedding_models
+    assert registry._vector_store is None and registry._cache_manager is None
+
+
+def test_client_registry_memory_ttl():
+    """
+    With several workers, the in-process cache tiers expire after the shared time to live and are not verified.
+    """
+    with mock.patch.object(settings, "WORKERS", 2):
+        vector_store = ClientRegistry().vector_store()
+    assert vector_store.local_cache.time_to_live == vector_store.exact_cache.time_to_live == settings.SEMANTIC_CACHE_SHARED_TTL
+    assert not vector_store.verify_memory_hits
+
+    assert ClientRegistry().vector_store().local_cache.time_to_live == settings.SEMANTIC_CACHE_TTL
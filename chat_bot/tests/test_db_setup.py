@@ -0,0 +1,205 @@
+import asyncio
+import time
+from unittest import mock
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from qdrant_client import models
+from qdrant_client.http.exceptions import UnexpectedResponse
+from tenacity import wait_none
+
+from chat_bot.core.config import settings
+from chat_bot.core.db_setup import (
+    CACHE_SCOPE_FIELDS,
+    BootstrapStatus,
+    bootstrap,
+    collection_update,
+    setup_knowledge_base,
+    snapshot_chunks,
+    upload_snapshot,
+)
+
+
+def collection_config(on_disk: bool | None = None, quantization=None) -> models.CollectionConfig:
+    return models.CollectionConfig(
+        params=models.CollectionParams(vectors=models.VectorParams(size=4, distance=models.Distance.COSINE, on_disk=on_disk)),
+        hnsw_config=models.HnswConfig(m=16, ef_construct=100, full_scan_threshold=10000),
+        optimizer_config=models.OptimizersConfig(
+            deleted_threshold=0.2,
+            vacuum_min_vector_number=1000,
+            default_segment_number=0,
+            flush_interval_sec=5,
+        ),
+        wal_config=models.WalConfig(wal_capacity_mb=32, wal_segments_ahead=0),
+        quantization_config=quantization,
+    )
+
+
+def test_collection_update():
+    """
+    Only the storage settings that differ from the collection configuration are updated.
+    """
+    assert collection_update(collection_config()) == {}
+
+    with (
+        mock.patch("chat_bot.core.db_setup.settings.QDRANT_QUANTIZATION", "scalar"),
+        mock.patch("chat_bot.core.db_setup.settings.QDRANT_ON_DISK_VECTORS", True),
+        mock.patch("chat_bot.core.db_setup.settings.QDRANT_HNSW_M", 32),
+        mock.patch("chat_bot.core.db_setup.settings.QDRANT_HNSW_EF_CONSTRUCT", 100),
+    ):
+        update = collection_update(collection_config())
+        assert update["hnsw_config"] == models.HnswConfigDiff(m=32)
+        assert update["vectors_config"] == {"": models.VectorParamsDiff(on_disk=True)}
+        assert update["quantization_config"].scalar.type == models.ScalarType.INT8
+
+        provisioned = collection_config(on_disk=True, quantization=update["quantization_config"])
+        assert collection_update(provisioned) == {"hnsw_config": models.HnswConfigDiff(m=32)}
+
+    assert collection_update(collection_config(quantization=models.BinaryQuantization(binary=models.BinaryQuantizationConfig()))) == {
+        "quantization_config": models.Disabled.DISABLED
+    }
+
+
+@pytest.mark.asyncio
+async def test_snapshot_chunks(tmp_path):
+    """
+    The snapshot is read in chunks and the upload progress is reported.
+    """
+    snapshot = tmp_path / "collection.snapshot"
+    snapshot.write_bytes(b"0123456789")
+    status = BootstrapStatus()
+
+    assert [chunk async for chunk in snapshot_chunks(snapshot, status, chunk_size=4)] == [b"0123", b"4567", b"89"]
+    assert status.uploaded_bytes == 10
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.core.db_setup.wait_random", return_value=wait_none())
+@mock.patch("chat_bot.core.db_setup.setup_knowledge_base")
+async def test_bootstrap_failure(setup_mock: AsyncMock, _wait_mock: MagicMock, tmp_path):
+    """
+    The bootstrap reports the error once every attempt failed.
+    """
+    setup_mock.side_effect = RuntimeError("Qdrant is down")
+    status = BootstrapStatus()
+
+    await bootstrap(MagicMock(), status, attempts=2, lock_path=tmp_path / "bootstrap.lock")
+
+    assert setup_mock.call_count == 2
+    assert status.as_dict() == {
+        "state": "failed",
+        "step": "waiting_for_lock",
+        "attempt": 2,
+        "error": "RuntimeError: Qdrant is down",
+        "uploaded_bytes": 0,
+        "snapshot_bytes": 0,
+        "copied_points": 0,
+    }
+
+
+@mock.patch("chat_bot.core.db_setup.wait_random", return_value=wait_none())
+@mock.patch("chat_bot.core.db_setup.setup_knowledge_base")
+def test_readiness(setup_mock: AsyncMock, _wait_mock: MagicMock, client: TestClient):
+    """
+    The readiness endpoint answers 200 once the bootstrap run by the lifespan succeeded.
+    """
+    setup_mock.side_effect = [RuntimeError("Qdrant is starting"), None]
+
+    with mock.patch.object(settings, "QDRANT_BOOTSTRAP", True), client:
+        for _ in range(100):
+            response = client.get("/readyz")
+            if response.status_code == 200:
+                break
+            assert response.status_code == 503
+            time.sleep(0.01)
+
+    assert response.status_code == 200
+    assert response.json()["attempt"] == 2
+
+
+@mock.patch("chat_bot.core.db_setup.setup_knowledge_base")
+@mock.patch("chat_bot.tools.numpy_retriever.NumpyRetriever.load")
+def test_readiness_warmup(load_mock: AsyncMock, setup_mock: AsyncMock, client: TestClient):
+    """
+    With the NumPy retriever, the index is loaded during startup, before the worker reports ready.
+    """
+    with mock.patch.object(settings, "NUMPY_RETRIEVER", True), client:
+        for _ in range(100):
+            response = client.get("/readyz")
+            if response.status_code == 200:
+                break
+            time.sleep(0.01)
+
+    assert response.json()["attempt"] == 1
+    load_mock.assert_awaited_once()
+    # The collections are managed outside the application
+    setup_mock.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_workers(tmp_path):
+    """
+    Workers take turns on the lock file, and a collection another host created in the meantime counts as created.
+    """
+    running: list[int] = []
+
+    async def setup(vector_db: MagicMock, status: BootstrapStatus) -> None:
+        running.append(1)
+        assert len(running) == 1
+        await asyncio.sleep(0.05)
+        running.pop()
+
+    with mock.patch("chat_bot.core.db_setup.setup_knowledge_base", side_effect=setup) as setup_mock:
+        statuses = [BootstrapStatus(), BootstrapStatus()]
+        await asyncio.gather(*(bootstrap(MagicMock(), status, lock_path=tmp_path / "bootstrap.lock") for status in statuses))
+    assert setup_mock.call_count == 2
+    assert [status.state for status in statuses] == ["ready", "ready"]
+
+    # Both collections are indexed and provisioned already
+    info = MagicMock(payload_schema=dict.fromkeys(("metadata.resource", *CACHE_SCOPE_FIELDS)), config=collection_config())
+    vector_db = MagicMock(
+        collection_exists=AsyncMock(return_value=False),
+        create_collection=AsyncMock(side_effect=UnexpectedResponse(409, "Conflict", b"already exists", httpx.Headers())),
+        get_collection=AsyncMock(return_value=info),
+        update_collection=AsyncMock(),
+    )
+    with mock.patch("chat_bot.core.db_setup.upload_snapshot") as upload_mock:
+        await setup_knowledge_base(vector_db, BootstrapStatus())
+    upload_mock.assert_called_once()
+    vector_db.update_collection.assert_not_called()
+
+    vector_db.create_collection.side_effect = UnexpectedResponse(500, "Internal Server Error", b"", httpx.Headers())
+    with mock.patch("chat_bot.core.db_setup.upload_snapshot"), pytest.raises(UnexpectedResponse):
+        await setup_knowledge_base(vector_db, BootstrapStatus())
+
+
+@pytest.mark.asyncio
+async def test_upload_snapshot(tmp_path):
+    """
+    The snapshot is streamed as a multipart body of the announced length, and a rejected upload raises.
+    """
+    snapshot = tmp_path / "main.snapshot"
+    snapshot.write_bytes(b"SNAPSHOT-" * 100)
+    requests: list[tuple[httpx.Request, bytes]] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request, await request.aread()))
+        return httpx.Response(200 if len(requests) == 1 else 500, json={"result": True})
+
+    status = BootstrapStatus()
+    with mock.patch("chat_bot.core.db_setup.settings.QDRANT_SNAPSHOT_CHUNK_SIZE", 256):
+        await upload_snapshot("main", snapshot, status, transport=httpx.MockTransport(handler))
+        with pytest.raises(httpx.HTTPStatusError):
+            await upload_snapshot("main", snapshot, status, transport=httpx.MockTransport(handler))
+
+    request, body = requests[0]
+    assert request.url.path == "/collections/main/snapshots/upload"
+    assert request.url.params["priority"] == "snapshot"
+    assert int(request.headers["Content-Length"]) == len(body)
+    boundary = request.headers["Content-Type"].split("boundary=")[1]
+    assert body.startswith(f"--{boundary}\r\n".encode())
+    assert b'name="snapshot"; filename="main.snapshot"' in body
+    assert body.endswith(b"\r\n\r\n" + b"SNAPSHOT-" * 100 + f"\r\n--{boundary}--\r\n".encode())
+    assert status.uploaded_bytes == status.snapshot_bytes == 900
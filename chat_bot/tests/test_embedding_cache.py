@@ -0,0 +1,137 @@
+import asyncio
+from unittest import mock
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from chat_bot.tools.embedding_cache import DiskEmbeddingStore, EmbeddingCache
+from chat_bot.tools.llm import EmbeddingModel
+
+
+def test_embedding_cache_budget():
+    """
+    Vectors are stored as float32 and the least recently used ones are evicted to stay within the byte budget.
+    """
+    cache = EmbeddingCache(max_bytes=2 * 4 * 4, time_to_live=60)
+    first, second, third = (EmbeddingCache.key("model", 4, text) for text in ("first", "second", "third"))
+
+    assert cache.put(first, [0.1, 0.2, 0.3, 0.4]).dtype == np.float32
+    cache.put(second, [0.1, 0.2, 0.3, 0.4])
+    assert cache.get(first) is not None
+    cache.put(third, [0.1, 0.2, 0.3, 0.4])
+
+    assert cache.get(second) is None
+    assert cache.stats == {"hits": 1, "disk_hits": 0, "misses": 1, "entries": 2, "bytes": 32}
+
+
+def test_embedding_cache_expiry():
+    """
+    Expired vectors count as misses.
+    """
+    cache = EmbeddingCache(max_bytes=1024, time_to_live=60)
+    key = EmbeddingCache.key("model", 2, "query")
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=0):
+        cache.put(key, [0.1, 0.2])
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=61):
+        assert cache.get(key) is None
+    assert cache.stats["bytes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_disk_embedding_store(tmp_path):
+    """
+    Vectors written by one store are served by another store on the same directory, e.g. another worker.
+    """
+    key = EmbeddingCache.key("model", 4, "query")
+    writer = DiskEmbeddingStore(tmp_path, dimension=4)
+    writer.put(key, np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32))
+    writer.put(key, np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32))
+    writer.put(EmbeddingCache.key("model", 4, "other"), np.array([0.5, 0.6, 0.7, 0.8], dtype=np.float32))
+
+    reader = DiskEmbeddingStore(tmp_path, dimension=4)
+    cache = EmbeddingCache(max_bytes=1024, time_to_live=60, disk_store=reader)
+    assert await cache.aget(key) == pytest.approx([0.1, 0.2, 0.3, 0.4])
+    assert await cache.aget(key) is not None
+    assert await cache.aget(EmbeddingCache.key("model", 4, "missing")) is None
+    assert cache.stats["disk_hits"] == 1
+    assert cache.stats["hits"] == 1
+
+    await EmbeddingCache(max_bytes=1024, time_to_live=60, disk_store=writer).aput(EmbeddingCache.key("model", 4, "late"), [0.9, 1.0, 1.1, 1.2])
+    assert reader.get(EmbeddingCache.key("model", 4, "late")) == pytest.approx([0.9, 1.0, 1.1, 1.2])
+
+    # A write blocked by the writer of another worker is skipped rather than waited for
+    busy = DiskEmbeddingStore(tmp_path, dimension=4, busy_timeout=0.01)
+    writer._index.execute("BEGIN IMMEDIATE")
+    busy.put(EmbeddingCache.key("model", 4, "busy"), np.array([0.1, 0.1, 0.1, 0.1], dtype=np.float32))
+    writer._index.execute("ROLLBACK")
+    assert busy.get(EmbeddingCache.key("model", 4, "busy")) is None
+    busy.close()
+    writer.close()
+    reader.close()
+
+
+def test_disk_embedding_store_eviction(tmp_path):
+    """
+    The store keeps at most `max_rows` vectors, reusing the rows of the oldest ones, also with another `max_rows` later.
+    """
+    keys = [EmbeddingCache.key("model", 4, f"query {index}") for index in range(5)]
+    store = DiskEmbeddingStore(tmp_path, dimension=4, max_rows=2)
+    for index, key in enumerate(keys[:3]):
+        store.put(key, np.full(4, index, dtype=np.float32))
+
+    assert store.get(keys[0]) is None
+    assert store.get(keys[1]) == pytest.approx([1, 1, 1, 1])
+    assert store.get(keys[2]) == pytest.approx([2, 2, 2, 2])
+    assert (tmp_path / "vectors-4.f32").stat().st_size == 2 * store.row_bytes
+    store.close()
+
+    smaller = DiskEmbeddingStore(tmp_path, dimension=4, max_rows=1)
+    smaller.put(keys[3], np.full(4, 3, dtype=np.float32))
+    assert smaller.get(keys[2]) is None
+    assert smaller.get(keys[3]) == pytest.approx([3, 3, 3, 3])
+    assert smaller._index.execute("SELECT COUNT(*) FROM embeddings_4").fetchone()[0] == 1
+    smaller.close()
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.OpenAIEmbeddings.aembed_query")
+async def test_embedding_model_cache(openai_embedding_mock: MagicMock):
+    """
+    The cache is keyed by model and normalized text, so only distinct queries reach OpenAI.
+    """
+    openai_embedding_mock.return_value = [0.1, 0.2]
+    cache = EmbeddingCache(max_bytes=1024, time_to_live=60)
+    ada = EmbeddingModel(model="text-embedding-ada-002", openai_key="sk-1234567890", cache=cache)
+    small = EmbeddingModel(model="text-embedding-3-small", openai_key="sk-1234567890", cache=cache)
+
+    assert await ada.aembed_query("explain  admin module") == pytest.approx([0.1, 0.2])
+    assert await ada.aembed_query(" explain admin module ") == pytest.approx([0.1, 0.2])
+    await small.aembed_query("explain admin module")
+
+    assert openai_embedding_mock.call_count == 2
+    openai_embedding_mock.assert_called_with("explain admin module")
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.OpenAIEmbeddings.aembed_documents")
+async def test_embedding_model_batching(openai_embedding_mock: MagicMock):
+    """
+    Concurrent queries are sent as one batched request and each caller gets its own vector.
+    """
+    openai_embedding_mock.return_value = [[0.1, 0.2], [0.3, 0.4]]
+    model = EmbeddingModel(model="text-embedding-ada-002", openai_key="sk-1234567890", batch_window=0.01, batch_size=8)
+
+    first, second, repeated = await asyncio.gather(
+        model.aembed_query("first query"),
+        model.aembed_query("second query"),
+        model.aembed_query("first query"),
+    )
+
+    assert first == repeated == [0.1, 0.2]
+    assert second == [0.3, 0.4]
+    openai_embedding_mock.assert_called_once_with(["first query", "second query"])
+
+    openai_embedding_mock.side_effect = RuntimeError("rate limited")
+    with pytest.raises(RuntimeError):
+        await asyncio.gather(model.aembed_query("third query"), model.aembed_query("fourth query"))
@@ -0,0 +1,27 @@
+from unittest import mock
+
+from chat_bot.tools.lru import LRUCache
+
+
+def test_lru_cache_bounds():
+    """
+    Entries are evicted least recently used first to stay within the size bound, and expire after their time to live.
+    """
+    removed: list[str] = []
+    cache: LRUCache[str, str] = LRUCache(max_size=8, time_to_live=60, size=len, on_remove=lambda key, _: removed.append(key))
+
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=0):
+        cache.put("first", "abcd")
+        cache.put("second", "efgh", time_to_live=10)
+        assert cache.get("first") == "abcd"
+        cache.put("third", "ij")
+        assert removed == ["second"]
+        assert cache.get("second") is None
+        # A value larger than the whole cache is not stored
+        assert cache.put("large", "abcdefghi") == "abcdefghi"
+        assert "large" not in cache
+        assert (cache.hits, cache.misses, len(cache), cache.current_size) == (1, 1, 2, 6)
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=60):
+        assert cache.lookup("first") is None
+    assert removed == ["second", "first"]
+    assert cache.pop("missing") is None
@@ -0,0 +1,79 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from unittest import mock
+from unittest.mock import MagicMock
+
+import time
+
+import jwt
+import pytest
+from datetime import UTC, datetime, timedelta
+
+from chat_bot.core.middleware import AuthBackend, TokenCache
+from chat_bot.core.config import settings
+from chat_bot.core.security import User, decode_claims
+
+USER = User(user_id=123, user_name="alimon", first_name="Alimon", last_name="Khader", openai_key="sk-1234567890")
+
+
+@contextmanager
+def clock(now: float) -> Iterator[None]:
+    """
+    Set both the wall clock the `exp` claims are read with and the monotonic clock the cache entries expire on.
+    """
+    with mock.patch("chat_bot.core.middleware.time.time", return_value=now), mock.patch("chat_bot.tools.lru.time.monotonic", return_value=now):
+        yield
+
+
+def test_token_cache_bounds():
+    """
+    The least recently used token is evicted when full, and tokens expire after the time to live or their exp claim.
+    """
+    cache = TokenCache(capacity=2, time_to_live=60)
+    with clock(0):
+        cache.put("first", USER)
+        cache.put("second", USER)
+        assert cache.get("first") is USER
+        cache.put("third", USER, expires_at=30)
+        assert cache.get("second") is None
+        # A token accepted although it expired is kept for the time to live
+        cache.put("expired", USER, expires_at=-10)
+        assert cache.get("expired") is USER
+        cache.put("second", USER)
+        assert cache.stats == {"hits": 2, "misses": 1, "entries": 2}
+    with clock(30):
+        assert cache.get("second") is USER
+        assert cache.get("expired") is USER
+    with clock(60):
+        assert cache.get("second") is None
+
+
+@pytest.mark.asyncio
+async def test_auth_backend_token_cache(jwt_token: str):
+    """
+    A token is decoded on the first connection only, reconnections are served from the cache.
+    """
+    backend = AuthBackend(token_cache=TokenCache(capacity=8, time_to_live=60))
+    conn = MagicMock(scope={"path": "/ws"}, query_params={"token": jwt_token})
+
+    with mock.patch("chat_bot.core.middleware.decode_claims", side_effect=decode_claims) as decode_mock:
+        _, first = await backend.authenticate(conn)
+        _, second = await backend.authenticate(conn)
+
+    assert first == second == USER
+    assert decode_mock.call_count == 1
+    assert backend.token_cache.stats == {"hits": 1, "misses": 1, "entries": 1}
+    # The entry does not outlive the token
+    remaining = jwt.decode(jwt_token, options={"verify_signature": False})["exp"] - time.time()
+    assert backend.token_cache._entries.expires_at(TokenCache.digest(jwt_token)) <= time.monotonic() + remaining
+
+    # An expired token is still accepted, and cached like any other
+    expired_token = jwt.encode(
+        payload={"user_details": USER.model_dump(), "exp": datetime.now(UTC) - timedelta(hours=1)},
+        key=settings.JWT_SECRET_KEY,
+        algorithm=settings.JWT_ALGORITHM,
+    )
+    conn = MagicMock(scope={"path": "/ws"}, query_params={"token": expired_token})
+    await backend.authenticate(conn)
+    await backend.authenticate(conn)
+    assert backend.token_cache.stats == {"hits": 2, "misses": 2, "entries": 2}
@@ -0,0 +1,64 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+from qdrant_client import models
+
+from chat_bot.tools.numpy_retriever import NumpyRetriever
+from chat_bot.tools.retriever import Qdrant, make_client
+
+
+@pytest.mark.asyncio
+async def test_numpy_retriever(tmp_path):
+    """
+    The NumPy index returns the results of Qdrant for the main collection, and is saved for the next start.
+    """
+    client = make_client(local_path=":memory:")
+    await client.create_collection("main", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+    rng = np.random.default_rng(7)
+    await client.upsert(
+        "main",
+        points=[
+            models.PointStruct(
+                id=index,
+                vector=rng.normal(size=3).tolist(),
+                payload={"metadata": {"resource": ("admin_guide", "user_guide")[index % 2], "page_number": index}},
+            )
+            for index in range(40)
+        ],
+    )
+    retriever = NumpyRetriever(
+        cache_collection="llm_cache", main_collection="main", search_limit=5, cache_hit_score=0.9, client=client, index_path=tmp_path
+    )
+    query = rng.normal(size=3).tolist()
+
+    for query_filter in ([("metadata.resource", "admin_guide")], [("metadata.resource", "user_guide")], [], [("metadata.resource", "missing")]):
+        expected = await Qdrant.search(retriever, "main", query, query_filter, limit=5, score_threshold=0.1)
+        response = await retriever.search("main", query, query_filter, limit=5, score_threshold=0.1)
+        assert [point.id for point in response.points] == [point.id for point in expected.points]
+        assert [point.score for point in response.points] == pytest.approx([point.score for point in expected.points], abs=1e-5)
+        assert [point.payload for point in response.points] == [point.payload for point in expected.points]
+
+    # A new worker memory-maps the saved index instead of reading the collection again
+    reloaded = NumpyRetriever(
+        cache_collection="llm_cache", main_collection="main", search_limit=5, cache_hit_score=0.9, client=client, index_path=tmp_path
+    )
+    with mock.patch.object(client, "scroll", wraps=client.scroll) as scroll_mock:
+        await reloaded.load()
+        response = await reloaded.search("main", query, [("metadata.resource", "admin_guide")], limit=3)
+    # Only the point IDs are read, to fingerprint the collection
+    assert not any(call.kwargs["with_vectors"] or call.kwargs["with_payload"] for call in scroll_mock.call_args_list)
+    assert isinstance(reloaded.matrix, np.memmap)
+    assert len(response.points) == 3
+
+    # A collection restored with as many, but other, points is read again
+    await client.delete("main", points_selector=models.PointIdsList(points=[0]))
+    await client.upsert("main", points=[models.PointStruct(id=100, vector=[1.0, 0.0, 0.0], payload={"metadata": {"resource": "admin_guide"}})])
+    restored = NumpyRetriever(
+        cache_collection="llm_cache", main_collection="main", search_limit=5, cache_hit_score=0.9, client=client, index_path=tmp_path
+    )
+    await restored.load()
+    assert not isinstance(restored.matrix, np.memmap)
+    assert 100 in restored.point_ids
+
+    await client.close()
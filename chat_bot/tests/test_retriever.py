@@ -0,0 +1,76 @@
+import pytest
+from qdrant_client import models
+
+from chat_bot.core.config import settings
+from chat_bot.core.db_setup import BootstrapStatus, copy_collection, export_collection, load_collection
+from chat_bot.tools.retriever import Qdrant, make_client
+
+
+@pytest.mark.asyncio
+async def test_local_mode():
+    """
+    The main collection is copied into the local mode, which serves the search, upsert and delete of the vector store.
+    """
+    server = make_client(local_path=":memory:")
+    await server.create_collection("main", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    await server.upsert(
+        "main",
+        points=[
+            models.PointStruct(id=index, vector=[1.0, index], payload={"metadata": {"resource": "admin_guide", "page_number": index}})
+            for index in range(5)
+        ],
+    )
+    local = make_client(local_path=":memory:")
+    status = BootstrapStatus()
+    await copy_collection(server, local, "main", status, batch_size=2)
+    assert status.copied_points == 5
+
+    await local.create_collection("llm_cache", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    vector_store = Qdrant(cache_collection="llm_cache", main_collection="main", search_limit=3, cache_hit_score=0.9, client=local)
+    response = await vector_store.search("main", [1.0, 0.0], query_filter=[("metadata.resource", "admin_guide")], limit=3)
+    assert [point.id for point in response.points] == [0, 1, 2]
+
+    point_id = await vector_store.upsert("llm_cache", [1.0, 0.0], {"llm_response": "cached", "metadata": {"resource": "admin_guide"}})
+    response = await vector_store.search("llm_cache", [1.0, 0.0], query_filter=[("metadata.resource", "admin_guide")])
+    assert response.points[0].payload["llm_response"] == "cached"
+    await vector_store.delete_point(point_id)
+    assert (await vector_store.search("llm_cache", [1.0, 0.0], query_filter=[])).points == []
+
+    await vector_store.close()
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_local_mode_seed(tmp_path):
+    """
+    The local mode loads the main collection from a JSONL export, without a server.
+    """
+    source = make_client(local_path=":memory:")
+    await source.create_collection("main", vectors_config=models.VectorParams(size=2, distance=models.Distance.DOT))
+    await source.upsert(
+        "main", points=[models.PointStruct(id=index, vector=[1.0, index], payload={"page_number": index}) for index in range(5)]
+    )
+    seed = tmp_path / "main.jsonl"
+    assert await export_collection(source, "main", seed, batch_size=2) == 5
+    await source.close()
+
+    local = make_client(local_path=":memory:")
+    status = BootstrapStatus()
+    await load_collection(local, "main", seed, status, batch_size=2)
+    assert status.copied_points == 5
+    info = await local.get_collection("main")
+    assert info.config.params.vectors.distance == models.Distance.DOT
+    records = await local.retrieve("main", ids=[3], with_vectors=True)
+    assert records[0].payload == {"page_number": 3}
+    assert records[0].vector == [1.0, 3.0]
+    await local.close()
+
+
+def test_local_path_workers():
+    """
+    A storage directory is locked by the worker that opens it, so it is rejected with several workers.
+    """
+    with pytest.raises(ValueError, match="WORKERS"):
+        settings.model_copy(update={"QDRANT_LOCAL_PATH": "/tmp/qdrant", "WORKERS": 2}).check_local_mode()
+    settings.model_copy(update={"QDRANT_LOCAL_PATH": ":memory:", "WORKERS": 2}).check_local_mode()
+    settings.model_copy(update={"QDRANT_LOCAL_PATH": "/tmp/qdrant", "WORKERS": 1}).check_local_mode()
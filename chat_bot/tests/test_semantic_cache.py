@@ -0,0 +1,108 @@
+from unittest import mock
+
+from chat_bot.tools.semantic_cache import ExactMatchCache, SemanticCache, normalize_query
+
+
+def test_semantic_cache_lookup():
+    """
+    A stored point is served for similar vectors of the same scope only.
+    """
+    cache = SemanticCache(capacity=4, time_to_live=60)
+    cache.add("admin_guide", "point-1", [1.0, 0.0, 0.0], {"llm_response": "cached"})
+
+    hit = cache.lookup("admin_guide", [0.9, 0.1, 0.0], score_threshold=0.8)
+    assert hit is not None
+    assert hit.id == "point-1"
+    assert hit.payload == {"llm_response": "cached"}
+
+    assert cache.lookup("admin_guide", [0.0, 1.0, 0.0], score_threshold=0.8) is None
+    assert cache.lookup("user_guide", [1.0, 0.0, 0.0], score_threshold=0.8) is None
+
+
+def test_semantic_cache_eviction_and_discard():
+    """
+    The least recently used point is evicted when the scope is full, and discarded points are never served.
+    """
+    cache = SemanticCache(capacity=2, time_to_live=60)
+    cache.add("admin_guide", "point-1", [1.0, 0.0, 0.0], {})
+    cache.add("admin_guide", "point-2", [0.0, 1.0, 0.0], {})
+    assert cache.lookup("admin_guide", [1.0, 0.0, 0.0], score_threshold=0.8).id == "point-1"
+
+    # point-2 is now the least recently used point
+    cache.add("admin_guide", "point-3", [0.0, 0.0, 1.0], {})
+    assert cache.lookup("admin_guide", [0.0, 1.0, 0.0], score_threshold=0.8) is None
+    assert cache.lookup("admin_guide", [0.0, 0.0, 1.0], score_threshold=0.8).id == "point-3"
+
+    cache.discard("point-1")
+    assert cache.lookup("admin_guide", [1.0, 0.0, 0.0], score_threshold=0.8) is None
+    assert cache.lookup("admin_guide", [0.0, 0.0, 1.0], score_threshold=0.8).id == "point-3"
+
+
+def test_semantic_cache_expiry():
+    """
+    Points older than the time to live are not served and are evicted first.
+    """
+    cache = SemanticCache(capacity=2, time_to_live=60)
+    with mock.patch("chat_bot.tools.semantic_cache.time.monotonic", return_value=0):
+        cache.add("admin_guide", "point-1", [1.0, 0.0], {})
+    with mock.patch("chat_bot.tools.semantic_cache.time.monotonic", return_value=30):
+        cache.add("admin_guide", "point-2", [0.0, 1.0], {})
+    with mock.patch("chat_bot.tools.semantic_cache.time.monotonic", return_value=61):
+        assert cache.lookup("admin_guide", [1.0, 0.0], score_threshold=0.8) is None
+        cache.add("admin_guide", "point-3", [0.7, 0.7], {})
+        assert cache.lookup("admin_guide", [0.0, 1.0], score_threshold=0.8).id == "point-2"
+
+
+def test_semantic_cache_scopes():
+    """
+    Scope matrices grow with their points, and the least recently used scope is dropped past the scope bound.
+    """
+    cache = SemanticCache(capacity=40, time_to_live=60, max_scopes=2)
+    for point in range(20):
+        cache.add("admin_guide", f"point-{point}", [1.0, float(point)], {})
+    index = cache._scopes.lookup("admin_guide")
+    assert index.matrix.shape == (32, 2)
+    assert cache.lookup("admin_guide", [1.0, 19.0], score_threshold=0.99).id == "point-19"
+
+    cache.add("user_guide", "point-20", [1.0, 0.0], {})
+    assert cache._scopes.lookup("user_guide").matrix.shape == (16, 2)
+    cache.lookup("admin_guide", [1.0, 0.0], score_threshold=0.8)
+    cache.add("api_guide", "point-21", [1.0, 0.0], {})
+
+    assert cache.lookup("user_guide", [1.0, 0.0], score_threshold=0.8) is None
+    assert cache.lookup("admin_guide", [1.0, 0.0], score_threshold=0.99).id == "point-0"
+    # The points of a dropped scope are forgotten with it
+    assert "point-20" not in cache._point_scopes
+    cache.discard("point-20")
+
+
+def test_exact_match_cache():
+    """
+    Normalized repeat questions map to the cached point until it is discarded.
+    """
+    cache = ExactMatchCache(capacity=2, time_to_live=60)
+    key = ("admin_guide", "english", normalize_query("  Explain the Admin module? "))
+    cache.add(key, "point-1", {"llm_response": "cached"})
+
+    assert key == ("admin_guide", "english", "explain the admin module")
+    assert cache.get(("admin_guide", "english", normalize_query("explain the admin   module"))).id == "point-1"
+    assert cache.get(("admin_guide", "german", "explain the admin module")) is None
+
+    cache.discard("point-1")
+    assert cache.get(key) is None
+
+
+def test_exact_match_cache_bounds():
+    """
+    The least recently used key is evicted when full, and expired keys are not served.
+    """
+    cache = ExactMatchCache(capacity=2, time_to_live=60)
+    with mock.patch("chat_bot.tools.semantic_cache.time.monotonic", return_value=0):
+        cache.add("first", "point-1", {})
+        cache.add("second", "point-2", {})
+        cache.add("first", "point-1", {})
+        cache.add("third", "point-3", {})
+        assert cache.get("second") is None
+        assert cache.get("first").id == "point-1"
+    with mock.patch("chat_bot.tools.semantic_cache.time.monotonic", return_value=61):
+        assert cache.get("third") is None
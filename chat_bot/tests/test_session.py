@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from chat_bot.api.ws.session import WebSocketSession
+
+
+@pytest.mark.asyncio
+async def test_session_concurrency_limit():
+    """
+    Transactions beyond the concurrency limit wait for a free slot.
+    """
+    session = WebSocketSession(max_concurrency=1)
+    release = asyncio.Event()
+    started: list[str] = []
+
+    async def transaction(name: str):
+        started.append(name)
+        await release.wait()
+
+    first = session.submit("first", transaction("first"))
+    second = session.submit("second", transaction("second"))
+    await asyncio.sleep(0.01)
+    assert started == ["first"]
+    assert session.active == ["first", "second"]
+
+    release.set()
+    await asyncio.gather(first, second)
+    assert started == ["first", "second"]
+    assert session.active == []
+
+
+@pytest.mark.asyncio
+async def test_session_cancellation():
+    """
+    Superseded transactions are cancelled, and closing the session cancels the rest.
+    """
+    session = WebSocketSession(max_concurrency=2)
+
+    first = session.submit("transaction", asyncio.sleep(10))
+    second = session.submit("transaction", asyncio.sleep(10))
+    await asyncio.sleep(0.01)
+    assert first.cancelled()
+    assert session.active == ["transaction"]
+
+    assert session.cancel("missing") is False
+    await session.close()
+    assert second.cancelled()
+    assert session.active == []
+
+
+@pytest.mark.asyncio
+async def test_session_pending_limit():
+    """
+    Transactions beyond the pending limit are refused, except the ones superseding a running transaction.
+    """
+    session = WebSocketSession(max_concurrency=1, max_pending=2)
+    session.submit("first", asyncio.sleep(10))
+    assert session.accepts("second")
+    session.submit("second", asyncio.sleep(10))
+
+    assert not session.accepts("third")
+    assert session.accepts("second")
+    session.cancel("first")
+    assert session.accepts("third")
+    await session.close()
+
+
+@pytest.mark.asyncio
+async def test_session_background_jobs():
+    """
+    Stopping a transaction or closing the session also cancels the background jobs it handed over.
+    """
+    session = WebSocketSession(max_concurrency=1)
+
+    first = asyncio.create_task(asyncio.sleep(10))
+    session.attach("first", first)
+    second = asyncio.create_task(asyncio.sleep(10))
+    session.attach("second", second)
+    assert session.active == []
+    assert session.cancel("first")
+    await asyncio.sleep(0)
+    assert first.cancelled()
+
+    await session.close()
+    assert second.cancelled()
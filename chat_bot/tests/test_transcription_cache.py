@@ -0,0 +1,66 @@
+import base64
+from unittest import mock
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from chat_bot.tools.llm import LLM
+from chat_bot.tools.transcription_cache import DiskTranscriptionStore, TranscriptionCache
+
+
+def test_transcription_cache_budget():
+    """
+    The least recently used transcriptions are evicted to stay within the byte budget, expired ones count as misses.
+    """
+    cache = TranscriptionCache(max_bytes=10, time_to_live=60)
+    first, second, third = (TranscriptionCache.key("whisper-1", audio) for audio in (b"first", b"second", b"third"))
+
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=0):
+        cache.put(first, "hello")
+        cache.put(second, "world")
+        assert cache.get(first) == "hello"
+        cache.put(third, "again")
+        assert cache.get(second) is None
+        assert cache.stats == {"hits": 1, "disk_hits": 0, "misses": 1, "entries": 2, "bytes": 10}
+    with mock.patch("chat_bot.tools.lru.time.monotonic", return_value=61):
+        assert cache.get(third) is None
+
+
+@pytest.mark.asyncio
+async def test_disk_transcription_store(tmp_path):
+    """
+    Transcriptions written by one store are served by another store on the same directory until they expire.
+    """
+    key = TranscriptionCache.key("whisper-1", b"audio")
+    writer = DiskTranscriptionStore(tmp_path, time_to_live=60)
+    writer.put(key, "explain admin module")
+
+    cache = TranscriptionCache(max_bytes=1024, time_to_live=60, disk_store=DiskTranscriptionStore(tmp_path, time_to_live=60))
+    assert await cache.aget(key) == "explain admin module"
+    assert await cache.aget(key) == "explain admin module"
+    assert cache.stats["disk_hits"] == 1
+    assert cache.stats["hits"] == 1
+
+    with mock.patch("chat_bot.tools.transcription_cache.time.time", return_value=10**12):
+        assert writer.get(key) is None
+    writer.close()
+    cache.close()
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.AsyncOpenAI")
+async def test_llm_transcription_cache(openai_whisper_mock: MagicMock):
+    """
+    A recording is sent to Whisper once, whether it is sent again base64 encoded or as raw bytes.
+    """
+    create = AsyncMock(return_value=MagicMock(text="explain admin module"))
+    openai_whisper_mock.return_value = MagicMock(audio=MagicMock(transcriptions=MagicMock(create=create)))
+    llm = LLM(model="gpt-4o-mini", openai_key="sk-1234567890", transcription_cache=TranscriptionCache(max_bytes=1024, time_to_live=60))
+
+    audio = b"RIFF-MOCK-WAV-AUDIO"
+    assert await llm.audio_transcription(base64.b64encode(audio).decode()) == "explain admin module"
+    assert await llm.audio_transcription(bytearray(audio)) == "explain admin module"
+    await llm.audio_transcription(b"OTHER-RECORDING")
+
+    assert create.call_count == 2
+    assert llm.transcription_cache.stats["hits"] == 1
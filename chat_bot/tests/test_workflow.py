@@ -1,11 +1,18 @@
+import asyncio
 import base64
+from functools import partial
 import pytest
 
 from unittest import mock
 from unittest.mock import MagicMock, AsyncMock
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 
+from chat_bot.api.ws.session import WebSocketSession
+from chat_bot.tools import LLM, ContextBuilder, PipeLine, StreamBuffer, TaskSupervisor
 from chat_bot.tools.chat_pipeline import EventType
+from chat_bot.tools.context import get_encoding, load_encoding
+from chat_bot.tools.prompts import CHAT_PROMPT, SUGGESTED_QUESTION_PROMPT
 
 
 @pytest.mark.asyncio
@@ -15,9 +22,11 @@ from chat_bot.tools.chat_pipeline import EventType
         (False, "audio_message", base64.b64encode("explain admin module configuration".encode()).decode()),
         (True, "audio_message", base64.b64encode("explain admin module configuration".encode()).decode()),
         (False, "text_message", "explain admin module configuration"),
-        (True, "text_message", "explain admin module configuration")
+        (True, "text_message", "explain admin module configuration"),
+        (False, "audio_message", b"RIFF-MOCK-WAV-AUDIO" * 100),
     ]
 )
+@mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.retrieve")
 @mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.delete")
 @mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.upsert")
 @mock.patch("chat_bot.tools.retriever.AsyncQdrantClient.query_points")
@@ -33,9 +42,10 @@ async def test_websocket_with_jwt(
     qdrant_query_points_mock: MagicMock,
     qdrant_query_upsert_mock: MagicMock,
     qdrant_query_delete_mock: MagicMock,
+    qdrant_retrieve_mock: MagicMock,
     re_generate: bool,
     action_type: str,
-    query: str,
+    query: str | bytes,
     client: TestClient,
     jwt_token: str
 ):
@@ -84,21 +94,325 @@ async def test_websocket_with_jwt(
         ]
     )
 
-    with client.websocket_connect(f"/ws?token={jwt_token}") as websocket:
-        websocket.send_json({
-            "type": action_type,
-            "payload": {
-                "data": query,
-                "suggested_question": True,
-                "response_language": "english",
-                "re_generate": re_generate,
-                "document": "admin_guide",
-                "point_id": "739af4ef1f9f4c34a3b4fced617c92b2"
-            }
-        })
+    payload = {
+        "suggested_question": True,
+        "response_language": "english",
+        "re_generate": re_generate,
+        "document": "admin_guide",
+        "point_id": "739af4ef1f9f4c34a3b4fced617c92b2",
+        "transaction_id": "transaction-1"
+    }
+    # Raw audio bytes are announced in the header and sent as binary frames
+    payload |= {"audio_bytes": len(query)} if isinstance(query, bytes) else {"data": query}
+
+    with client, client.websocket_connect(f"/ws?token={jwt_token}") as websocket:
+        websocket.send_json({"type": action_type, "payload": payload})
+        if isinstance(query, bytes):
+            websocket.send_bytes(query[:1000])
+            websocket.send_bytes(query[1000:])
         while True:
             data = websocket.receive_json()
             assert data['type'] != EventType.EXCEPTION.value
+            assert data['transaction_id'] == "transaction-1"
             if data['type'] == EventType.TRANSACTION.value and data['payload']['data'] == 'chat_transaction_end':
                 break
 
+    if isinstance(query, bytes):
+        assert create.call_args.kwargs["file"] == ("mmm.wav", query)
+
+
+@pytest.mark.asyncio
+async def test_binary_audio_upload_limits(client: TestClient, jwt_token: str):
+    """
+    An interrupted upload is rejected and its stray frames are answered without closing the connection;
+    an upload over the size limit, or frames exceeding the announced size, close it with code 1009.
+    """
+    with client, client.websocket_connect(f"/ws?token={jwt_token}") as websocket:
+        websocket.send_json({"type": "audio_message", "payload": {"audio_bytes": 4, "transaction_id": "transaction-1"}})
+        websocket.send_bytes(b"RI")
+        websocket.send_text("FF")
+        websocket.send_bytes(b"FF")
+        data = websocket.receive_json()
+        assert data["type"] == EventType.EXCEPTION.value
+        assert data["payload"]["data"] == "Invalid audio upload: Expected a binary audio frame"
+        assert data["transaction_id"] == "transaction-1"
+        assert websocket.receive_json()["payload"]["data"] == "Unexpected binary frame"
+
+        websocket.send_json({"type": "audio_message", "payload": {"audio_bytes": 0, "transaction_id": "transaction-2"}})
+        assert websocket.receive_json()["payload"]["data"] == "Invalid audio upload: Audio size must be positive"
+
+        websocket.send_json({"type": "audio_message", "payload": {"audio_bytes": 10**12, "transaction_id": "transaction-3"}})
+        websocket.send_bytes(b"RIFF")
+        data = websocket.receive_json()
+        assert data["type"] == EventType.EXCEPTION.value
+        assert data["transaction_id"] == "transaction-3"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1009
+
+    with client, client.websocket_connect(f"/ws?token={jwt_token}") as websocket:
+        websocket.send_json({"type": "audio_message", "payload": {"audio_bytes": 4, "transaction_id": "transaction-1"}})
+        websocket.send_bytes(b"RIFF-AND-MORE")
+        assert websocket.receive_json()["payload"]["data"] == "Invalid audio upload: Audio frames exceed the announced size"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1009
+
+
+def make_pipeline(websocket: MagicMock, vector_store: MagicMock, **options) -> PipeLine:
+    """
+    Build a pipeline on mocked clients, answering a text message from the main collection.
+    """
+    vector_store.local_cache = vector_store.exact_cache = None
+    vector_store.search = AsyncMock(
+        return_value=MagicMock(
+            points=[MagicMock(payload={"metadata": {"page_number": 1}, "page_content": "MOCK_QDRANT_RESPONSE"})],
+        )
+    )
+    embedding_model = MagicMock(aembed_query=AsyncMock(return_value=[0.1, 0.2, 0.3]))
+    return PipeLine(
+        llm_model=LLM(model="gpt-4o-mini", openai_key="sk-1234567890"),
+        embedding_model=embedding_model,
+        vector_store=vector_store,
+        websocket=websocket,
+        resource="admin_guide",
+        response_language="english",
+        text_data="explain admin module configuration",
+        skip_cache=True,
+        transaction_id="transaction-1",
+        **options,
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.ChatOpenAI.astream")
+async def test_stop_generation(openai_stream_mock: MagicMock):
+    """
+    Cancelling a transaction closes the LLM stream and skips the cache write.
+    """
+    closed = asyncio.Event()
+
+    async def astream():
+        try:
+            yield "TEST-MOCK-RESPONSE"
+            await asyncio.sleep(10)
+            yield "NEVER-SENT"
+        finally:
+            closed.set()
+
+    openai_stream_mock.return_value = astream()
+    websocket = MagicMock(send_json=AsyncMock())
+    vector_store = MagicMock(upsert=AsyncMock())
+    task = asyncio.create_task(make_pipeline(websocket, vector_store).run())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    events = [call.args[0]["payload"]["data"] for call in websocket.send_json.call_args_list]
+    assert events[-3:] == ["TEST-MOCK-RESPONSE", "chat_transaction_stopped", "chat_transaction_end"]
+    assert closed.is_set()
+    vector_store.upsert.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.ChatOpenAI.astream")
+async def test_client_disconnect(openai_stream_mock: MagicMock):
+    """
+    A failed send stops the generation without any further event.
+    """
+    async def astream():
+        yield "TEST-MOCK-RESPONSE"
+        yield "NEVER-SENT"
+
+    openai_stream_mock.return_value = astream()
+    websocket = MagicMock(send_json=AsyncMock(side_effect=[None, None, WebSocketDisconnect()]))
+    vector_store = MagicMock(upsert=AsyncMock())
+    await make_pipeline(websocket, vector_store).run()
+
+    assert websocket.send_json.call_count == 3
+    vector_store.upsert.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("chat_bot.tools.llm.ChatOpenAI.astream")
+async def test_stop_post_answer_steps(openai_stream_mock: MagicMock):
+    """
+    Stopping a transaction also cancels its post-answer steps, and a disconnected client gets no suggested questions.
+    """
+    async def astream():
+        yield "TEST-MOCK-RESPONSE"
+
+    openai_stream_mock.return_value = astream()
+    websocket = MagicMock(send_json=AsyncMock())
+    vector_store = MagicMock(upsert=AsyncMock())
+    session = WebSocketSession(max_concurrency=1)
+    pipeline = make_pipeline(
+        websocket,
+        vector_store,
+        suggested_question=True,
+        background=TaskSupervisor(max_concurrency=1, attempts=1),
+        on_offload=partial(session.attach, "transaction-1"),
+    )
+    started = asyncio.Event()
+
+    async def generate_questions(query: str, response: str) -> None:
+        started.set()
+        await asyncio.sleep(10)
+
+    pipeline.generate_questions = generate_questions
+    await session.submit("transaction-1", pipeline.run())
+    await started.wait()
+    assert session.cancel("transaction-1")
+    await pipeline.background.drain(timeout=1)
+
+    events = [call.args[0]["payload"]["data"] for call in websocket.send_json.call_args_list]
+    assert events[-2:] == ["chat_transaction_stopped", "chat_transaction_end"]
+    vector_store.upsert.assert_not_called()
+
+    pipeline.generate_questions = AsyncMock()
+    pipeline.store_llm_response = AsyncMock()
+    pipeline.disconnected = True
+    await pipeline.complete_transaction()
+    pipeline.generate_questions.assert_not_called()
+    pipeline.store_llm_response.assert_awaited_once()
+
+
+def test_stream_buffer():
+    """
+    The first non-empty chunk is sent at once, later chunks are coalesced until a flush condition is met.
+    """
+    buffer = StreamBuffer(interval=60, max_chars=12, on_sentence=True)
+    with mock.patch("chat_bot.tools.stream_buffer.time.monotonic", return_value=0):
+        # ChatOpenAI streams an empty chunk first, the first token is still sent at once
+        assert buffer.push("") is None
+        assert buffer.push("The") == "The"
+        assert buffer.push(" admin") is None
+        assert buffer.push(" module.") == " admin module."
+        assert buffer.push(" It") is None
+        assert buffer.push(" configures") == " It configures"
+        assert buffer.push(" users") is None
+    with mock.patch("chat_bot.tools.stream_buffer.time.monotonic", return_value=61):
+        assert buffer.push(" and") == " users and"
+        assert buffer.push(" roles") is None
+        assert buffer.flush() == " roles"
+
+
+@mock.patch("chat_bot.tools.context.get_encoding")
+def test_context_builder(encoding_mock: MagicMock):
+    """
+    Chunks are packed in relevance order within the token budget, and near-duplicates are dropped.
+    """
+    encoding_mock.return_value = MagicMock(encode=str.split)
+
+    def point(page_number: int, page_content: str) -> MagicMock:
+        return MagicMock(payload={"metadata": {"page_number": page_number}, "page_content": page_content})
+
+    builder = ContextBuilder(model="gpt-4o-mini", token_budget=12)
+    context = builder.build(
+        [
+            point(1, "admin module manages users and roles"),
+            point(2, "Admin module manages users and roles"),
+            point(3, "a long chunk that does not fit in the remaining token budget"),
+            point(4, "roles grant permissions"),
+        ]
+    )
+    assert context == "[PageNumber-1]admin module manages users and roles\n[PageNumber-4]roles grant permissions"
+
+    encoding_mock.return_value = None
+    assert builder.count_tokens("12345678") == 3
+
+
+def test_load_encoding():
+    """
+    The tokenizer is only used once loaded, token counts are estimated meanwhile and if it cannot be loaded.
+    """
+    assert get_encoding("test-model") is None
+    with mock.patch("chat_bot.tools.context.tiktoken.encoding_for_model", return_value=MagicMock(encode=str.split)):
+        assert load_encoding("test-model") is get_encoding("test-model")
+    assert ContextBuilder(model="test-model", token_budget=12).count_tokens("admin module") == 2
+
+    with mock.patch("chat_bot.tools.context.tiktoken.encoding_for_model", side_effect=ConnectionError):
+        assert load_encoding("offline-model") is None
+    assert ContextBuilder(model="offline-model", token_budget=12).count_tokens("12345678") == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_scope():
+    """
+    Cached answers are looked up and stored per resource, response language, model and prompt version.
+    """
+    vector_store = MagicMock(cache_collection="llm_cache", cache_hit_score=0.9, upsert=AsyncMock(return_value="point-1"))
+    english = make_pipeline(MagicMock(send_json=AsyncMock()), vector_store)
+    german = make_pipeline(MagicMock(send_json=AsyncMock()), vector_store)
+    german.response_language = "german"
+
+    await english.to_vector(english.plain_text)
+    await english.get_from_cache()
+    query_filter = vector_store.search.call_args.kwargs["query_filter"]
+    assert ("metadata.response_language", "english") in query_filter
+    assert ("metadata.model", "gpt-4o-mini") in query_filter
+    assert english.exact_cache_key != german.exact_cache_key
+
+    await english.store_llm_response()
+    metadata = vector_store.upsert.call_args.kwargs["page_content"]["metadata"]
+    assert [(f"metadata.{field}", metadata[field]) for field in ("resource", "response_language", "model", "prompt_version")] == query_filter
+
+
+@pytest.mark.asyncio
+async def test_speculative_search():
+    """
+    The main collection is searched during the cache lookup: the search is cancelled on a hit and its result used on a miss.
+    """
+    completed: list[str] = []
+    documents = MagicMock(points=[MagicMock(payload={"metadata": {"page_number": 1}, "page_content": "MOCK_QDRANT_RESPONSE"})])
+    cached = MagicMock(points=[MagicMock(id="point-1", payload={"llm_response": "cached"})])
+    responses = {"llm_cache": cached, "main": documents}
+
+    async def search(collection_name: str, **kwargs) -> MagicMock:
+        # The main collection search is the slower one
+        await asyncio.sleep(0.05 if collection_name == "main" else 0.01)
+        completed.append(collection_name)
+        return responses[collection_name]
+
+    vector_store = MagicMock(cache_collection="llm_cache", main_collection="main", cache_hit_score=0.9)
+    pipeline = make_pipeline(MagicMock(send_json=AsyncMock()), vector_store)
+    vector_store.search = search
+    pipeline.embeddings = [0.1, 0.2, 0.3]
+
+    await pipeline.get_from_cache_with_search()
+    assert pipeline.cache_response is cached
+    await asyncio.sleep(0.1)
+    assert completed == ["llm_cache"]
+    assert not pipeline.similarity_searched
+
+    # On a miss the speculative search result is used, the main collection is not searched again
+    responses["llm_cache"] = MagicMock(points=[])
+    completed.clear()
+    await pipeline.get_from_cache_with_search()
+    assert pipeline.cache_response is None
+    assert pipeline.similar_documents is documents
+    assert pipeline.similarity_searched
+    assert completed == ["llm_cache", "main"]
+
+    # A failed cache lookup stops the search before the error is raised
+    pipeline.get_from_cache = AsyncMock(side_effect=RuntimeError("Qdrant unavailable"))
+    tasks = asyncio.all_tasks()
+    with pytest.raises(RuntimeError):
+        await pipeline.get_from_cache_with_search()
+    assert all(task.done() for task in asyncio.all_tasks() - tasks)
+
+
+def test_prompt_layout():
+    """
+    The system messages are identical for every request, so the provider can cache the prompt prefix.
+    """
+    for prompt, variables in (
+        (CHAT_PROMPT, ({"CONTEXT": "a", "QUERY": "b"}, {"CONTEXT": "c", "QUERY": "d"})),
+        (SUGGESTED_QUESTION_PROMPT, ({"QUESTION": "a", "ANSWER": "b"}, {"QUESTION": "c", "ANSWER": "d"})),
+    ):
+        first = prompt.format_messages(**variables[0], RESPONSE_LANGUAGE="english")
+        second = prompt.format_messages(**variables[1], RESPONSE_LANGUAGE="german")
+        assert first[0].type == "system"
+        assert first[0] == second[0]
+        assert first[1] != second[1]
@@ -0,0 +1,71 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from qdrant_client import models
+
+from chat_bot.tools.write_behind import WriteBehindBuffer
+
+
+@pytest.mark.asyncio
+async def test_write_behind_buffer():
+    """
+    Pending points are written in one batch by size, by interval, or on close; discarded points are never written.
+    """
+    client = MagicMock(upsert=AsyncMock())
+    buffer = WriteBehindBuffer(client, "llm_cache", batch_size=2, interval=0.01)
+
+    buffer.add(models.PointStruct(id="point-1", vector=[0.1], payload={}))
+    buffer.add(models.PointStruct(id="point-2", vector=[0.2], payload={}))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert [point.id for point in client.upsert.call_args.kwargs["points"]] == ["point-1", "point-2"]
+    assert client.upsert.call_args.kwargs["wait"] is True
+
+    buffer.add(models.PointStruct(id="point-3", vector=[0.3], payload={}))
+    await asyncio.sleep(0.05)
+    assert client.upsert.call_count == 2
+
+    buffer.add(models.PointStruct(id="point-4", vector=[0.4], payload={}))
+    assert buffer.discard("point-4")
+    buffer.add(models.PointStruct(id="point-5", vector=[0.5], payload={}))
+    await buffer.close()
+    assert [point.id for point in client.upsert.call_args.kwargs["points"]] == ["point-5"]
+    assert buffer.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_write_behind_retry():
+    """
+    Points of a failed upsert are written again after the interval, without waiting for another point.
+    """
+    client = MagicMock(upsert=AsyncMock(side_effect=[RuntimeError("Qdrant unavailable"), None]))
+    buffer = WriteBehindBuffer(client, "llm_cache", batch_size=10, interval=0.01)
+
+    buffer.add(models.PointStruct(id="point-1", vector=[0.1], payload={}))
+    await asyncio.sleep(0.05)
+    assert client.upsert.call_count == 2
+    assert [point.id for point in client.upsert.call_args.kwargs["points"]] == ["point-1"]
+    assert buffer.pending == 0
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_in_flight():
+    """
+    Points of a running flush count as buffered until Qdrant has applied the upsert.
+    """
+    applied = asyncio.Event()
+
+    async def upsert(**kwargs) -> None:
+        await applied.wait()
+
+    buffer = WriteBehindBuffer(MagicMock(upsert=upsert), "llm_cache", batch_size=1, interval=0.01)
+    buffer.add(models.PointStruct(id="point-1", vector=[0.1], payload={}))
+    await asyncio.sleep(0)
+    assert buffer.pending == 0
+    assert "point-1" in buffer
+
+    applied.set()
+    await buffer.close()
+    assert "point-1" not in buffer
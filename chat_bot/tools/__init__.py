@@ -1,5 +1,24 @@
+from .background import TaskSupervisor
+from .batch import BatchProcessor
+from .cache_manager import CacheManager
 from .chat_pipeline import PipeLine
+from .clients import ClientRegistry
+from .context import ContextBuilder
 from .llm import LLM, EmbeddingModel
+from .numpy_retriever import NumpyRetriever
 from .retriever import Qdrant
+from .stream_buffer import StreamBuffer
 
-__all__ = ["PipeLine", "LLM", "EmbeddingModel", "Qdrant"]
+__all__ = [
+    "PipeLine",
+    "ClientRegistry",
+    "ContextBuilder",
+    "LLM",
+    "EmbeddingModel",
+    "Qdrant",
+    "NumpyRetriever",
+    "StreamBuffer",
+    "TaskSupervisor",
+    "CacheManager",
+    "BatchProcessor",
+]
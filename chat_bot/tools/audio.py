@@ -0,0 +1,79 @@
+import io
+import wave
+
+import numpy as np
+
+SAMPLE_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def frame_energy(samples: np.ndarray, frame_size: int) -> np.ndarray:
+    """
+    Root mean square energy of every frame of `frame_size` samples, the last partial frame dropped.
+
+    Args:
+        samples (np.ndarray): Mono float samples.
+        frame_size (int): Number of samples per frame.
+
+    Returns:
+        np.ndarray: The energy of each frame.
+    """
+    frames = samples[: len(samples) // frame_size * frame_size].reshape(-1, frame_size)
+    return np.sqrt(np.mean(np.square(frames), axis=1))
+
+
+def split_wav(audio: bytes, segment_seconds: float, frame_ms: int = 30, window_ms: int = 300) -> list[bytes]:
+    """
+    Split a PCM WAV recording at silences into segments of about `segment_seconds`.
+
+    The cut of each segment is the quietest stretch of `window_ms`, by frame energy, between half and
+    the full segment length, so words are not cut in the middle. Each segment is a WAV file of its own.
+    Recordings that are not PCM WAV, or not longer than a segment, are returned as they are.
+
+    Args:
+        audio (bytes): The recording.
+        segment_seconds (float): Target length of the segments, in seconds.
+        frame_ms (int, optional): Length of the frames the energy is measured on. Defaults to 30.
+        window_ms (int, optional): Length of the silence looked for at each cut. Defaults to 300.
+
+    Returns:
+        list[bytes]: The segments, in order.
+    """
+    try:
+        with wave.open(io.BytesIO(audio)) as reader:
+            params = reader.getparams()
+            pcm = reader.readframes(params.nframes)
+    except (wave.Error, EOFError):
+        return [audio]
+    if params.sampwidth not in SAMPLE_TYPES or params.nframes <= segment_seconds * params.framerate:
+        return [audio]
+
+    samples = np.frombuffer(pcm[: len(pcm) // params.sampwidth * params.sampwidth], dtype=SAMPLE_TYPES[params.sampwidth])
+    samples = samples.astype(np.float32).reshape(-1, params.nchannels).mean(axis=1)
+    if params.sampwidth == 1:
+        # 8-bit WAV samples are unsigned
+        samples -= 128
+
+    frame_size = max(1, params.framerate * frame_ms // 1000)
+    energy = frame_energy(samples, frame_size)
+    # Smooth the energy over the window, so a cut falls in a pause rather than between two syllables
+    width = max(1, window_ms // frame_ms)
+    energy = np.convolve(energy, np.ones(width) / width, mode="same")
+
+    # Segments shorter than a frame are a frame long, so every cut moves forward
+    segment_frames = max(1, int(segment_seconds * 1000 // frame_ms))
+    cuts = [0]
+    while len(energy) - cuts[-1] > segment_frames:
+        low = cuts[-1] + max(1, segment_frames // 2)
+        high = max(low + 1, cuts[-1] + segment_frames)
+        cuts.append(low + int(np.argmin(energy[low:high])))
+    bounds = [cut * frame_size for cut in cuts] + [len(samples)]
+
+    block = params.sampwidth * params.nchannels
+    segments = []
+    for start, stop in zip(bounds, bounds[1:], strict=False):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as writer:
+            writer.setparams(params)
+            writer.writeframes(pcm[start * block : stop * block])
+        segments.append(buffer.getvalue())
+    return segments
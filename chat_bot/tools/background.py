@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+from starlette.websockets import WebSocketDisconnect
+from tenacity import AsyncRetrying, retry_if_not_exception_type, stop_after_attempt, wait_random
+
+logger = logging.getLogger("chatbot")
+
+
+class TaskSupervisor:
+    def __init__(self, max_concurrency: int, attempts: int):
+        """
+        Initialize the supervisor of the background work of the worker process.
+
+        Jobs run as tasks outside the WebSocket transaction that spawned them, with at most
+        `max_concurrency` of them running at the same time. They are drained on shutdown.
+
+        Args:
+            max_concurrency (int): Maximum number of jobs running at the same time.
+            attempts (int): Number of attempts of each step run through `retrying`.
+        """
+        self.attempts = attempts
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def spawn(self, name: str, job: Callable[[], Awaitable[None]]) -> asyncio.Task[None]:
+        """
+        Run a job in the background once a slot is free.
+
+        Args:
+            name (str): Name of the job, used in the logs.
+            job (Callable): The job to run.
+
+        Returns:
+            asyncio.Task: The task of the job.
+        """
+        task = asyncio.create_task(self._run(name, job), name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, name: str, job: Callable[[], Awaitable[None]]) -> None:
+        async with self._slots:
+            try:
+                await job()
+            except Exception:  # pragma: no cover
+                logger.exception("[Background] Job %s failed", name)
+
+    async def retrying(self, step: Callable[[], Awaitable[None]]) -> None:
+        """
+        Run a step of a job, retrying it on failure. A disconnected client is never retried.
+
+        Args:
+            step (Callable): The step to run.
+        """
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self.attempts),
+            wait=wait_random(min=0.5, max=2),
+            retry=retry_if_not_exception_type((WebSocketDisconnect, asyncio.CancelledError)),
+            reraise=True,
+        ):
+            with attempt:
+                await step()
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Wait for the running jobs to finish, cancelling those still running after the timeout.
+
+        Args:
+            timeout (float): Seconds to wait for the jobs.
+        """
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:  # pragma: no cover
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+from collections.abc import AsyncIterator, Iterable
+from typing import Any
+
+from qdrant_client.conversions import common_types as types
+
+from chat_bot.core.config import settings
+
+from .chat_pipeline import EventType, PipeLine
+from .clients import ClientRegistry
+from .context import ContextBuilder, load_encoding
+
+logger = logging.getLogger("chatbot")
+
+
+class EventCollector:
+    def __init__(self):
+        """
+        Stand-in for the WebSocket of a batch question, keeping the events the pipeline sends.
+        """
+        self.events: list[dict[str, Any]] = []
+
+    async def send_json(self, data: dict[str, Any]) -> None:
+        self.events.append(data)
+
+    def errors(self) -> list[str]:
+        return [event["payload"]["data"] for event in self.events if event["type"] == EventType.EXCEPTION]
+
+
+class BatchProcessor:
+    def __init__(self, clients: ClientRegistry, openai_key: str, concurrency: int, batch_size: int, skip_cache: bool = False):
+        """
+        Answer many questions without a WebSocket, e.g. to pre-warm the cache collection or to evaluate answers.
+
+        Questions are embedded in bulk and searched with one batched query per collection for every
+        `batch_size` questions. The LLM calls of the cache misses then run with at most `concurrency`
+        of them at the same time, and their answers are stored in the cache collection.
+
+        Args:
+            clients (ClientRegistry): The registry handing out the LLM, embedding model and vector store.
+            openai_key (str): The OpenAI API key the questions are answered with.
+            concurrency (int): Maximum number of questions answered at the same time.
+            batch_size (int): Number of questions embedded and searched per request.
+            skip_cache (bool, optional): Answer every question with the LLM, even if it is cached. Defaults to False.
+        """
+        self.llm_model = clients.llm(model=settings.OPENAI_BASE_MODEL, temperature=0, openai_key=openai_key)
+        self.embedding_model = clients.embedding_model(model=settings.OPENAI_EMBEDDING_BASE_MODEL, openai_key=openai_key)
+        self.vector_store = clients.vector_store()
+        self.batch_size = batch_size
+        self.skip_cache = skip_cache
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @staticmethod
+    def parse(index: int, line: str) -> dict[str, Any]:
+        """
+        Parse a JSONL line: `question` and `resource` are required, `language` defaults to english and
+        `suggested_question` to true, so the cached answers come with their follow-up questions.
+        """
+        item = json.loads(line)
+        if not isinstance(item, dict) or not item.get("question") or not item.get("resource"):
+            raise ValueError("question and resource are required")
+        return {
+            "index": index,
+            "question": str(item["question"]),
+            "resource": str(item["resource"]),
+            "language": str(item.get("language") or "english"),
+            "suggested_question": bool(item.get("suggested_question", True)),
+        }
+
+    def make_pipeline(self, item: dict[str, Any]) -> PipeLine:
+        return PipeLine(
+            llm_model=self.llm_model,
+            embedding_model=self.embedding_model,
+            vector_store=self.vector_store,
+            websocket=EventCollector(),  # type: ignore[arg-type]
+            resource=item["resource"],
+            response_language=item["language"],
+            text_data=item["question"],
+            suggested_question=item["suggested_question"],
+            skip_cache=self.skip_cache,
+            context_builder=ContextBuilder(model=settings.OPENAI_BASE_MODEL, token_budget=settings.CONTEXT_TOKEN_BUDGET),
+        )
+
+    async def prepare(self, items: list[dict[str, Any]]) -> list[PipeLine]:
+        """
+        Embed the questions in bulk and run the cache and main collection searches as batched queries.
+        """
+        pipelines = [self.make_pipeline(item) for item in items]
+        embeddings = await self.embedding_model.aembed_documents([item["question"] for item in items])
+        for pipeline, embedding in zip(pipelines, embeddings, strict=True):
+            pipeline.embeddings = embedding
+
+        misses = pipelines
+        if not self.skip_cache:
+            responses = await self.vector_store.search_batch(
+                self.vector_store.cache_collection,
+                embeddings,
+                [pipeline.cache_filter for pipeline in pipelines],
+                limit=1,
+                score_threshold=self.vector_store.cache_hit_score,
+            )
+            for pipeline, response in zip(pipelines, responses, strict=True):
+                pipeline.cache_response = response if response.points else None
+            misses = [pipeline for pipeline in pipelines if not pipeline.cache_response]
+
+        responses = await self.vector_store.search_batch(
+            self.vector_store.main_collection,
+            [pipeline.embeddings for pipeline in misses],
+            [[("metadata.resource", pipeline.resource)] for pipeline in misses],
+            limit=self.vector_store.search_limit,
+            score_threshold=self.vector_store.search_score_threshold,
+        )
+        for pipeline, response in zip(misses, responses, strict=True):
+            pipeline.similar_documents = types.QueryResponse(points=response.points) if response.points else None
+            pipeline.similarity_searched = True
+        return pipelines
+
+    async def answer(self, item: dict[str, Any], pipeline: PipeLine) -> dict[str, Any]:
+        """
+        Answer a prepared question from the cache, or with the LLM, and describe the outcome.
+        """
+        cached = bool(pipeline.cache_response and pipeline.cache_response.points)
+        try:
+            if cached:
+                point = pipeline.cache_response.points[0]
+                pipeline.llm_response = point.payload["llm_response"]
+                pipeline.suggested_question_list = point.payload["metadata"]["suggested_questions"]
+                point_id = str(point.id)
+            else:
+                await pipeline.process_user_query()
+                point_id = next(
+                    (event["payload"]["data"] for event in pipeline.websocket.events if event["type"] == EventType.MESSAGE_THREAD),  # type: ignore[attr-defined]
+                    None,
+                )
+        except Exception as e:
+            logger.exception("[Batch] Question %s failed", item["index"])
+            return item | {"error": f"{e.__class__.__name__}: {e}"}
+        errors = pipeline.websocket.errors()  # type: ignore[attr-defined]
+        return item | {
+            "answer": pipeline.llm_response,
+            "suggested_questions": pipeline.suggested_question_list,
+            "point_id": point_id,
+            "cached": cached,
+            "error": errors[0] if errors else None,
+        }
+
+    async def run(self, lines: Iterable[str]) -> AsyncIterator[dict[str, Any]]:
+        """
+        Answer the questions of a JSONL document and yield the results as they complete.
+
+        Every result carries the `index` of its line, since the answers complete out of order.
+
+        Args:
+            lines (Iterable[str]): The JSONL lines.
+
+        Yields:
+            dict: The question with its answer, suggested questions, cache point ID, whether it was
+                served from the cache, and the error if it failed.
+        """
+        await asyncio.to_thread(load_encoding, settings.OPENAI_BASE_MODEL)
+        results: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        tasks: set[asyncio.Task[None]] = set()
+
+        async def answer(item: dict[str, Any], pipeline: PipeLine) -> None:
+            try:
+                await results.put(await self.answer(item, pipeline))
+            finally:
+                self._slots.release()
+
+        async def produce() -> None:
+            try:
+                items: list[dict[str, Any]] = []
+                for index, line in enumerate(lines):
+                    if not line.strip():
+                        continue
+                    try:
+                        items.append(self.parse(index, line))
+                    except ValueError as e:
+                        await results.put({"index": index, "error": f"Invalid line: {e}"})
+                for start in range(0, len(items), self.batch_size):
+                    chunk = items[start : start + self.batch_size]
+                    try:
+                        pipelines = await self.prepare(chunk)
+                    except Exception as e:
+                        logger.exception("[Batch] Questions %s to %s failed", chunk[0]["index"], chunk[-1]["index"])
+                        for item in chunk:
+                            await results.put(item | {"error": f"{e.__class__.__name__}: {e}"})
+                        continue
+                    for item, pipeline in zip(chunk, pipelines, strict=True):
+                        # Wait for a free slot, so the next chunk is only prepared once answers are needed
+                        await self._slots.acquire()
+                        task = asyncio.create_task(answer(item, pipeline))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (result := await results.get()) is not None:
+                yield result
+        finally:
+            # The consumer stopped early, e.g. the HTTP client disconnected
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import IO
+
+from .retriever import Qdrant, point_key
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows, where every worker compacts
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger("chatbot")
+
+# Elects the worker of a host that compacts the cache collection
+COMPACTION_LOCK_PATH = Path(tempfile.gettempdir()) / "chatbot-compaction.lock"
+
+
+def try_lock(lock_file: IO[str]) -> bool:
+    """
+    Take an exclusive lock on an open file without waiting. The lock is held until the file is closed.
+
+    Args:
+        lock_file (IO[str]): The open lock file.
+
+    Returns:
+        bool: Whether the lock is held.
+    """
+    if fcntl is None:  # pragma: no cover
+        return True
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class CacheManager:
+    def __init__(self, vector_store: Qdrant, max_points: int, time_to_live: float, batch_size: int = 1000):
+        """
+        Initialize the manager of the cache collection.
+
+        Every cache point records `created_at`, `last_hit_at` and `hit_count` in its metadata. Hits are
+        counted in memory and written in batches, and the compaction removes expired points and keeps
+        at most `max_points` per `metadata.resource`, evicting the least frequently used points first.
+
+        Args:
+            vector_store (Qdrant): The vector store holding the cache collection.
+            max_points (int): Maximum number of points kept per resource. 0 keeps every point.
+            time_to_live (float): Seconds after which a point is removed. 0 keeps points forever.
+            batch_size (int, optional): Number of points scrolled or deleted per request. Defaults to 1000.
+        """
+        self.vector_store = vector_store
+        self.max_points = max_points
+        self.time_to_live = time_to_live
+        self.batch_size = batch_size
+        # Point ID -> (hits since the last flush, time of the last hit)
+        self._hits: dict[str, tuple[int, float]] = {}
+
+    def record_hit(self, point_id: str) -> None:
+        """
+        Count a cache hit. The counters are written on the next `flush_hits`.
+
+        Args:
+            point_id (str): The point that was served.
+        """
+        point_id = point_key(point_id)
+        count, _ = self._hits.get(point_id, (0, 0.0))
+        self._hits[point_id] = (count + 1, time.time())
+
+    async def flush_hits(self) -> None:
+        """
+        Add the counted hits to the `hit_count` and `last_hit_at` of the points.
+
+        Only these two fields of the metadata are written, so a concurrent update of the other fields
+        is kept. The count is read and written back, and two workers flushing hits of the same point at
+        once may lose some of them: the counts only rank points for the eviction and are approximate.
+        """
+        hits, self._hits = self._hits, {}
+        if not hits:
+            return
+        client, collection = self.vector_store.client, self.vector_store.cache_collection
+        # Points deleted in the meantime are not returned and their hits are dropped
+        records = await client.retrieve(collection_name=collection, ids=list(hits), with_payload=["metadata"])
+        updates = []
+        for record in records:
+            count, last_hit_at = hits[point_key(record.id)]
+            metadata = (record.payload or {}).get("metadata", {})
+            payload = {"hit_count": metadata.get("hit_count", 0) + count, "last_hit_at": last_hit_at}
+            updates.append(client.set_payload(collection_name=collection, payload=payload, points=[record.id], key="metadata", wait=False))
+        await asyncio.gather(*updates)
+
+    async def compact(self) -> dict[str, int]:
+        """
+        Enforce the time to live and the per-resource size limit of the cache collection.
+
+        Points stored before the timestamps were recorded are stamped with the current time, so they
+        expire one time to live later instead of all at once.
+
+        Returns:
+            dict[str, int]: Number of expired, evicted and kept points.
+        """
+        now = time.time()
+        client, collection = self.vector_store.client, self.vector_store.cache_collection
+        resources: defaultdict[str | None, list[tuple[int, float, str]]] = defaultdict(list)
+        expired: list[str] = []
+        unstamped: list[str] = []
+
+        offset = None
+        while True:
+            records, offset = await client.scroll(
+                collection_name=collection,
+                limit=self.batch_size,
+                offset=offset,
+                with_payload=["metadata"],
+                with_vectors=False,
+            )
+            for record in records:
+                point_id = point_key(record.id)
+                metadata = (record.payload or {}).get("metadata", {})
+                created_at = metadata.get("created_at")
+                if created_at is None:
+                    unstamped.append(point_id)
+                    created_at = now
+                if self.time_to_live and now - created_at > self.time_to_live:
+                    expired.append(point_id)
+                    continue
+                last_hit_at = metadata.get("last_hit_at") or created_at
+                resources[metadata.get("resource")].append((metadata.get("hit_count", 0), last_hit_at, point_id))
+            if offset is None:
+                break
+
+        evicted: list[str] = []
+        if self.max_points:
+            for points in resources.values():
+                if len(points) > self.max_points:
+                    # Least frequently used first, the least recently used among equals
+                    points.sort()
+                    evicted.extend(point_id for _, _, point_id in points[: len(points) - self.max_points])
+
+        if unstamped:
+            await client.set_payload(collection_name=collection, payload={"created_at": now}, points=unstamped, key="metadata")
+        removed = expired + evicted
+        for start in range(0, len(removed), self.batch_size):
+            await self.vector_store.delete_points(removed[start : start + self.batch_size])
+
+        kept = sum(len(points) for points in resources.values()) - len(evicted)
+        return {"expired": len(expired), "evicted": len(evicted), "kept": kept}
+
+    async def run(self, interval: float, lock_path: Path | None = None) -> None:
+        """
+        Flush the hits and compact the cache collection every `interval` seconds, until cancelled.
+
+        Every worker flushes the hits it counted, but with a `lock_path` only the worker holding the
+        lock compacts. The lock is released when the worker stops, and another worker takes it over
+        on its next run.
+
+        Args:
+            interval (float): Seconds between two compactions.
+            lock_path (Path | None, optional): Lock file shared by the workers of the host. Defaults to
+                compacting in every worker.
+        """
+        lock_file = await asyncio.to_thread(lock_path.open, "a") if lock_path is not None else None
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush_hits()
+                    if lock_file is None or try_lock(lock_file):
+                        logger.info("[Cache Compaction] %s", await self.compact())
+                except Exception:  # pragma: no cover
+                    logger.exception("[Cache Compaction] Failed")
+        finally:
+            if lock_file is not None:
+                lock_file.close()
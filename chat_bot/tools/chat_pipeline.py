@@ -1,13 +1,24 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from contextlib import aclosing, suppress
 from enum import Enum
 
 from fastapi import WebSocket
-from langchain_core.output_parsers import NumberedListOutputParser, StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from qdrant_client.conversions import common_types as types
+from starlette.websockets import WebSocketDisconnect
 
+from .background import TaskSupervisor
+from .cache_manager import CacheManager
+from .context import ContextBuilder
 from .llm import LLM, EmbeddingModel
-from .prompts import CHAT_PROMPT, SUGGESTED_QUESTION_PROMPT
+from .prompts import PROMPT_VERSION
 from .retriever import Qdrant
+from .semantic_cache import normalize_query
+from .stream_buffer import StreamBuffer
+
+logger = logging.getLogger("chatbot")
 
 
 class EventType(str, Enum):
@@ -29,10 +40,17 @@ class PipeLine:
         resource: str,
         response_language: str,
         chat_message_id: str | None = None,
-        audio_data: str = "",
+        audio_data: str | bytes | bytearray = "",
         text_data: str = "",
         suggested_question: bool = False,
         skip_cache: bool = False,
+        speculative_search: bool = False,
+        transaction_id: str | None = None,
+        stream_buffer: StreamBuffer | None = None,
+        context_builder: ContextBuilder | None = None,
+        background: TaskSupervisor | None = None,
+        cache_manager: CacheManager | None = None,
+        on_offload: Callable[[asyncio.Task[None]], None] | None = None,
     ):
         """
         Initialize the pipeline.
@@ -44,10 +62,17 @@ class PipeLine:
             websocket: The WebSocket to use.
             resource: The type of resource.
             chat_message_id: The ID of the chat message.
-            audio_data: The base64 encoded audio data.
+            audio_data: The base64 encoded audio data, or the raw audio bytes of a binary upload.
             text_data: The plain text data.
             suggested_question: Whether to generate a suggested question.
             skip_cache: Whether to skip the cache.
+            speculative_search: Whether to query the main collection together with the cache lookup.
+            transaction_id: The correlation ID added to every event of this transaction.
+            stream_buffer: Coalesces LLM chunks into fewer streaming events. Defaults to one event per chunk.
+            context_builder: Packs the search results into the prompt context. Defaults to every result.
+            background: Runs the post-answer steps in the background. Defaults to running them inline.
+            cache_manager: Counts the cache hits used by the cache compaction.
+            on_offload: Called with the task of the post-answer steps, e.g. to cancel it with the transaction.
         """
         self.llm_model = llm_model
         self.embedding_model = embedding_model
@@ -59,15 +84,41 @@ class PipeLine:
         self.similar_documents: types.QueryResponse = types.QueryResponse(points=[])
         self.cache_response: types.QueryResponse = types.QueryResponse(points=[])
         self.llm_response: str = ""
-        self.b64_text: str = audio_data
+        self.audio_data: str | bytes | bytearray = audio_data
         self.plain_text: str = text_data
         self.response_language: str = response_language
         self.suggested_question: bool = suggested_question
         self.suggested_question_list: list[str] = []
         self.skip_cache: bool = skip_cache
+        self.speculative_search: bool = speculative_search
+        self.similarity_searched: bool = False
+        self.transaction_id: str | None = transaction_id
+        self.disconnected: bool = False
+        self.stream_buffer: StreamBuffer | None = stream_buffer
+        self.context_builder: ContextBuilder | None = context_builder
+        self.background: TaskSupervisor | None = background
+        self.offloaded: bool = False
+        self.cache_manager: CacheManager | None = cache_manager
+        self.on_offload: Callable[[asyncio.Task[None]], None] | None = on_offload
+
+    async def emit(self, event_type: str, payload: dict[str, str | list[str] | bool]) -> None:
+        """
+        Send an event to the client.
 
-    async def emit(self, event_type: str, payload: dict[str, str | list[str]]) -> None:
-        await self.websocket.send_json({"type": event_type, "payload": payload})
+        Once the client has disconnected, events are dropped. The send that detects the
+        disconnection raises `WebSocketDisconnect`, which stops the running generation.
+        """
+        if self.disconnected:
+            return
+        event: dict[str, str | dict[str, str | list[str] | bool]] = {"type": event_type, "payload": payload}
+        if self.transaction_id:
+            event["transaction_id"] = self.transaction_id
+        try:
+            await self.websocket.send_json(event)
+        except (WebSocketDisconnect, RuntimeError) as e:
+            # Starlette raises RuntimeError when sending after the socket was closed
+            self.disconnected = True
+            raise WebSocketDisconnect() from e
 
     async def to_vector(self, query: str) -> "PipeLine":
         """
@@ -82,19 +133,60 @@ class PipeLine:
         self.embeddings = await self.embedding_model.aembed_query(query)
         return self
 
+    @property
+    def cache_filter(self) -> list[tuple[str, str]]:
+        """
+        The payload conditions a cache point must match to be served for this message.
+
+        An answer is only replayed for the same resource and response language, and only if it was
+        generated by the same model with the same prompts.
+        """
+        return [
+            ("metadata.resource", self.resource),
+            ("metadata.response_language", self.response_language),
+            ("metadata.model", self.llm_model.model),
+            ("metadata.prompt_version", PROMPT_VERSION),
+        ]
+
+    @property
+    def exact_cache_key(self) -> tuple:
+        """
+        The exact-match cache key of this message: cache scope and normalized query text.
+        """
+        return tuple(self.cache_filter), normalize_query(self.plain_text)
+
+    async def get_from_exact_cache(self) -> bool:
+        """
+        Look the normalized query up in the exact-match index of the vector store, before any embedding call.
+
+        Returns:
+            True if the exact-match index answered the query.
+        """
+        exact_cache = self.vector_store.exact_cache
+        point = exact_cache.get(self.exact_cache_key) if exact_cache is not None else None
+        # A single dictionary lookup, unless memory hits are verified in Qdrant
+        if point is None or self.vector_store.verify_memory_hits and not await self.vector_store.confirm_cached(point.id):
+            return False
+        self.cache_response = types.QueryResponse(points=[point])
+        return True
+
     async def _query_points(
         self,
         collection: str,
+        query_filter: list[tuple[str, str]],
         limit: int | None = None,
         score_threshold: float | None = None,
+        with_vectors: bool = False,
     ):
         """
         Query the vector store for points within the specified collection.
 
         Args:
             collection: The name of the collection to query.
+            query_filter: The payload conditions the points must match.
             limit: The maximum number of points to return. If None, all points are returned.
             score_threshold: The minimum score a point must have to be included in the results. If None, all points are returned.
+            with_vectors: Whether to return the point vectors.
 
         Returns:
             A QueryResponse object containing the results of the query.
@@ -102,11 +194,28 @@ class PipeLine:
         return await self.vector_store.search(
             collection_name=collection,
             embedding=self.embeddings,
-            query_filter=[("metadata.resource", self.resource)],
+            query_filter=query_filter,
             limit=limit,
             score_threshold=score_threshold,
+            with_vectors=with_vectors,
         )
 
+    async def get_from_local_cache(self) -> bool:
+        """
+        Query the in-process cache tier of the vector store, without any vector search.
+
+        Returns:
+            True if the local tier answered the query.
+        """
+        local_cache = self.vector_store.local_cache
+        if local_cache is None:
+            return False
+        point = local_cache.lookup(tuple(self.cache_filter), self.embeddings, self.vector_store.cache_hit_score)
+        if point is None or self.vector_store.verify_memory_hits and not await self.vector_store.confirm_cached(point.id):
+            return False
+        self.cache_response = types.QueryResponse(points=[point])
+        return True
+
     async def get_from_cache(self) -> "PipeLine":
         """
         Query the cache for points within the specified collection.
@@ -115,30 +224,49 @@ class PipeLine:
         The score_threshold parameter is set to the cache_hit_score.
         Only one point is returned.
 
+        The in-process tier is checked first; points found in Qdrant are copied into it.
+
         Returns:
             The modified pipeline.
         """
+        if await self.get_from_local_cache():
+            return self
+
+        local_cache = self.vector_store.local_cache
         query_response = await self._query_points(
             collection=self.vector_store.cache_collection,
+            query_filter=self.cache_filter,
             score_threshold=self.vector_store.cache_hit_score,
             limit=1,
+            with_vectors=local_cache is not None,
         )
+        if local_cache is not None:
+            for point in query_response.points:
+                if isinstance(point.vector, list):
+                    local_cache.add(tuple(self.cache_filter), str(point.id), point.vector, point.payload)
         self.cache_response = query_response if query_response.points else None
         return self
 
-    async def audio_to_text(self, audio_base64_text) -> "PipeLine":
+    async def audio_to_text(self, audio: str | bytes | bytearray) -> "PipeLine":
         """
         Transcribe an audio file to text and send the text to the client.
 
+        The text of a long recording transcribed in segments is also sent as it grows, in
+        `AUDIO_TO_TEXT` events marked `partial`, before the event with the whole text.
+
         Args:
-            audio_base64_text (str): The base64 encoded audio data.
+            audio (str | bytes | bytearray): The base64 encoded audio data, or the raw audio bytes.
 
         Returns:
             The modified pipeline.
         """
 
+        async def on_partial(text: str) -> None:
+            # Stream the beginning of a long recording while the rest is still transcribed
+            await self.emit(event_type=EventType.AUDIO_TO_TEXT, payload={"data": text, "partial": True})
+
         # Transcribe the audio to text
-        self.plain_text = await self.llm_model.audio_transcription(audio_base64_text)
+        self.plain_text = await self.llm_model.audio_transcription(audio, on_partial=on_partial)
 
         # Send the transcribed text to the client
         await self.emit(event_type=EventType.AUDIO_TO_TEXT, payload={"data": self.plain_text})
@@ -150,13 +278,51 @@ class PipeLine:
         Perform a similarity search on the main collection.
 
         The points returned from this query are the most similar to the query
-        embeddings and are used to generate the suggested questions.
+        embeddings and are used to generate the suggested questions. At most
+        `search_limit` points scoring at least `search_score_threshold` are returned.
 
         Returns:
             The modified pipeline.
         """
-        query_response = await self._query_points(collection=self.vector_store.main_collection)
+        query_response = await self._query_points(
+            collection=self.vector_store.main_collection,
+            query_filter=[("metadata.resource", self.resource)],
+            limit=self.vector_store.search_limit,
+            score_threshold=self.vector_store.search_score_threshold,
+        )
         self.similar_documents = query_response if query_response.points else None
+        self.similarity_searched = True
+        return self
+
+    async def get_from_cache_with_search(self) -> "PipeLine":
+        """
+        Query the cache and the main collection concurrently.
+
+        The cache lookup and the similarity search are sent at the same time, so a cache
+        miss does not pay for a second sequential round trip. The similarity search is
+        cancelled as soon as the cache hits. The two collections cannot share a single
+        `query_batch_points` call, as Qdrant batches queries per collection.
+
+        Returns:
+            The modified pipeline.
+        """
+        if await self.get_from_local_cache():
+            return self
+        search = asyncio.create_task(self.similarity_search())
+        try:
+            await self.get_from_cache()
+        except BaseException:
+            search.cancel()
+            # Wait for the search to stop, its own outcome is of no interest anymore
+            with suppress(asyncio.CancelledError, Exception):
+                await search
+            raise
+        if self.cache_response:
+            search.cancel()
+            with suppress(asyncio.CancelledError):
+                await search
+        else:
+            await search
         return self
 
     async def store_llm_response(self) -> None:
@@ -168,21 +334,35 @@ class PipeLine:
         so that they can be retrieved quickly in case the user asks for the same thing
         again.
         """
+        page_content = {
+            # Store the LLM response
+            "llm_response": self.llm_response,
+            # Message dependencies
+            "metadata": {
+                # Store the suggested questions
+                "suggested_questions": self.suggested_question_list,
+                # Cache scope, see `cache_filter`
+                "resource": self.resource,
+                "response_language": self.response_language,
+                "model": self.llm_model.model,
+                "prompt_version": PROMPT_VERSION,
+                # Bookkeeping of the cache compaction
+                "created_at": time.time(),
+                "last_hit_at": None,
+                "hit_count": 0,
+            },
+        }
         # Store the LLM response in the cache collection
         point_id = await self.vector_store.upsert(
             collection=self.vector_store.cache_collection,
             embedding=self.embeddings,
-            page_content={
-                # Store the LLM response
-                "llm_response": self.llm_response,
-                # Message dependencies
-                "metadata": {
-                    # Store the suggested questions
-                    "suggested_questions": self.suggested_question_list,
-                    "resource": self.resource,
-                },
-            },
+            page_content=page_content,
         )
+        # Keep the in-process tiers in step with the cache collection
+        if self.vector_store.local_cache is not None:
+            self.vector_store.local_cache.add(tuple(self.cache_filter), point_id, self.embeddings, page_content)
+        if self.vector_store.exact_cache is not None:
+            self.vector_store.exact_cache.add(self.exact_cache_key, point_id, page_content)
         # Send the message thread to the client
         await self.emit(event_type=EventType.MESSAGE_THREAD, payload={"data": point_id})
 
@@ -198,20 +378,32 @@ class PipeLine:
             None
         """
         response = ""
-        # Create a processing chain for the language model
-        chain = ChatPromptTemplate.from_template(CHAT_PROMPT) | self.llm_model.chat_model | StrOutputParser()
-
-        # Prepare the context by formatting each document with page numbers
-        context = "\n".join(
-            f"[PageNumber-{rec.payload['metadata']['page_number']}]" + rec.payload["page_content"] for rec in self.similar_documents.points
-        )
-
-        # Stream the response in chunks
+        # The processing chain of the language model is built once per pooled LLM
+        chain = self.llm_model.chat_chain
+
+        # Prepare the context by formatting each document with page numbers, within the token budget if a builder is set
+        if self.context_builder:
+            context = self.context_builder.build(self.similar_documents.points)
+        else:
+            context = "\n".join(
+                f"[PageNumber-{rec.payload['metadata']['page_number']}]" + rec.payload["page_content"]
+                for rec in self.similar_documents.points
+            )
+
+        # Stream the response in chunks. The stream is closed as soon as the generation is
+        # cancelled or the client disconnects, so no more tokens are paid for.
         payload = {"QUERY": query, "CONTEXT": context, "RESPONSE_LANGUAGE": self.response_language}
-        async for chunk in chain.astream(payload):
-            response += chunk
-            # Send each chunk to the client
-            await self.emit(event_type=EventType.STREAMING, payload={"data": chunk})
+        async with aclosing(chain.astream(payload)) as stream:
+            async for chunk in stream:
+                response += chunk
+                # Send the chunk to the client, coalesced with its neighbours if a stream buffer is set
+                text = self.stream_buffer.push(chunk) if self.stream_buffer else chunk
+                if text:
+                    await self.emit(event_type=EventType.STREAMING, payload={"data": text})
+
+        # Send whatever is left in the buffer
+        if self.stream_buffer and (text := self.stream_buffer.flush()):
+            await self.emit(event_type=EventType.STREAMING, payload={"data": text})
 
         # Store the complete response
         self.llm_response = response
@@ -227,8 +419,8 @@ class PipeLine:
         Returns:
             None
         """
-        # Create a processing chain for the language model
-        chain = ChatPromptTemplate.from_template(SUGGESTED_QUESTION_PROMPT) | self.llm_model.chat_model | NumberedListOutputParser()
+        # The processing chain of the language model is built once per pooled LLM
+        chain = self.llm_model.questions_chain
 
         # Generate the suggested questions
         payload = {"QUESTION": query, "ANSWER": response, "RESPONSE_LANGUAGE": self.response_language}
@@ -256,6 +448,8 @@ class PipeLine:
         questions = self.cache_response.points[0].payload["metadata"]["suggested_questions"]
         # Get the point ID
         point_id = self.cache_response.points[0].id
+        if self.cache_manager is not None and point_id:
+            self.cache_manager.record_hit(str(point_id))
 
         # Send the cached response
         await self.emit(event_type=EventType.STREAMING, payload={"data": llm_response}) if llm_response else None
@@ -273,8 +467,9 @@ class PipeLine:
 
         If there is no similar context found, it will send an exception event.
         """
-        # Perform a similarity search in the vector store
-        await self.similarity_search()
+        # Perform a similarity search in the vector store, unless it already ran alongside the cache lookup
+        if not self.similarity_searched:
+            await self.similarity_search()
         # Generate a response using the language model
         if self.similar_documents:  # pragma: no cover
             # Generate a response using the language model
@@ -285,6 +480,13 @@ class PipeLine:
             return
         # Send a stop message
         await self.emit(event_type=EventType.STREAMING, payload={"data": "stream_end"})
+        if self.background is not None:
+            # Hand the post-answer steps over, the transaction ends once they are done
+            task = self.background.spawn(f"post-answer-{self.transaction_id}", self.complete_transaction)
+            if self.on_offload is not None:
+                self.on_offload(task)
+            self.offloaded = True
+            return
         # Generate suggested questions
         if self.suggested_question and self.llm_response:  # pragma: no cover
             # Generate suggested questions
@@ -292,6 +494,32 @@ class PipeLine:
         # Store the response in the vector store
         await self.store_llm_response() if self.llm_response else None
 
+    async def complete_transaction(self) -> None:
+        """
+        Run the post-answer steps in the background and end the transaction.
+
+        The suggested questions and the cache write are retried on failure by the task supervisor.
+        Their events are sent on the same socket, followed by the transaction end event. Nobody reads
+        the suggested questions of a disconnected client, and a stopped transaction skips both steps.
+        """
+        try:
+            if self.suggested_question and self.llm_response and not self.disconnected:
+                await self.background.retrying(lambda: self.generate_questions(query=self.plain_text, response=self.llm_response))
+            if self.llm_response:
+                await self.background.retrying(self.store_llm_response)
+        except asyncio.CancelledError:
+            with suppress(WebSocketDisconnect):
+                await self.emit(event_type=EventType.TRANSACTION, payload={"data": "chat_transaction_stopped"})
+            raise
+        except WebSocketDisconnect:  # pragma: no cover
+            logger.info("[Stopped] Transaction %s: client disconnected", self.transaction_id)
+        except Exception as e:  # pragma: no cover
+            with suppress(WebSocketDisconnect):
+                await self.emit(event_type=EventType.EXCEPTION, payload={"data": f"Something went wrong:: {e.__class__.__name__}: {e}."})
+        finally:
+            with suppress(WebSocketDisconnect):
+                await self.emit(event_type=EventType.TRANSACTION, payload={"data": "chat_transaction_end"})
+
     async def run(self) -> None:
         """
         Run the entire pipeline.
@@ -308,6 +536,10 @@ class PipeLine:
         Otherwise, it will generate a response using the language model and send it to the client.
 
         If there is an exception, it will send an exception event to the client.
+
+        If the transaction is cancelled (the client sent `stop_generation` or superseded it) or the
+        client disconnects, the LLM stream is closed and the suggested questions and the cache
+        write are skipped.
         """
         try:
             # Send the transaction start event
@@ -315,25 +547,33 @@ class PipeLine:
 
             # If there is no plain text, transcribe the audio to text
             if not self.plain_text:
-                if not self.b64_text:  # pragma: no cover
+                if not self.audio_data:  # pragma: no cover
                     # Send an exception event if there is no audio data
                     await self.emit(
                         event_type=EventType.EXCEPTION,
                         payload={"data": "No audio data found"},
                     )
                 # Transcribe the audio to text
-                await self.audio_to_text(self.b64_text)
+                await self.audio_to_text(self.audio_data)
+
+            # Serve a repeated question straight from the exact-match index, without embedding it
+            exact_hit = not self.skip_cache and await self.get_from_exact_cache()
 
             # Convert the text to a vector using the embedding model
-            await self.to_vector(query=self.plain_text)
+            if not exact_hit:
+                await self.to_vector(query=self.plain_text)
 
             # Send the stream start event
             await self.emit(event_type=EventType.STREAMING, payload={"data": "stream_start"})
 
             # Check if there is a cache hit
-            if not self.skip_cache:
-                # Get the cached response
-                await self.get_from_cache()
+            if not self.skip_cache and not exact_hit:
+                # Get the cached response, speculatively searching the main collection at the same time
+                await self.get_from_cache_with_search() if self.speculative_search else await self.get_from_cache()
+                # Remember the hit, so the same question skips the embedding call next time
+                if self.cache_response and self.cache_response.points and self.vector_store.exact_cache is not None:
+                    point = self.cache_response.points[0]
+                    self.vector_store.exact_cache.add(self.exact_cache_key, str(point.id), point.payload)
 
             if self.cache_response and self.cache_response.points:
                 # Process the cached response
@@ -345,9 +585,19 @@ class PipeLine:
             # If there is a chat message ID and the cache is not skipped, delete the point
             if self.chat_message_id and self.skip_cache:  # pragma: no cover
                 await self.vector_store.delete_point(self.chat_message_id)
+        except asyncio.CancelledError:
+            # The generation was stopped by the client, let it know before ending the transaction
+            with suppress(WebSocketDisconnect):
+                await self.emit(event_type=EventType.TRANSACTION, payload={"data": "chat_transaction_stopped"})
+            raise
+        except WebSocketDisconnect:
+            # The client is gone, nothing is left to send
+            logger.info("[Stopped] Transaction %s: client disconnected", self.transaction_id)
         except Exception as e:  # pragma: no cover
             # Send an exception event if there is an exception
             await self.emit(event_type=EventType.EXCEPTION, payload={"data": f"Something went wrong:: {e.__class__.__name__}: {e}."})
         finally:
-            # Send the transaction end event
-            await self.emit(event_type=EventType.TRANSACTION, payload={"data": "chat_transaction_end"})
+            # Send the transaction end event, unless the post-answer steps will send it
+            if not self.offloaded:
+                with suppress(WebSocketDisconnect):
+                    await self.emit(event_type=EventType.TRANSACTION, payload={"data": "chat_transaction_end"})
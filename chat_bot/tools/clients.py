@@ -0,0 +1,202 @@
+import logging
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import TypeVar
+
+import httpx
+from openai import DefaultAsyncHttpxClient
+from qdrant_client import models
+
+from chat_bot.core.config import settings
+
+from .cache_manager import CacheManager
+from .embedding_cache import DiskEmbeddingStore, EmbeddingCache
+from .llm import LLM, EmbeddingModel
+from .numpy_retriever import NumpyRetriever
+from .retriever import Qdrant
+from .semantic_cache import ExactMatchCache, SemanticCache
+from .transcription_cache import DiskTranscriptionStore, TranscriptionCache
+
+logger = logging.getLogger("chatbot")
+
+T = TypeVar("T")
+
+
+class ClientRegistry:
+    def __init__(self, max_keys: int = settings.CLIENT_POOL_MAX_KEYS):
+        """
+        Initialize the process-wide client registry.
+
+        The registry is created once per worker in the FastAPI lifespan and hands out
+        long-lived clients, so every message reuses the same connection pools instead
+        of paying for new TLS handshakes to Qdrant and OpenAI.
+
+        Args:
+            max_keys (int, optional): Maximum number of (OpenAI key, model) entries kept per pool.
+                The least recently used entry is evicted once the limit is reached.
+        """
+        self.max_keys = max_keys
+
+        # One keep-alive connection pool shared by every OpenAI client, whatever the API key
+        self.http_client: httpx.AsyncClient = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.embedding_cache = EmbeddingCache(
+            max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES,
+            time_to_live=settings.EMBEDDING_CACHE_TTL,
+            disk_store=DiskEmbeddingStore(
+                settings.EMBEDDING_DISK_CACHE_PATH, dimension=settings.EMBEDDING_DIMENSION, max_rows=settings.EMBEDDING_DISK_CACHE_MAX_ROWS
+            )
+            if settings.EMBEDDING_DISK_CACHE_PATH
+            else None,
+        )
+        self.transcription_cache = TranscriptionCache(
+            max_bytes=settings.TRANSCRIPTION_CACHE_MAX_BYTES,
+            time_to_live=settings.TRANSCRIPTION_CACHE_TTL,
+            disk_store=DiskTranscriptionStore(settings.TRANSCRIPTION_DISK_CACHE_PATH, time_to_live=settings.TRANSCRIPTION_CACHE_TTL)
+            if settings.TRANSCRIPTION_DISK_CACHE_PATH
+            else None,
+        )
+        self._vector_store: Qdrant | None = None
+        self._cache_manager: CacheManager | None = None
+        self._llms: OrderedDict[Hashable, LLM] = OrderedDict()
+        self._embedding_models: OrderedDict[Hashable, EmbeddingModel] = OrderedDict()
+
+    def _checkout(self, pool: "OrderedDict[Hashable, T]", key: Hashable, factory: Callable[[], T]) -> T:
+        """
+        Return the pooled instance for the key, creating it and evicting the least recently used entry if needed.
+
+        Args:
+            pool (OrderedDict): The pool to look the key up in.
+            key (Hashable): The pool key.
+            factory (Callable): Builds a new instance on a miss.
+
+        Returns:
+            The pooled instance.
+        """
+        if key in pool:
+            pool.move_to_end(key)
+            return pool[key]
+        instance = pool[key] = factory()
+        if len(pool) > self.max_keys:
+            # The shared HTTP client owns the sockets, so dropping the reference is enough
+            pool.popitem(last=False)
+        return instance
+
+    def llm(self, model: str, openai_key: str, temperature: float | int = 0) -> LLM:
+        """
+        Get a pooled LLM for the given OpenAI key, model and temperature.
+        """
+        return self._checkout(
+            self._llms,
+            (openai_key, model, temperature),
+            lambda: LLM(
+                model=model,
+                openai_key=openai_key,
+                temperature=temperature,
+                http_client=self.http_client,
+                transcription_cache=self.transcription_cache,
+                segment_seconds=settings.TRANSCRIPTION_SEGMENT_SECONDS,
+                transcription_concurrency=settings.TRANSCRIPTION_CONCURRENCY,
+            ),
+        )
+
+    def embedding_model(self, model: str, openai_key: str) -> EmbeddingModel:
+        """
+        Get a pooled EmbeddingModel for the given OpenAI key and model.
+        """
+        return self._checkout(
+            self._embedding_models,
+            (openai_key, model),
+            lambda: EmbeddingModel(
+                model=model,
+                openai_key=openai_key,
+                http_client=self.http_client,
+                cache=self.embedding_cache,
+                batch_window=settings.EMBEDDING_BATCH_WINDOW_MS / 1000,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+            ),
+        )
+
+    def vector_store(self) -> Qdrant:
+        """
+        Get the shared Qdrant vector store, creating it on first use.
+        """
+        if self._vector_store is None:
+            # Another worker may delete a cache point this worker holds in memory, e.g. on a re_generate:
+            # the point is then served until its memory entry expires
+            memory_ttl = (
+                settings.SEMANTIC_CACHE_TTL
+                if settings.WORKERS <= 1
+                else min(settings.SEMANTIC_CACHE_TTL, settings.SEMANTIC_CACHE_SHARED_TTL)
+            )
+            # The main collection is searched in process by the NumPy index if it is enabled
+            extra = {"index_path": settings.NUMPY_INDEX_PATH} if settings.NUMPY_RETRIEVER else {}
+            self._vector_store = (NumpyRetriever if settings.NUMPY_RETRIEVER else Qdrant)(
+                **extra,
+                cache_collection=settings.QDRANT_CACHE_COLLECTION,
+                main_collection=settings.QDRANT_MAIN_COLLECTION,
+                search_limit=settings.QDRANT_SEARCH_LIMIT,
+                cache_hit_score=settings.QDRANT_CACHE_SCORE,
+                search_score_threshold=settings.QDRANT_SEARCH_SCORE,
+                write_behind_size=settings.QDRANT_WRITE_BEHIND_SIZE,
+                write_behind_interval=settings.QDRANT_WRITE_BEHIND_INTERVAL_MS / 1000,
+                search_params=models.SearchParams(
+                    hnsw_ef=settings.QDRANT_HNSW_EF,
+                    # Search the quantized vectors, then rescore the oversampled candidates with the original vectors
+                    quantization=models.QuantizationSearchParams(rescore=True, oversampling=settings.QDRANT_SEARCH_OVERSAMPLING)
+                    if settings.QDRANT_QUANTIZATION != "none"
+                    else None,
+                ),
+                local_cache=SemanticCache(
+                    capacity=settings.SEMANTIC_CACHE_CAPACITY,
+                    time_to_live=memory_ttl,
+                    max_scopes=settings.SEMANTIC_CACHE_MAX_SCOPES,
+                )
+                if settings.SEMANTIC_CACHE_CAPACITY > 0
+                else None,
+                exact_cache=ExactMatchCache(capacity=settings.EXACT_CACHE_CAPACITY, time_to_live=memory_ttl)
+                if settings.EXACT_CACHE_CAPACITY > 0
+                else None,
+                verify_memory_hits=settings.SEMANTIC_CACHE_VERIFY,
+            )
+        return self._vector_store
+
+    def cache_manager(self) -> CacheManager:
+        """
+        Get the shared manager of the cache collection, creating it on first use.
+        """
+        if self._cache_manager is None:
+            self._cache_manager = CacheManager(
+                self.vector_store(),
+                max_points=settings.CACHE_MAX_POINTS_PER_RESOURCE,
+                time_to_live=settings.CACHE_POINT_TTL,
+            )
+        return self._cache_manager
+
+    async def aclose(self) -> None:
+        """
+        Close every pooled client. Called by the FastAPI lifespan on shutdown.
+        """
+        if self._cache_manager is not None:
+            try:
+                await self._cache_manager.flush_hits()
+            except Exception:
+                logger.exception("[Shutdown] Cache hits could not be written")
+            self._cache_manager = None
+        if self._vector_store is not None:
+            await self._vector_store.close()
+            self._vector_store = None
+        self._llms.clear()
+        self._embedding_models.clear()
+        await self.http_client.aclose()
+        self.embedding_cache.close()
+        self.transcription_cache.close()
+        logger.info(
+            "[Shutdown] Client registry closed, embedding cache: %s, transcription cache: %s",
+            self.embedding_cache.stats,
+            self.transcription_cache.stats,
+        )
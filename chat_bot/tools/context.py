@@ -0,0 +1,98 @@
+import logging
+
+import tiktoken
+from qdrant_client import models
+
+logger = logging.getLogger("chatbot")
+
+
+_encodings: dict[str, tiktoken.Encoding | None] = {}
+
+
+def load_encoding(model: str) -> tiktoken.Encoding | None:
+    """
+    Load the tokenizer of the model, or None if it cannot be loaded (e.g. the BPE file cannot be downloaded).
+
+    tiktoken may download the BPE file, so this blocks: the lifespan and the batch processor run it in a worker thread.
+    """
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:  # pragma: no cover
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            logger.warning("[Tokenizer] Could not load the tokenizer of %s, estimating token counts", model)
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def get_encoding(model: str) -> tiktoken.Encoding | None:
+    """
+    Get the tokenizer of the model once it is loaded, see `load_encoding`, so the event loop never waits for a download.
+    """
+    return _encodings.get(model)
+
+
+def shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+    """
+    The set of word n-grams of the text, used to detect near-duplicate chunks.
+    """
+    words = text.casefold().split()
+    return {tuple(words[i : i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+class ContextBuilder:
+    def __init__(self, model: str, token_budget: int, duplicate_threshold: float = 0.9):
+        """
+        Initialize the context builder of the chat prompt.
+
+        The chunks returned by the similarity search are taken in relevance order, near-duplicates
+        are dropped, and chunks are packed until the token budget of the context is spent.
+
+        Args:
+            model (str): The LLM model, used to pick the tokenizer.
+            token_budget (int): Maximum number of tokens of the context.
+            duplicate_threshold (float, optional): Jaccard similarity of word trigrams above which a chunk
+                is considered a duplicate of a chunk already in the context. Defaults to 0.9.
+        """
+        self.model = model
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of the text with the model tokenizer, or estimate them at 4 characters per token
+        while the tokenizer is not loaded.
+        """
+        encoding = get_encoding(self.model)
+        return len(encoding.encode(text)) if encoding else len(text) // 4 + 1
+
+    def build(self, points: list[models.ScoredPoint]) -> str:
+        """
+        Build the context from the search results.
+
+        Args:
+            points (list[models.ScoredPoint]): The search results, most relevant first.
+
+        Returns:
+            str: The context, one chunk per line, each prefixed with its page number.
+        """
+        chunks: list[str] = []
+        kept: list[set[tuple[str, ...]]] = []
+        used_tokens = 0
+        for point in points:
+            page_content = point.payload["page_content"]
+            # Skip chunks that repeat a chunk already in the context
+            chunk_shingles = shingles(page_content)
+            if any(len(chunk_shingles & other) / len(chunk_shingles | other) >= self.duplicate_threshold for other in kept):
+                continue
+
+            chunk = f"[PageNumber-{point.payload['metadata']['page_number']}]" + page_content
+            tokens = self.count_tokens(chunk) + 1
+            # A less relevant but shorter chunk may still fit
+            if used_tokens + tokens > self.token_budget:
+                continue
+            chunks.append(chunk)
+            kept.append(chunk_shingles)
+            used_tokens += tokens
+        return "\n".join(chunks)
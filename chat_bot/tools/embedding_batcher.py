@@ -0,0 +1,78 @@
+import asyncio
+
+from langchain_openai import OpenAIEmbeddings
+
+
+class EmbeddingBatcher:
+    def __init__(self, embedding_model: OpenAIEmbeddings, window: float, max_size: int):
+        """
+        Initialize the query embedding micro-batcher.
+
+        Concurrent queries are collected for a short window, or until the batch is full, and sent
+        as a single `aembed_documents` request. Each result is then handed back to its waiting caller.
+
+        Args:
+            embedding_model (OpenAIEmbeddings): The embedding client used to send the batches.
+            window (float): Seconds to wait for more queries after the first one of a batch.
+            max_size (int): Maximum number of queries sent in one request.
+        """
+        self.embedding_model = embedding_model
+        self.window = window
+        self.max_size = max_size
+        self._pending: list[tuple[str, asyncio.Future[list[float]]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def embed(self, text: str) -> list[float]:
+        """
+        Embed a single query as part of the current batch.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            list[float]: The embedding of the text.
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[list[float]] = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """
+        Send the pending queries as one batch in the background.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._send(batch))
+        # Keep a reference to the task until it finishes, so it is not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future[list[float]]]]) -> None:
+        """
+        Embed the batch and resolve the waiting futures. Identical queries are embedded once.
+        """
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            if len(texts) == 1:
+                vectors = [await self.embedding_model.aembed_query(texts[0])]
+            else:
+                vectors = await self.embedding_model.aembed_documents(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        results = dict(zip(texts, vectors, strict=True))
+        for text, future in batch:
+            # The caller may have been cancelled in the meantime
+            if not future.done():
+                future.set_result(results[text])
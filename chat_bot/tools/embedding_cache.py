@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import TypeVar
+
+import numpy as np
+
+from .lru import TieredCache
+
+logger = logging.getLogger("chatbot")
+
+T = TypeVar("T")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before embedding it: leading, trailing and repeated whitespace is collapsed.
+
+    Args:
+        text (str): The raw text.
+
+    Returns:
+        str: The normalized text.
+    """
+    return " ".join(text.split())
+
+
+class DiskEmbeddingStore:
+    def __init__(self, directory: str | Path, dimension: int, max_rows: int = 100_000, busy_timeout: float = 1.0):
+        """
+        Initialize the on-disk embedding store.
+
+        Vectors are written to a float32 file of at most `max_rows` rows that every worker memory-maps
+        read-only, and an SQLite index maps the hash of each cache key to its row. Once the file is
+        full, the rows are reused in a ring and the oldest vectors are evicted first. The store survives
+        restarts and is shared by all uvicorn workers of the host. Its methods block on disk I/O,
+        `EmbeddingCache` calls them from a worker thread.
+
+        Args:
+            directory (str | Path): Directory holding the vector file and the index.
+            dimension (int): Size of the stored vectors. Vectors of another size are not stored.
+            max_rows (int, optional): Maximum number of stored vectors. Defaults to 100000.
+            busy_timeout (float, optional): Seconds a write waits for the writers of other workers before
+                it is skipped. Defaults to 1.0.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.max_rows = max_rows
+        self.row_bytes = dimension * np.dtype(np.float32).itemsize
+
+        # The vector file is written with positioned writes; reads go through the memory map
+        self._vectors_path = self.directory / f"vectors-{dimension}.f32"
+        self._fd = os.open(self._vectors_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._matrix: np.ndarray = np.empty((0, dimension), dtype=np.float32)
+
+        self._lock = threading.Lock()
+        self._table = f"embeddings_{dimension}"
+        self._index = sqlite3.connect(self.directory / "index.sqlite", timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        # `seq` numbers the writes, `row` is the row of the vector file the write went to
+        self._index.execute(f"CREATE TABLE IF NOT EXISTS {self._table} (key TEXT PRIMARY KEY, row INTEGER NOT NULL, seq INTEGER NOT NULL)")
+        self._index.execute(f"CREATE INDEX IF NOT EXISTS {self._table}_row ON {self._table} (row)")
+        self._index.execute(f"CREATE INDEX IF NOT EXISTS {self._table}_seq ON {self._table} (seq)")
+        self._index.execute("CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+
+    @staticmethod
+    def digest(key: Hashable) -> str:
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def _rows(self, row: int) -> np.ndarray:
+        """
+        Return the memory-mapped vector matrix, remapping it if another worker grew the file since.
+        """
+        if row >= len(self._matrix):
+            rows = os.fstat(self._fd).st_size // self.row_bytes
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+        return self._matrix
+
+    def _lookup(self, digest: str) -> tuple[int, int] | None:
+        return self._index.execute(f"SELECT row, seq FROM {self._table} WHERE key = ?", (digest,)).fetchone()
+
+    def get(self, key: Hashable) -> np.ndarray | None:
+        """
+        Get a copy of the stored vector for the key.
+
+        The index entry is looked up again after the copy: a row evicted in the meantime may have been
+        overwritten while it was copied, and is reported as a miss.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            np.ndarray | None: The float32 vector, or None if the key is not stored.
+        """
+        digest = self.digest(key)
+        with self._lock:
+            record = self._lookup(digest)
+            if record is None:
+                return None
+            vector = np.array(self._rows(record[0])[record[0]])
+            return vector if self._lookup(digest) == record else None
+
+    def put(self, key: Hashable, vector: np.ndarray) -> None:
+        """
+        Write the vector to the next row of the ring and index it under the key.
+
+        The row is claimed and the entry of the vector it held is deleted in a first immediate SQLite
+        transaction, which serializes concurrent writers across processes. The vector is written after
+        that commit and indexed in a second transaction, so readers never see an entry whose row is
+        being overwritten. A write that cannot get the lock within the busy timeout is skipped, the
+        vector is only missing from the cache.
+
+        Args:
+            key (Hashable): The cache key.
+            vector (np.ndarray): The float32 vector to store.
+        """
+        if vector.shape != (self.dimension,):
+            return
+        digest = self.digest(key)
+        with self._lock:
+            seq = self._transaction(lambda: self._claim(digest))
+            if seq is None:
+                return
+            row = seq % self.max_rows
+            os.pwrite(self._fd, vector.astype(np.float32).tobytes(), row * self.row_bytes)
+            self._transaction(lambda: self._insert(digest, row, seq))
+
+    def _transaction(self, statements: Callable[[], T]) -> T | None:
+        try:
+            self._index.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            logger.warning("[Embedding Cache] Disk store busy, vector not stored")
+            return None
+        try:
+            result = statements()
+            self._index.execute("COMMIT")
+        except BaseException:
+            self._index.execute("ROLLBACK")
+            raise
+        return result
+
+    def _claim(self, digest: str) -> int | None:
+        if self._lookup(digest) is not None:
+            return None
+        cursor = self._index.execute("SELECT next FROM cursors WHERE name = ?", (self._table,)).fetchone()
+        seq = cursor[0] if cursor is not None else 0
+        self._index.execute("INSERT OR REPLACE INTO cursors (name, next) VALUES (?, ?)", (self._table, seq + 1))
+        # Evict the vector held by the row, and those left behind by a larger `max_rows`
+        self._index.execute(f"DELETE FROM {self._table} WHERE row = ? OR seq <= ?", (seq % self.max_rows, seq - self.max_rows))
+        return seq
+
+    def _insert(self, digest: str, row: int, seq: int) -> None:
+        # The row was claimed again by a full round of the ring in the meantime
+        if self._index.execute("SELECT next FROM cursors WHERE name = ?", (self._table,)).fetchone()[0] - seq > self.max_rows:
+            return
+        self._index.execute(f"INSERT OR REPLACE INTO {self._table} (key, row, seq) VALUES (?, ?, ?)", (digest, row, seq))
+
+    def close(self) -> None:
+        """
+        Close the index and the vector file.
+        """
+        with self._lock:
+            self._index.close()
+            self._matrix = np.empty((0, self.dimension), dtype=np.float32)
+            os.close(self._fd)
+
+
+class EmbeddingCache(TieredCache[Hashable, np.ndarray]):
+    def __init__(self, max_bytes: int, time_to_live: float, disk_store: DiskEmbeddingStore | None = None):
+        """
+        Initialize the embedding cache.
+
+        Vectors are stored as compact float32 arrays, keyed by (model, dimension, normalized text),
+        and the cache is bounded by the number of bytes held rather than the number of entries.
+
+        Args:
+            max_bytes (int): Memory budget of the stored vectors, in bytes.
+            time_to_live (float): Seconds after which a vector is embedded again.
+            disk_store (DiskEmbeddingStore | None, optional): Persistent tier consulted on memory misses.
+        """
+        super().__init__(max_bytes, time_to_live, size=lambda vector: vector.nbytes, disk_store=disk_store)
+
+    @staticmethod
+    def key(model: str, dimension: int, text: str) -> tuple[str, int, str]:
+        return model, dimension, normalize_text(text)
+
+    def put(self, key: Hashable, embedding: list[float] | np.ndarray, time_to_live: float | None = None) -> np.ndarray:
+        """
+        Store a vector in memory as a float32 copy, evicting the least recently used vectors until the memory budget is met.
+
+        Args:
+            key (Hashable): The cache key, see `EmbeddingCache.key`.
+            embedding (list[float] | np.ndarray): The vector to store.
+            time_to_live (float | None, optional): Seconds the vector is served for. Defaults to the time to live of the cache.
+
+        Returns:
+            np.ndarray: The stored float32 vector.
+        """
+        return super().put(key, np.array(embedding, dtype=np.float32), time_to_live)
@@ -1,12 +1,34 @@
+import asyncio
 import base64
+from collections.abc import Awaitable, Callable
 
-from cache import AsyncTTL
+import httpx
+from langchain_core.output_parsers import NumberedListOutputParser, StrOutputParser
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from openai import AsyncOpenAI
 
+from chat_bot.core.config import settings
+
+from .audio import split_wav
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache, normalize_text
+from .prompts import CHAT_PROMPT, SUGGESTED_QUESTION_PROMPT
+from .transcription_cache import TranscriptionCache
+
+TRANSCRIPTION_MODEL = "whisper-1"
+
 
 class LLM:
-    def __init__(self, model: str, openai_key: str, temperature: float | int = 0):
+    def __init__(
+        self,
+        model: str,
+        openai_key: str,
+        temperature: float | int = 0,
+        http_client: httpx.AsyncClient | None = None,
+        transcription_cache: TranscriptionCache | None = None,
+        segment_seconds: float = 0,
+        transcription_concurrency: int = 4,
+    ):
         """
         Initialize the LLM model.
 
@@ -18,38 +40,114 @@ class LLM:
             openai_key (str): The API key for accessing OpenAI services.
             temperature (float | int, optional): The temperature of the model, which controls
                 the randomness of the output. Defaults to 0.
+            http_client (httpx.AsyncClient | None, optional): Shared keep-alive HTTP client used for
+                the OpenAI requests. Defaults to a private client per instance.
+            transcription_cache (TranscriptionCache | None, optional): Cache of audio transcriptions, usually
+                shared by every LLM of the process. Defaults to no caching.
+            segment_seconds (float, optional): Length of the segments longer WAV recordings are split into
+                and transcribed concurrently. Defaults to 0, which transcribes every recording in one request.
+            transcription_concurrency (int, optional): Maximum number of segments transcribed at the same time.
+                Defaults to 4.
         """
+        self.model = model
+        self.transcription_cache = transcription_cache
+        self.segment_seconds = segment_seconds
+        self._transcription_slots = asyncio.Semaphore(transcription_concurrency)
         # Initialize the chat model for conversational AI
-        self.chat_model = ChatOpenAI(model=model, temperature=temperature, openai_api_key=openai_key)  # type: ignore
+        self.chat_model = ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            openai_api_key=openai_key,  # type: ignore
+            http_async_client=http_client,
+        )
+        # Build the chains once, the LLM is pooled and reused by every message
+        self.chat_chain = CHAT_PROMPT | self.chat_model | StrOutputParser()
+        self.questions_chain = SUGGESTED_QUESTION_PROMPT | self.chat_model | NumberedListOutputParser()
 
         # Set up the transcription service for converting audio to text
-        self.transcriptions = AsyncOpenAI(api_key=openai_key).audio.transcriptions  # type: ignore
+        self.transcriptions = AsyncOpenAI(api_key=openai_key, http_client=http_client).audio.transcriptions  # type: ignore
 
-    async def audio_transcription(self, audio_b64_text: str):
+    async def audio_transcription(
+        self,
+        audio: str | bytes | bytearray,
+        on_partial: Callable[[str], Awaitable[None]] | None = None,
+    ) -> str:
         """
-        Transcribes audio data from a base64 encoded string using the Whisper model.
+        Transcribes audio data using the Whisper model.
+
+        WAV recordings longer than `segment_seconds` are split at silences, the segments are transcribed
+        concurrently and their texts are joined in order.
 
         Args:
-            audio_b64_text (str): The base64 encoded audio data.
+            audio (str | bytes | bytearray): The base64 encoded audio data of a JSON message,
+                or the raw audio bytes of a binary upload, which are sent as they are.
+            on_partial (Callable[[str], Awaitable[None]] | None, optional): Called with the text transcribed
+                so far, every time the next segment in order is done, before the whole recording is.
 
         Returns:
             str: The transcribed text from the audio.
 
         """
-        # Decode the base64 encoded audio data
-        decoded_audio = base64.b64decode(audio_b64_text.encode())
+        # Decode the base64 encoded audio data, binary uploads need no decoding
+        decoded_audio = base64.b64decode(audio.encode()) if isinstance(audio, str) else bytes(audio)
+
+        # A recording sent again, e.g. for a re_generate, is served from the cache
+        key = TranscriptionCache.key(TRANSCRIPTION_MODEL, decoded_audio)
+        cached = await self.transcription_cache.aget(key) if self.transcription_cache is not None else None
+        if cached is not None:
+            return cached
+
+        segments = await asyncio.to_thread(split_wav, decoded_audio, self.segment_seconds) if self.segment_seconds > 0 else [decoded_audio]
+        if len(segments) == 1:
+            text = await self._transcribe(decoded_audio)
+        else:
+            text = await self._transcribe_segments(segments, on_partial)
+
+        if self.transcription_cache is not None:
+            await self.transcription_cache.aput(key, text)
+        # Return the transcribed text
+        return text
 
+    async def _transcribe(self, audio: bytes) -> str:
         # Create a transcription request using the Whisper model
-        response = await self.transcriptions.create(model="whisper-1", file=("mmm.wav", decoded_audio))
+        async with self._transcription_slots:
+            response = await self.transcriptions.create(model=TRANSCRIPTION_MODEL, file=("mmm.wav", audio))
+        return response.text  # type: ignore[no-any-return]
 
-        # Return the transcribed text
-        return response.text
+    async def _transcribe_segments(self, segments: list[bytes], on_partial: Callable[[str], Awaitable[None]] | None) -> str:
+        """
+        Transcribe the segments concurrently and join their texts in order.
+        """
+        tasks = [asyncio.create_task(self._transcribe(segment)) for segment in segments]
+        texts: list[str | None] = [None] * len(tasks)
+        done = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                await task
+                # Report the text of the segments done in order, later segments may finish first
+                reported = done
+                while done < len(tasks) and tasks[done].done():
+                    texts[done] = tasks[done].result().strip()
+                    done += 1
+                if on_partial is not None and reported < done < len(tasks):
+                    await on_partial(" ".join(text for text in texts[:done] if text))
+        finally:
+            for pending in tasks:
+                pending.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return " ".join(text for text in texts if text)
 
 
 class EmbeddingModel:
-    embedding_client: OpenAIEmbeddings
-
-    def __init__(self, model: str, openai_key: str):
+    def __init__(
+        self,
+        model: str,
+        openai_key: str,
+        http_client: httpx.AsyncClient | None = None,
+        cache: EmbeddingCache | None = None,
+        batch_window: float = 0,
+        batch_size: int = 1,
+    ):
         """
         Initialize the Embedding Model.
 
@@ -58,21 +156,35 @@ class EmbeddingModel:
         Args:
             model (str): The name of the Embedding Model.
             openai_key (str): The API key for accessing OpenAI services.
+            http_client (httpx.AsyncClient | None, optional): Shared keep-alive HTTP client used for
+                the OpenAI requests. Defaults to a private client per instance.
+            cache (EmbeddingCache | None, optional): Cache of query embeddings, usually shared by every
+                EmbeddingModel of the process. Defaults to no caching.
+            batch_window (float, optional): Seconds concurrent queries are collected into a single
+                embedding request. Defaults to 0, which sends every query on its own.
+            batch_size (int, optional): Maximum number of queries per embedding request. Defaults to 1.
         """
+        self.model = model
+        self.dimension = settings.EMBEDDING_DIMENSION
+        self.cache = cache
+
         # Initialize the OpenAI Embeddings model
-        self.embedding_model = OpenAIEmbeddings(model=model, api_key=openai_key)
+        self.embedding_model = OpenAIEmbeddings(model=model, api_key=openai_key, http_async_client=http_client)  # type: ignore
 
-        # Assign the initialized embedding model to the class-level attribute
-        EmbeddingModel.embedding_client = self.embedding_model
+        # Collect concurrent queries into batched requests
+        self.batcher = (
+            EmbeddingBatcher(self.embedding_model, window=batch_window, max_size=batch_size)
+            if batch_window > 0 and batch_size > 1
+            else None
+        )
 
-    @staticmethod
-    @AsyncTTL(time_to_live=3600, maxsize=1024)  # Cache the result for 1 hour, with a max size of 1GB
-    async def aembed_query(query: str) -> list[float]:
+    async def aembed_query(self, query: str) -> list[float]:
         """
         Asynchronously generate embeddings for a given query.
 
         This method uses the OpenAI embedding model to convert a text query into a list of floats
-        that represent the embeddings. The results are cached to improve performance for repeated queries.
+        that represent the embeddings. The results are cached per model and normalized query text
+        to improve performance for repeated queries.
 
         Args:
             query (str): The text query to embed.
@@ -80,7 +192,41 @@ class EmbeddingModel:
         Returns:
             list[float]: A list of floats representing the query's embeddings.
         """
-        # Generate embeddings for the query using the embedding client
-        embeddings_list: list[float] = await EmbeddingModel.embedding_client.aembed_query(query)
+        key = EmbeddingCache.key(self.model, self.dimension, query)
+        cached = await self.cache.aget(key) if self.cache is not None else None
+        if cached is not None:
+            return cached.tolist()  # type: ignore[no-any-return]
+
+        # Generate embeddings for the query using the embedding client, batched with concurrent queries if enabled
+        text = normalize_text(query)
+        embeddings_list: list[float] = await (self.batcher.embed(text) if self.batcher else self.embedding_model.aembed_query(text))
 
+        if self.cache is not None:
+            await self.cache.aput(key, embeddings_list)
         return embeddings_list
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Generate the embeddings of several texts, sending the texts missing from the cache in one request.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embedding of each text, in order.
+        """
+        keys = [EmbeddingCache.key(self.model, self.dimension, text) for text in texts]
+        vectors: dict[str, list[float]] = {}
+        for key in keys:
+            cached = await self.cache.aget(key) if self.cache is not None else None
+            if cached is not None:
+                vectors[key[2]] = cached.tolist()
+
+        # Identical texts are embedded once
+        missing = list(dict.fromkeys(key[2] for key in keys if key[2] not in vectors))
+        if missing:
+            for key, embedding in zip(missing, await self.embedding_model.aembed_documents(missing), strict=True):
+                vectors[key] = embedding
+                if self.cache is not None:
+                    await self.cache.aput(EmbeddingCache.key(self.model, self.dimension, key), embedding)
+        return [vectors[key[2]] for key in keys]
@@ -0,0 +1,224 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Generic, Protocol, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(
+        self,
+        max_size: int,
+        time_to_live: float,
+        size: Callable[[V], int] | None = None,
+        on_remove: Callable[[K, V], None] | None = None,
+    ):
+        """
+        Initialize the cache.
+
+        Entries are kept in least recently used order and bounded by `max_size`, counted in entries,
+        or in the unit `size` measures values in, e.g. bytes. An entry is served for `time_to_live`
+        seconds at most, or for the time to live it was stored with.
+
+        Args:
+            max_size (int): Maximum number of entries, or total size of the values when `size` is given.
+            time_to_live (float): Seconds after which an entry is no longer served.
+            size (Callable | None, optional): Measures a value. Defaults to counting entries.
+            on_remove (Callable | None, optional): Called with the key and value of every entry that is
+                evicted, expired, replaced or popped.
+        """
+        self.max_size = max_size
+        self.time_to_live = time_to_live
+        self.size = size
+        self.on_remove = on_remove
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[K, tuple[float, V, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def get(self, key: K) -> V | None:
+        """
+        Get the value of the key and count the hit or miss.
+
+        Args:
+            key (K): The key.
+
+        Returns:
+            V | None: The value, or None if the key is not cached or its entry expired.
+        """
+        value = self.lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def lookup(self, key: K) -> V | None:
+        """
+        Get the value of the key without counting the hit or miss, dropping the entry if it expired.
+
+        Args:
+            key (K): The key.
+
+        Returns:
+            V | None: The value, or None if the key is not cached or its entry expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: K, value: V, time_to_live: float | None = None) -> V:
+        """
+        Store a value, evicting the least recently used entries until the cache is within its bounds.
+
+        A value larger than the whole cache is not stored.
+
+        Args:
+            key (K): The key.
+            value (V): The value.
+            time_to_live (float | None, optional): Seconds the entry is served for, capped by the time
+                to live of the cache. Defaults to the time to live of the cache.
+
+        Returns:
+            V: The value.
+        """
+        self.pop(key)
+        size = self.size(value) if self.size is not None else 1
+        if size > self.max_size:
+            return value
+        while self.current_size + size > self.max_size:
+            self.pop(next(iter(self._entries)))
+        ttl = self.time_to_live if time_to_live is None else min(time_to_live, self.time_to_live)
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.current_size += size
+        return value
+
+    def pop(self, key: K) -> V | None:
+        """
+        Remove the entry of the key.
+
+        Args:
+            key (K): The key.
+
+        Returns:
+            V | None: The removed value, or None if the key was not cached.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.current_size -= entry[2]
+        if self.on_remove is not None:
+            self.on_remove(key, entry[1])
+        return entry[1]
+
+    def expires_at(self, key: K) -> float | None:
+        """
+        Get the `time.monotonic` deadline of the entry of the key, or None if the key is not cached.
+        """
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+
+class DiskStore(Protocol[K, V]):
+    def get(self, key: K) -> V | None: ...
+
+    def put(self, key: K, value: V) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class TieredCache(LRUCache[K, V]):
+    def __init__(
+        self,
+        max_size: int,
+        time_to_live: float,
+        size: Callable[[V], int] | None = None,
+        disk_store: DiskStore[K, V] | None = None,
+    ):
+        """
+        Initialize a memory cache backed by an optional disk store, e.g. one shared by every worker of the host.
+
+        The disk store is consulted on memory misses and written through, both from a worker thread so
+        the event loop does not wait on the disk.
+
+        Args:
+            max_size (int): Maximum number of entries, or total size of the values when `size` is given.
+            time_to_live (float): Seconds after which an entry is no longer served from memory.
+            size (Callable | None, optional): Measures a value. Defaults to counting entries.
+            disk_store (DiskStore | None, optional): Persistent tier consulted on memory misses.
+        """
+        super().__init__(max_size, time_to_live, size=size)
+        self.disk_store = disk_store
+        self.disk_hits = 0
+
+    async def aget(self, key: K) -> V | None:
+        """
+        Get the value of the key, from memory or else from the disk store, and count the hit or miss.
+
+        Args:
+            key (K): The key.
+
+        Returns:
+            V | None: The value, or None on a miss.
+        """
+        value = self.lookup(key)
+        if value is None and self.disk_store is not None:
+            stored = await asyncio.to_thread(self.disk_store.get, key)
+            if stored is not None:
+                self.disk_hits += 1
+                return self.put(key, stored)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def aput(self, key: K, value: V) -> V:
+        """
+        Store a value in memory and in the disk store.
+
+        Args:
+            key (K): The key.
+            value (V): The value.
+
+        Returns:
+            V: The value stored in memory.
+        """
+        value = self.put(key, value)
+        if self.disk_store is not None:
+            await asyncio.to_thread(self.disk_store.put, key, value)
+        return value
+
+    def close(self) -> None:
+        """
+        Close the disk store.
+        """
+        if self.disk_store is not None:
+            self.disk_store.close()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Hit and miss counters and the memory currently held.
+        """
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.current_size,
+        }
@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from qdrant_client import models
+from qdrant_client.conversions import common_types as types
+
+from .retriever import Qdrant
+
+logger = logging.getLogger("chatbot")
+
+RESOURCE_FIELD = "metadata.resource"
+
+
+class NumpyRetriever(Qdrant):
+    def __init__(self, *args: Any, index_path: str | Path | None = None, batch_size: int = 256, **kwargs: Any):
+        """
+        Initialize the vector store with an in-process exact index of the main collection.
+
+        The main collection is read from Qdrant once into a float32 matrix of normalized vectors, sorted by
+        `metadata.resource`, so every resource is a contiguous block of rows. Searches on the main collection
+        are a matrix-vector product over that block and an `argpartition` top-k, without any network call.
+        The cache collection is still searched and written in Qdrant.
+
+        Args:
+            *args: Positional arguments of `Qdrant`.
+            index_path (str | Path | None, optional): Directory the index is saved to and memory-mapped from,
+                so it is read from Qdrant only once per host and collection content. Defaults to keeping
+                the index in memory.
+            batch_size (int, optional): Number of points read from Qdrant per request. Defaults to 256.
+            **kwargs: Keyword arguments of `Qdrant`.
+        """
+        super().__init__(*args, **kwargs)
+        self.index_path = Path(index_path) if index_path else None
+        self.batch_size = batch_size
+        self.matrix: np.ndarray | None = None
+        self.resource_ids: np.ndarray = np.empty(0, dtype=np.int32)
+        self.point_ids: list[int | str] = []
+        self.payloads: list[dict[str, Any]] = []
+        self._resources: dict[str, slice] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """
+        Load the index of the main collection, from `index_path` if it was saved for the current content
+        of the collection, from Qdrant otherwise.
+
+        Called on startup by the bootstrap, so the first question does not pay for reading the collection.
+        """
+        async with self._lock:
+            if self.matrix is not None:
+                return
+            fingerprint = await self.fingerprint() if self.index_path is not None else ""
+            if self.index_path is None or not await asyncio.to_thread(self._read, fingerprint):
+                await self._build()
+                if self.index_path is not None:
+                    await asyncio.to_thread(self._write, fingerprint)
+            logger.info("[Numpy Retriever] %s points of %s loaded", len(self.point_ids), self.main_collection)
+
+    async def fingerprint(self) -> str:
+        """
+        Fingerprint the main collection by its vector configuration and point IDs, without reading vectors or payloads.
+
+        A collection restored with other points, even as many as before, gets another fingerprint. Points
+        updated in place keep their ID, delete the saved index to pick such changes up.
+        """
+        info = await self.client.get_collection(collection_name=self.main_collection)
+        point_ids: list[str] = []
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name=self.main_collection,
+                limit=self.batch_size * 16,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            point_ids.extend(str(record.id) for record in records)
+            if offset is None:
+                break
+        digest = hashlib.sha256(info.config.params.model_dump_json().encode())
+        digest.update("\0".join(sorted(point_ids)).encode())
+        return digest.hexdigest()
+
+    async def _build(self) -> None:
+        """
+        Read every point of the main collection from Qdrant.
+        """
+        vectors: list[list[float]] = []
+        points: list[tuple[str, int | str, dict[str, Any]]] = []
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name=self.main_collection,
+                limit=self.batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for record in records:
+                payload = record.payload or {}
+                points.append((payload.get("metadata", {}).get("resource", ""), record.id, payload))
+                vectors.append(record.vector)  # type: ignore[arg-type]
+            if offset is None:
+                break
+
+        order = sorted(range(len(points)), key=lambda row: points[row][0])
+        matrix = np.asarray([vectors[row] for row in order], dtype=np.float32).reshape(len(order), -1)
+        # The main collection uses the cosine distance, which is the dot product of normalized vectors
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        resources = sorted({resource for resource, _, _ in points})
+        codes = {resource: code for code, resource in enumerate(resources)}
+        self._set(
+            matrix,
+            np.asarray([codes[points[row][0]] for row in order], dtype=np.int32),
+            resources,
+            [points[row][1] for row in order],
+            [points[row][2] for row in order],
+        )
+
+    def _set(
+        self,
+        matrix: np.ndarray,
+        resource_ids: np.ndarray,
+        resources: list[str],
+        point_ids: list[int | str],
+        payloads: list[dict[str, Any]],
+    ) -> None:
+        self.matrix = matrix
+        self.resource_ids = resource_ids
+        self.point_ids = point_ids
+        self.payloads = payloads
+        # The rows are sorted by resource, so each resource is a slice of the matrix and needs no copy
+        bounds = np.searchsorted(resource_ids, np.arange(len(resources) + 1))
+        self._resources = {resource: slice(int(bounds[code]), int(bounds[code + 1])) for code, resource in enumerate(resources)}
+
+    def _files(self) -> tuple[Path, Path, Path]:
+        assert self.index_path is not None
+        name = self.main_collection
+        return self.index_path / f"{name}.vectors.npy", self.index_path / f"{name}.resources.npy", self.index_path / f"{name}.points.json"
+
+    def _read(self, fingerprint: str) -> bool:
+        """
+        Memory-map a saved index, if it was saved for the fingerprint of the main collection.
+        """
+        vectors_file, resources_file, points_file = self._files()
+        if not points_file.exists():
+            return False
+        points = json.loads(points_file.read_text())
+        if points.get("fingerprint") != fingerprint:
+            return False
+        self._set(
+            np.load(vectors_file, mmap_mode="r"),
+            np.load(resources_file),
+            points["resources"],
+            points["ids"],
+            points["payloads"],
+        )
+        return True
+
+    def _write(self, fingerprint: str) -> None:
+        """
+        Save the index, the points file last, so an interrupted write is never read back.
+        """
+        assert self.matrix is not None
+        vectors_file, resources_file, points_file = self._files()
+        self.index_path.mkdir(parents=True, exist_ok=True)  # type: ignore[union-attr]
+        np.save(vectors_file, self.matrix)
+        np.save(resources_file, self.resource_ids)
+        points = {"fingerprint": fingerprint, "resources": list(self._resources), "ids": self.point_ids, "payloads": self.payloads}
+        points_file.write_text(json.dumps(points))
+
+    async def search(
+        self,
+        collection_name: str,
+        embedding: list[float],
+        query_filter: list[tuple[str, str]],
+        limit: int | None = 10,
+        score_threshold: float | None = None,
+        with_vectors: bool = False,
+    ) -> types.QueryResponse:
+        """
+        Search the main collection in the in-process index, and any other collection in Qdrant.
+
+        Searches filtering on other fields than `metadata.resource` are sent to Qdrant as well.
+        The arguments and the response are the ones of `Qdrant.search`.
+        """
+        if collection_name != self.main_collection or any(field != RESOURCE_FIELD for field, _ in query_filter):
+            return await super().search(collection_name, embedding, query_filter, limit, score_threshold, with_vectors)
+        await self.load()
+        assert self.matrix is not None
+
+        rows = slice(0, len(self.point_ids))
+        for _, resource in query_filter:
+            block = self._resources.get(resource, slice(0, 0))
+            start = max(rows.start, block.start)
+            rows = slice(start, max(start, min(rows.stop, block.stop)))
+        # A copy, the embedding may be a vector of the embedding cache
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        scores = self.matrix[rows] @ query
+
+        top = len(scores) if limit is None else min(limit, len(scores))
+        if top == 0:
+            return types.QueryResponse(points=[])
+        candidates = np.argpartition(-scores, top - 1)[:top] if top < len(scores) else np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        if score_threshold is not None:
+            candidates = candidates[scores[candidates] >= score_threshold]
+
+        return types.QueryResponse(
+            points=[
+                models.ScoredPoint(
+                    id=self.point_ids[rows.start + row],
+                    version=0,
+                    score=float(scores[row]),
+                    payload=self.payloads[rows.start + row],
+                    vector=self.matrix[rows.start + row].tolist() if with_vectors else None,
+                )
+                for row in candidates.tolist()
+            ]
+        )
+
+    async def search_batch(
+        self,
+        collection_name: str,
+        embeddings: list[list[float]],
+        query_filters: list[list[tuple[str, str]]],
+        limit: int | None = 10,
+        score_threshold: float | None = None,
+    ) -> list[types.QueryResponse]:
+        """
+        Run several searches, in the in-process index for the main collection. See `Qdrant.search_batch`.
+        """
+        if collection_name != self.main_collection:
+            return await super().search_batch(collection_name, embeddings, query_filters, limit, score_threshold)
+        return [
+            await self.search(collection_name, embedding, query_filter, limit, score_threshold)
+            for embedding, query_filter in zip(embeddings, query_filters, strict=True)
+        ]
@@ -1,13 +1,12 @@
-CHAT_PROMPT = """
-### Knowledge Base Information:
-```
-{CONTEXT}
-```
+import hashlib
 
-### User Inquiry:
-```
-{QUERY}
-```
+from langchain_core.prompts import ChatPromptTemplate
+
+# The system messages hold only static text and come first, so every request starts with the same
+# prefix and the provider can serve it from its prompt cache. The variables go into the user messages.
+
+CHAT_SYSTEM_PROMPT = """
+You answer questions about a product from the knowledge base provided in the user message.
 
 ### Response Instructions:
 - Derive a precise and straightforward answer directly from the provided knowledge base.
@@ -18,12 +17,37 @@ CHAT_PROMPT = """
 - Use visual aids like graphs or charts whenever they can enhance understanding or illustrate complex points clearly.
 - Ensure responses are in simple language, avoiding technical jargon to accommodate a broad range of users.
 - Strive for engagement by acknowledging the user's question and showing a helpful attitude even when the answer isn't available.
-- Always respond in {RESPONSE_LANGUAGE}
+- Always respond in the response language given in the user message.
+"""
+
+CHAT_USER_PROMPT = """
+### Knowledge Base Information:
+```
+{CONTEXT}
+```
+
+### User Inquiry:
+```
+{QUERY}
+```
+
+### Response Language:
+{RESPONSE_LANGUAGE}
 """
 
-SUGGESTED_QUESTION_PROMPT = """
+SUGGESTED_QUESTION_SYSTEM_PROMPT = """
 You are provided with a question and its answer related to a specific topic. Your task is to generate three follow-up questions that delve deeper into the topic, explore related areas, or clarify concepts mentioned in the answer. The follow-up questions should encourage further exploration and understanding of the subject.
 
+** Strict Guidelines for follow-up questions:**
+1. **Relevance:** Each follow-up question must directly relate to the initial question or the information provided in the answer. It should aim to expand on the topic, not deviate from it.
+2. **Depth:** Aim to formulate questions that require more than a yes/no answer. The questions should encourage detailed explanations or discussions.
+3. **Clarity:** Ensure that Questions should be clear and concise, avoiding ambiguity. They should be easily understood without requiring additional context.
+4. **Concise:** Ensure that follow-up questions should be short and concise not more than 10 words
+5. **ResponseLanguage:** Always respond in the response language given in the user message.
+6. **Format:** Answer with a numbered list of the questions only.
+"""
+
+SUGGESTED_QUESTION_USER_PROMPT = """
 Question and Answer :
 ```
 ### Current Question:
@@ -33,10 +57,17 @@ Question and Answer :
 {ANSWER}
 ```
 
-** Strict Guidelines for follow-up questions:**
-1. **Relevance:** Each follow-up question must directly relate to the initial question or the information provided in the answer. It should aim to expand on the topic, not deviate from it.
-2. **Depth:** Aim to formulate questions that require more than a yes/no answer. The questions should encourage detailed explanations or discussions.
-3. **Clarity:** Ensure that Questions should be clear and concise, avoiding ambiguity. They should be easily understood without requiring additional context.
-4. **Concise:** Ensure that follow-up questions should be short and concise not more than 10 words
-5. **ResponseLanguage:** Always respond in {RESPONSE_LANGUAGE}
+### Response Language:
+{RESPONSE_LANGUAGE}
 """
+
+# Parsed once, the chains of every LLM share them
+CHAT_PROMPT = ChatPromptTemplate.from_messages([("system", CHAT_SYSTEM_PROMPT), ("human", CHAT_USER_PROMPT)])
+SUGGESTED_QUESTION_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", SUGGESTED_QUESTION_SYSTEM_PROMPT), ("human", SUGGESTED_QUESTION_USER_PROMPT)]
+)
+
+# Cached answers are scoped by this version, so editing a prompt stops serving answers generated with the old one
+PROMPT_VERSION = hashlib.sha256(
+    "".join((CHAT_SYSTEM_PROMPT, CHAT_USER_PROMPT, SUGGESTED_QUESTION_SYSTEM_PROMPT, SUGGESTED_QUESTION_USER_PROMPT)).encode()
+).hexdigest()[:12]
@@ -1,9 +1,37 @@
 import uuid
 
 from qdrant_client import AsyncQdrantClient, models
+from qdrant_client.conversions import common_types as types
 
 from chat_bot.core.config import settings
 
+from .semantic_cache import ExactMatchCache, SemanticCache, point_key
+from .write_behind import WriteBehindBuffer
+
+
+def make_client(local_path: str | None = settings.QDRANT_LOCAL_PATH) -> AsyncQdrantClient:
+    """
+    Create the Qdrant client: the configured server, or the embedded local mode of qdrant-client.
+
+    Args:
+        local_path (str | None, optional): Directory of the local storage, or ":memory:" for an in-memory
+            store. Defaults to `QDRANT_LOCAL_PATH`; None connects to `QDRANT_URL`.
+
+    Returns:
+        AsyncQdrantClient: The client.
+    """
+    if local_path == ":memory:":
+        return AsyncQdrantClient(location=":memory:")
+    if local_path:
+        return AsyncQdrantClient(path=local_path)
+    # Initialize the AsyncQdrantClient with URL and API key if in cloud mode
+    return AsyncQdrantClient(
+        url=settings.QDRANT_URL,
+        https=settings.QDRANT_TLS,
+        verify=False,
+        api_key=settings.QDRANT_API_KEY if settings.QDRANT_CLOUD or settings.QDRANT_TLS else None,
+    )
+
 
 class Qdrant:
     def __init__(
@@ -12,6 +40,14 @@ class Qdrant:
         main_collection: str,
         search_limit: int,
         cache_hit_score: float | int,
+        client: AsyncQdrantClient | None = None,
+        local_cache: SemanticCache | None = None,
+        exact_cache: ExactMatchCache | None = None,
+        search_score_threshold: float | None = None,
+        write_behind_size: int = 0,
+        write_behind_interval: float = 0.5,
+        search_params: models.SearchParams | None = None,
+        verify_memory_hits: bool = False,
     ):
         """
         Initialize the Qdrant instance with provided collection names and settings.
@@ -21,21 +57,45 @@ class Qdrant:
             main_collection (str): Name of the main collection in Qdrant.
             search_limit (int): Maximum number of search results to return.
             cache_hit_score (float | int): Score threshold for cache hits.
+            client (AsyncQdrantClient | None, optional): Existing client to reuse. Defaults to a new client.
+            local_cache (SemanticCache | None, optional): In-process tier in front of the cache collection.
+            exact_cache (ExactMatchCache | None, optional): Exact-match index of the cache collection.
+            search_score_threshold (float | None, optional): Minimum score of the main collection search results.
+            write_behind_size (int, optional): Number of pending cache points written as one batched upsert.
+                Defaults to 0, which writes every point synchronously.
+            write_behind_interval (float, optional): Seconds after which pending cache points are written.
+            search_params (models.SearchParams | None, optional): HNSW and quantization rescoring parameters of every search.
+            verify_memory_hits (bool, optional): Whether a point found in the in-process tiers is looked up by ID
+                in the cache collection before it is served, see `confirm_cached`. Defaults to False.
         """
         # Assign collection names and configurations to instance variables
         self.cache_collection = cache_collection
         self.main_collection = main_collection
         self.search_limit = search_limit
         self.cache_hit_score = cache_hit_score
+        self.search_score_threshold = search_score_threshold
+        self.local_cache = local_cache
+        self.exact_cache = exact_cache
+        self.search_params = search_params
+        self.verify_memory_hits = verify_memory_hits
+
+        self.client = client or make_client()
 
-        # Initialize the AsyncQdrantClient with URL and API key if in cloud mode
-        self.client = AsyncQdrantClient(
-            url=settings.QDRANT_URL,
-            https=settings.QDRANT_TLS,
-            verify=False,
-            api_key=settings.QDRANT_API_KEY if settings.QDRANT_CLOUD or settings.QDRANT_TLS else None,
+        # Batch the cache writes of all sessions of the worker
+        self.write_behind = (
+            WriteBehindBuffer(self.client, cache_collection, batch_size=write_behind_size, interval=write_behind_interval)
+            if write_behind_size > 0
+            else None
         )
 
+    async def close(self) -> None:
+        """
+        Write the pending cache points, then close the underlying Qdrant client and release its connection pool.
+        """
+        if self.write_behind is not None:
+            await self.write_behind.close()
+        await self.client.close()
+
     async def search(
         self,
         collection_name: str,
@@ -43,6 +103,7 @@ class Qdrant:
         query_filter: list[tuple[str, str]],
         limit: int | None = 10,
         score_threshold: float | None = None,
+        with_vectors: bool = False,
     ) -> models.QueryResponse:
         """
         Search for similar documents in the specified Qdrant collection.
@@ -53,6 +114,7 @@ class Qdrant:
             query_filter (list[tuple[str, str]], optional): List of filter conditions to apply on the query results. Defaults to [].
             limit (int, optional): Maximum number of results to return. Defaults to 10.
             score_threshold (float | None, optional): Minimum score for a result to be returned. Defaults to None.
+            with_vectors (bool, optional): Whether to return the point vectors. Defaults to False.
 
         Returns:
             models.QueryResponse: Query response containing the search results.
@@ -64,15 +126,62 @@ class Qdrant:
                 query=embedding,
                 limit=limit,
                 score_threshold=score_threshold,
-                query_filter=models.Filter(
-                    must=[models.FieldCondition(key=field, match=models.MatchValue(value=value)) for field, value in query_filter],
-                ),
+                with_vectors=with_vectors,
+                search_params=self.search_params,
+                query_filter=self.make_filter(query_filter),
             )
         finally:
             # This empty finally block is here to indicate that the function call is wrapped in a try-finally block,
             # which is necessary to ensure that the Qdrant client is properly closed even if an exception occurs.
             pass
 
+    @staticmethod
+    def make_filter(query_filter: list[tuple[str, str]]) -> models.Filter:
+        """
+        Build the Qdrant filter matching every (field, value) condition.
+        """
+        return models.Filter(
+            must=[models.FieldCondition(key=field, match=models.MatchValue(value=value)) for field, value in query_filter],
+        )
+
+    async def search_batch(
+        self,
+        collection_name: str,
+        embeddings: list[list[float]],
+        query_filters: list[list[tuple[str, str]]],
+        limit: int | None = 10,
+        score_threshold: float | None = None,
+    ) -> list[types.QueryResponse]:
+        """
+        Run several searches on the specified Qdrant collection in a single request.
+
+        Args:
+            collection_name (str): Name of the collection to be searched.
+            embeddings (list[list[float]]): One query vector per search.
+            query_filters (list[list[tuple[str, str]]]): The filter conditions of each search.
+            limit (int, optional): Maximum number of results per search. Defaults to 10.
+            score_threshold (float | None, optional): Minimum score for a result to be returned. Defaults to None.
+
+        Returns:
+            list[types.QueryResponse]: The response of each search, in order.
+        """
+        if not embeddings:
+            return []
+        return await self.client.query_batch_points(
+            collection_name=collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=embedding,
+                    filter=self.make_filter(query_filter),
+                    limit=limit,
+                    score_threshold=score_threshold,
+                    params=self.search_params,
+                    with_payload=True,
+                )
+                for embedding, query_filter in zip(embeddings, query_filters, strict=True)
+            ],
+        )
+
     async def upsert(
         self,
         collection: str,
@@ -82,6 +191,9 @@ class Qdrant:
         """
         Insert or update a document in the specified Qdrant collection.
 
+        Writes to the cache collection go through the write-behind buffer if it is enabled. The point ID
+        is generated locally, so it is returned before the point is written.
+
         Args:
             collection (str): Name of the collection to be searched.
             embedding (list[float]): Document embedding vector.
@@ -90,13 +202,43 @@ class Qdrant:
         Returns:
             str: Unique point ID of the inserted document.
         """
-        point_id = uuid.uuid4().hex
-        await self.client.upsert(
-            collection_name=collection,
-            points=[models.PointStruct(id=point_id, vector=embedding, payload=page_content)],
-        )
+        # The dashed form, the one Qdrant returns the ID in
+        point_id = str(uuid.uuid4())
+        point = models.PointStruct(id=point_id, vector=embedding, payload=page_content)
+        if self.write_behind is not None and collection == self.cache_collection:
+            self.write_behind.add(point)
+            return point_id
+        await self.client.upsert(collection_name=collection, points=[point])
         return point_id
 
+    async def confirm_cached(self, point_id: int | str) -> bool:
+        """
+        Check that a point found in the in-process tiers is still in the cache collection.
+
+        The in-process tiers are per worker: a point deleted by a `re_generate` handled by another worker,
+        or another host, stays in them until it expires. By default memory hits make no network call, and
+        the tiers of a multi-worker deployment expire after the short `SEMANTIC_CACHE_SHARED_TTL` instead.
+        With `verify_memory_hits` the pipeline calls this before serving a memory hit: the point is looked
+        up by ID, a primary key read that is still cheaper than the vector search it saves, and a deleted
+        point is dropped from the tiers.
+
+        Args:
+            point_id (int | str): The point ID in the cache collection.
+
+        Returns:
+            bool: Whether the point can be served.
+        """
+        point = point_key(point_id)
+        if self.write_behind is not None and point in self.write_behind:
+            return True
+        if await self.client.retrieve(collection_name=self.cache_collection, ids=[point], with_payload=False, with_vectors=False):
+            return True
+        if self.local_cache is not None:
+            self.local_cache.discard(point)
+        if self.exact_cache is not None:
+            self.exact_cache.discard(point)
+        return False
+
     async def delete_point(self, point: str):
         """
         Delete a document from the cache collection in Qdrant.
@@ -107,8 +249,27 @@ class Qdrant:
         Returns:
             None
         """
-        # Perform the delete operation on the specified point ID in the cache collection
+        await self.delete_points([point])
+
+    async def delete_points(self, points: list[str]) -> None:
+        """
+        Delete documents from the cache collection in Qdrant.
+
+        Args:
+            points (list[str]): Unique point IDs of the documents to be deleted.
+        """
+        points = [point_key(point) for point in points]
+        for point in points:
+            # Drop the point from the in-process tiers first, so it can no longer be served locally
+            if self.local_cache is not None:
+                self.local_cache.discard(point)
+            if self.exact_cache is not None:
+                self.exact_cache.discard(point)
+            # A point that was not written yet is simply dropped, the delete below is then a no-op
+            if self.write_behind is not None:
+                self.write_behind.discard(point)
+        # Perform the delete operation on the specified point IDs in the cache collection
         await self.client.delete(
             collection_name=self.cache_collection,
-            points_selector=models.PointIdsList(points=[point]),
+            points_selector=models.PointIdsList(points=points),
         )
@@ -0,0 +1,264 @@
+import math
+import time
+import uuid
+from collections.abc import Hashable
+from typing import Any
+
+import numpy as np
+from qdrant_client import models
+
+from .lru import LRUCache
+
+
+def point_key(point_id: int | str | uuid.UUID) -> str:
+    """
+    Get the canonical form of a point ID, used by every in-process tier.
+
+    Qdrant returns UUIDs in the dashed form whatever form they were written in, so a UUID given
+    in another form, e.g. the hex form of older point IDs, is converted to the dashed form.
+
+    Args:
+        point_id (int | str | uuid.UUID): The point ID.
+
+    Returns:
+        str: The point ID as a string.
+    """
+    if isinstance(point_id, int):
+        return str(point_id)
+    try:
+        return str(uuid.UUID(str(point_id)))
+    except ValueError:
+        return str(point_id)
+
+
+class _ScopeIndex:
+    def __init__(self, dimension: int, capacity: int, initial_rows: int = 16):
+        """
+        Contiguous vector matrix and payloads for a single cache scope.
+
+        The matrix starts small and doubles as points are added, so a scope holding a few points
+        does not allocate `capacity` rows.
+
+        Args:
+            dimension (int): Size of the stored vectors.
+            capacity (int): Maximum number of rows held for the scope.
+            initial_rows (int, optional): Rows allocated up front. Defaults to 16.
+        """
+        self.capacity = capacity
+        rows = min(initial_rows, capacity)
+        self.matrix = np.zeros((rows, dimension), dtype=np.float32)
+        self.created_at = np.zeros(rows, dtype=np.float64)
+        self.last_used = np.zeros(rows, dtype=np.float64)
+        self.ids: list[str] = []
+        self.payloads: list[dict[str, Any]] = []
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def append(self, vector: np.ndarray, now: float, point_id: str, payload: dict[str, Any]) -> None:
+        """
+        Add a row, doubling the matrix if it is full.
+        """
+        row = self.size
+        if row == len(self.matrix):
+            rows = min(2 * row, self.capacity)
+            self.matrix = np.resize(self.matrix, (rows, self.matrix.shape[1]))
+            self.created_at = np.resize(self.created_at, rows)
+            self.last_used = np.resize(self.last_used, rows)
+        self.matrix[row] = vector
+        self.created_at[row] = now
+        self.last_used[row] = now
+        self.ids.append(point_id)
+        self.payloads.append(payload)
+
+    def remove(self, row: int) -> None:
+        """
+        Remove a row by moving the last row into its slot, keeping the matrix contiguous.
+        """
+        last = self.size - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.created_at[row] = self.created_at[last]
+            self.last_used[row] = self.last_used[last]
+            self.ids[row] = self.ids[last]
+            self.payloads[row] = self.payloads[last]
+        self.ids.pop()
+        self.payloads.pop()
+
+
+class SemanticCache:
+    def __init__(self, capacity: int, time_to_live: float, max_scopes: int = 64):
+        """
+        Initialize the in-process semantic cache tier.
+
+        Recent points of the cache collection are kept per scope (the cache query filter, e.g. the resource)
+        in a contiguous float32 matrix of unit vectors, so a lookup is a single vectorized cosine scan.
+        At most `max_scopes` scopes are kept, the least recently used scope is dropped first.
+
+        Args:
+            capacity (int): Maximum number of points kept per scope. Least recently used points are evicted first.
+            time_to_live (float): Seconds after which a point is no longer served from memory.
+            max_scopes (int, optional): Maximum number of scopes kept. Defaults to 64.
+        """
+        self.capacity = capacity
+        self.time_to_live = time_to_live
+        # Scopes do not expire as a whole, their points do
+        self._scopes: LRUCache[Hashable, _ScopeIndex] = LRUCache(max_scopes, math.inf, on_remove=self._drop_scope)
+        self._point_scopes: dict[str, Hashable] = {}
+
+    @staticmethod
+    def _normalize(embedding: list[float] | np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: Hashable, embedding: list[float] | np.ndarray, score_threshold: float) -> models.ScoredPoint | None:
+        """
+        Find the most similar cached point in the scope.
+
+        Args:
+            scope (Hashable): The cache scope to search.
+            embedding (list[float] | np.ndarray): The query embedding.
+            score_threshold (float): Minimum cosine similarity for a hit.
+
+        Returns:
+            models.ScoredPoint | None: The best matching point, or None on a miss.
+        """
+        index = self._scopes.lookup(scope)
+        if index is None or not index.size or index.matrix.shape[1] != len(embedding):
+            return None
+
+        now = time.monotonic()
+        scores = index.matrix[: index.size] @ self._normalize(embedding)
+        # Expired rows can never be served
+        scores[now - index.created_at[: index.size] > self.time_to_live] = -np.inf
+        row = int(np.argmax(scores))
+        if scores[row] < score_threshold:
+            return None
+
+        index.last_used[row] = now
+        return models.ScoredPoint(id=index.ids[row], version=0, score=float(scores[row]), payload=index.payloads[row])
+
+    def add(self, scope: Hashable, point_id: str, embedding: list[float] | np.ndarray, payload: dict[str, Any]) -> None:
+        """
+        Add or replace a point in the scope, evicting an expired or the least recently used point when full.
+
+        Args:
+            scope (Hashable): The cache scope of the point.
+            point_id (str): The point ID in the cache collection.
+            embedding (list[float] | np.ndarray): The point vector.
+            payload (dict): The point payload.
+        """
+        if self.capacity <= 0:  # pragma: no cover
+            return
+        point_id = point_key(point_id)
+        self.discard(point_id)
+        index = self._scopes.lookup(scope)
+        if index is None:
+            index = self._scopes.put(scope, _ScopeIndex(dimension=len(embedding), capacity=self.capacity))
+        elif index.matrix.shape[1] != len(embedding):  # pragma: no cover
+            return
+
+        now = time.monotonic()
+        if index.size >= self.capacity:
+            expired = np.flatnonzero(now - index.created_at[: index.size] > self.time_to_live)
+            row = int(expired[0]) if expired.size else int(np.argmin(index.last_used[: index.size]))
+            self._point_scopes.pop(index.ids[row], None)
+            index.remove(row)
+
+        index.append(self._normalize(embedding), now, point_id, payload)
+        self._point_scopes[point_id] = scope
+
+    def discard(self, point_id: str) -> None:
+        """
+        Remove a point from the cache if present.
+
+        Args:
+            point_id (str): The point ID in the cache collection.
+        """
+        point_id = point_key(point_id)
+        scope = self._point_scopes.pop(point_id, None)
+        if scope is None:
+            return
+        index = self._scopes.lookup(scope)
+        if index is not None:
+            index.remove(index.ids.index(point_id))
+
+    def _drop_scope(self, scope: Hashable, index: _ScopeIndex) -> None:
+        for point_id in index.ids:
+            self._point_scopes.pop(point_id, None)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query for exact matching: case-folded, single-spaced and without trailing punctuation.
+
+    Args:
+        query (str): The raw user query.
+
+    Returns:
+        str: The normalized query text.
+    """
+    return " ".join(query.casefold().split()).rstrip("?!. ")
+
+
+class ExactMatchCache:
+    def __init__(self, capacity: int, time_to_live: float):
+        """
+        Initialize the exact-match index of the cache collection.
+
+        Maps a (scope, response language, normalized query) key straight to a cached point, so
+        a repeated question is answered before any embedding call or vector search.
+
+        Args:
+            capacity (int): Maximum number of keys kept. Least recently used keys are evicted first.
+            time_to_live (float): Seconds after which a key is no longer served.
+        """
+        self.capacity = capacity
+        self.time_to_live = time_to_live
+        self._entries: LRUCache[Hashable, models.ScoredPoint] = LRUCache(capacity, time_to_live, on_remove=self._unlink)
+        self._point_keys: dict[str, set[Hashable]] = {}
+
+    def get(self, key: Hashable) -> models.ScoredPoint | None:
+        """
+        Get the cached point for the key.
+
+        Args:
+            key (Hashable): The exact-match key.
+
+        Returns:
+            models.ScoredPoint | None: The cached point, or None on a miss.
+        """
+        return self._entries.lookup(key)
+
+    def add(self, key: Hashable, point_id: str, payload: dict[str, Any]) -> None:
+        """
+        Map the key to a cached point.
+
+        Args:
+            key (Hashable): The exact-match key.
+            point_id (str): The point ID in the cache collection.
+            payload (dict): The point payload.
+        """
+        point_id = point_key(point_id)
+        self._entries.put(key, models.ScoredPoint(id=point_id, version=0, score=1.0, payload=payload))
+        if key in self._entries:
+            self._point_keys.setdefault(point_id, set()).add(key)
+
+    def discard(self, point_id: str) -> None:
+        """
+        Remove every key that maps to the point.
+
+        Args:
+            point_id (str): The point ID in the cache collection.
+        """
+        for key in list(self._point_keys.get(point_key(point_id), ())):
+            self._entries.pop(key)
+
+    def _unlink(self, key: Hashable, point: models.ScoredPoint) -> None:
+        keys = self._point_keys.get(point_key(point.id))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._point_keys[point_key(point.id)]
@@ -0,0 +1,65 @@
+import re
+import time
+
+SENTENCE_END = re.compile(r"[.!?;:。！？\n]\s*$")
+
+
+class StreamBuffer:
+    def __init__(self, interval: float, max_chars: int, on_sentence: bool = True):
+        """
+        Initialize the buffer that coalesces LLM chunks into fewer, larger streaming events.
+
+        The first non-empty chunk is always sent at once, so the time to the first token is unchanged.
+        Later chunks are held until one of the flush conditions is met. The conditions are checked
+        when a chunk arrives, so text held during a stall of the LLM stream is sent with the next chunk
+        or when the stream ends.
+
+        Args:
+            interval (float): Seconds since the previous flush after which the buffer is flushed.
+            max_chars (int): Number of buffered characters after which the buffer is flushed.
+            on_sentence (bool, optional): Whether to flush when a chunk ends a sentence. Defaults to True.
+        """
+        self.interval = interval
+        self.max_chars = max_chars
+        self.on_sentence = on_sentence
+        self._chunks: list[str] = []
+        self._size = 0
+        self._last_flush: float | None = None
+
+    def push(self, chunk: str) -> str | None:
+        """
+        Add a chunk to the buffer.
+
+        Args:
+            chunk (str): The chunk received from the LLM.
+
+        Returns:
+            str | None: The text to send now, or None to keep buffering.
+        """
+        if not chunk:
+            # The LLM stream starts with an empty chunk, which must not use up the immediate first flush
+            return None
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        now = time.monotonic()
+        if (
+            self._last_flush is None
+            or self._size >= self.max_chars
+            or now - self._last_flush >= self.interval
+            or (self.on_sentence and SENTENCE_END.search(chunk))
+        ):
+            return self.flush(now)
+        return None
+
+    def flush(self, now: float | None = None) -> str:
+        """
+        Empty the buffer.
+
+        Returns:
+            str: The buffered text, possibly empty.
+        """
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        self._last_flush = time.monotonic() if now is None else now
+        return text
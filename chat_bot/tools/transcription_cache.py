@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .lru import TieredCache
+
+logger = logging.getLogger("chatbot")
+
+
+class DiskTranscriptionStore:
+    def __init__(self, directory: str | Path, time_to_live: float, busy_timeout: float = 1.0):
+        """
+        Initialize the on-disk transcription store.
+
+        Transcriptions are kept in an SQLite table keyed by the audio digest, so they survive restarts
+        and are shared by all uvicorn workers of the host. Its methods block on disk I/O,
+        `TranscriptionCache` calls them from a worker thread.
+
+        Args:
+            directory (str | Path): Directory holding the SQLite database.
+            time_to_live (float): Seconds after which a stored transcription is no longer served.
+            busy_timeout (float, optional): Seconds a write waits for the writers of other workers before
+                it is skipped. Defaults to 1.0.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.time_to_live = time_to_live
+
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(
+            self.directory / "transcriptions.sqlite", timeout=busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        self._index.execute(
+            "CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> str | None:
+        """
+        Get the stored transcription for the key, unless it expired.
+
+        Args:
+            key (str): The cache key, see `TranscriptionCache.key`.
+
+        Returns:
+            str | None: The transcribed text, or None if the key is not stored.
+        """
+        with self._lock:
+            record = self._index.execute(
+                "SELECT text FROM transcriptions WHERE key = ? AND created_at >= ?", (key, time.time() - self.time_to_live)
+            ).fetchone()
+        return record[0] if record else None
+
+    def put(self, key: str, text: str) -> None:
+        """
+        Store the transcription under the key, replacing an expired one. A write that cannot get the lock
+        within the busy timeout is skipped.
+
+        Args:
+            key (str): The cache key, see `TranscriptionCache.key`.
+            text (str): The transcribed text.
+        """
+        with self._lock:
+            try:
+                self._index.execute(
+                    "INSERT OR REPLACE INTO transcriptions (key, text, created_at) VALUES (?, ?, ?)", (key, text, time.time())
+                )
+            except sqlite3.OperationalError:
+                logger.warning("[Transcription Cache] Disk store busy, transcription not stored")
+
+    def close(self) -> None:
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._index.close()
+
+
+class TranscriptionCache(TieredCache[str, str]):
+    def __init__(self, max_bytes: int, time_to_live: float, disk_store: DiskTranscriptionStore | None = None):
+        """
+        Initialize the transcription cache.
+
+        Transcriptions are keyed by the transcription model and the SHA-256 digest of the decoded audio,
+        so a recording sent again, e.g. for a `re_generate`, is not sent to Whisper a second time, whether
+        it arrived base64 encoded or as binary frames. The cache is bounded by the bytes of text held.
+
+        Args:
+            max_bytes (int): Memory budget of the stored transcriptions, in bytes.
+            time_to_live (float): Seconds after which a recording is transcribed again.
+            disk_store (DiskTranscriptionStore | None, optional): Persistent tier consulted on memory misses.
+        """
+        super().__init__(max_bytes, time_to_live, size=lambda text: len(text.encode()), disk_store=disk_store)
+
+    @staticmethod
+    def key(model: str, audio: bytes | bytearray) -> str:
+        return f"{model}:{hashlib.sha256(audio).hexdigest()}"
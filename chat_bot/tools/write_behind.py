@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+from qdrant_client import AsyncQdrantClient, models
+
+logger = logging.getLogger("chatbot")
+
+
+class WriteBehindBuffer:
+    def __init__(self, client: AsyncQdrantClient, collection: str, batch_size: int, interval: float):
+        """
+        Initialize the write-behind buffer of a collection.
+
+        Points are collected across all sessions of the worker and written as one batched upsert once
+        `batch_size` points are pending or `interval` seconds after the first pending point. A point
+        counts as buffered until Qdrant has applied its upsert, so it is never missing in between.
+        The buffer is drained on shutdown.
+
+        Args:
+            client (AsyncQdrantClient): The client used to write the points.
+            collection (str): Name of the collection.
+            batch_size (int): Number of pending points that triggers a flush.
+            interval (float): Seconds after which pending points are flushed.
+        """
+        self.client = client
+        self.collection = collection
+        self.batch_size = batch_size
+        self.interval = interval
+        self._points: dict[str, models.PointStruct] = {}
+        # Points of the running flush, until Qdrant has applied them
+        self._flushing: dict[str, models.PointStruct] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, point_id: object) -> bool:
+        return point_id in self._points or point_id in self._flushing
+
+    def add(self, point: models.PointStruct) -> None:
+        """
+        Queue a point for the next batched upsert.
+
+        Args:
+            point (models.PointStruct): The point to write.
+        """
+        self._points[str(point.id)] = point
+        if len(self._points) >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._schedule_flush)
+
+    def discard(self, point_id: str) -> bool:
+        """
+        Drop a point that has not been written yet.
+
+        Args:
+            point_id (str): The point ID.
+
+        Returns:
+            bool: True if the point was still pending.
+        """
+        return self._points.pop(point_id, None) is not None
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        # Keep a reference to the task until it finishes, so it is not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """
+        Write every pending point in a single upsert. Points of a failed upsert are queued again.
+        """
+        async with self._lock:
+            if not self._points:
+                return
+            self._flushing, self._points = self._points, {}
+            points = list(self._flushing.values())
+            try:
+                await self.client.upsert(collection_name=self.collection, points=points, wait=True)
+            except Exception:
+                logger.exception("[Write-Behind] Upsert of %s points into %s failed", len(points), self.collection)
+                # Keep the points for the next flush, newer writes of the same IDs win
+                self._points = {str(point.id): point for point in points} | self._points
+                # Retry after the interval, even if no further point is added
+                if self._timer is None and not self._closed:
+                    self._timer = asyncio.get_running_loop().call_later(self.interval, self._schedule_flush)
+            finally:
+                self._flushing = {}
+
+    async def close(self) -> None:
+        """
+        Flush the pending points and wait for running flushes, so nothing is lost on shutdown.
+        """
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()